@@ -0,0 +1,143 @@
+import logging
+import importlib
+from pathlib import Path
+from collections import namedtuple
+
+from corpus_manifest import audio_durations
+
+# One record per utterance to evaluate. start_time/end_time (seconds) are
+# None when the utterance is the whole file.
+Record = namedtuple('Record', ['audio_file', 'audio_path', 'reference', 'start_time', 'end_time'])
+
+
+class CorpusAdapter:
+    """
+    Describes how the data of a corpus becomes evaluation records.
+
+    The parsing and the transcription stay in `<package>/utils.py`: an
+    adapter only knows how to call its `load_data` and `transcribe_audio`,
+    and which columns hold the audio file, the reference and the offsets.
+    Every corpus keeps its own rules for skipping an utterance (empty
+    reference, empty hypothesis...). `arguments` are the paths the adapter takes,
+    in the order given on the command line (same as the options of the
+    corpus main.py).
+    """
+    package = None
+    arguments = ('audio_path', 'text_path')
+    audio_column = 'wav_filename'
+    reference_column = 'transcript'
+    offset_columns = None  # (start, end) columns for corpora of long sessions
+    optional = 0  # trailing arguments that may be left out
+    shares_clips = False
+
+    def __init__(self, *paths):
+        if not len(self.arguments) - self.optional <= len(paths) <= len(self.arguments):
+            raise ValueError(f"{self.package} expects {', '.join(self.arguments)}")
+        self.paths = dict(zip(self.arguments, paths))
+        # CorpusManifest, used by the corpora whose load_data takes one
+        self.manifest = None
+        # seconds of the audio files, known once the records are read with a manifest
+        self.durations = None
+        # ClipIndex, used by the Common Voice releases
+        self.clips = None
+
+    @property
+    def utils(self):
+        return importlib.import_module(f'{self.package}.utils')
+
+    @property
+    def audio_root(self):
+        return Path(self.paths[self.arguments[0]])
+
+    def load_data(self, stt):
+        return self.utils.load_data(stt, self.paths['text_path'])
+
+    def audio_file(self, row):
+        return row[self.audio_column]
+
+    def transcribe(self, stt, record, logger):
+        """Result of the corpus' own `transcribe_audio`, so its skip rules apply."""
+        return self.utils.transcribe_audio(stt, record.audio_path, record.reference, logger)
+
+    def records(self, stt):
+        validation_df, _ = self.load_data(stt)
+        self.durations = audio_durations(validation_df)
+        records = []
+        for _, row in validation_df.iterrows():
+            audio_file = self.audio_file(row)
+            start_time, end_time = (row[column] for column in self.offset_columns) if self.offset_columns else (None, None)
+            records.append(Record(audio_file, self.audio_root / audio_file, row[self.reference_column], start_time, end_time))
+        return records
+
+
+class Aditu(CorpusAdapter):
+    package = 'ADITU'
+
+
+class CommonVoiceAdapter(CorpusAdapter):
+    audio_column = 'path'
+    reference_column = 'sentence'
+
+
+class CommonVoiceRelease(CommonVoiceAdapter):
+    shares_clips = True  # the releases reuse each other's hypotheses through the clip index
+
+    def transcribe(self, stt, record, logger):
+        return self.utils.transcribe_audio(stt, record.audio_path, record.reference, logger, self.clips)
+
+
+class CommonVoiceV9(CommonVoiceRelease):
+    package = 'Common_Voice_v9'
+
+
+class CommonVoiceV12(CommonVoiceRelease):
+    package = 'Common_Voice_v12'
+
+
+class CommonVoiceV15(CommonVoiceRelease):
+    package = 'Common_Voice_v15'
+
+
+class MintzaiST(CorpusAdapter):
+    package = 'MintzAI-ST'
+
+    def load_data(self, stt):
+        return self.utils.load_data(stt, Path(self.paths['text_path']), Path(self.paths['audio_path']), logging.getLogger(__name__),
+                                    manifest=self.manifest)
+
+
+class OpenSLR(CorpusAdapter):
+    package = 'OpenSLR'
+
+
+class ParlamentoEJ(CorpusAdapter):
+    package = 'Parlamento_EJ'
+    arguments = ('db_directory',)
+
+    def load_data(self, stt):
+        return self.utils.load_data(stt, self.audio_root, manifest=self.manifest)
+
+
+class TtsDB(CorpusAdapter):
+    package = 'TTS_DB'
+    optional = 1  # without text_path the audio directory also holds the transcriptions
+
+    def load_data(self, stt):
+        if self.paths.get('text_path'):
+            return self.utils.load_data(stt, self.paths['text_path'], self.paths['audio_path'], manifest=self.manifest)
+        return self.utils.load_data(stt, combined_path=self.paths['audio_path'], manifest=self.manifest)
+
+
+class BancoVoces(CorpusAdapter):
+    package = 'banco_voces_corpus'
+    arguments = ('directory',)
+    audio_column = 'audio_filepath'
+    reference_column = 'text'
+
+    def load_data(self, stt):
+        return self.utils.load_data(stt, self.audio_root)
+
+
+ADAPTERS = {adapter.package: adapter for adapter in (
+    Aditu, CommonVoiceV9, CommonVoiceV12, CommonVoiceV15, MintzaiST, OpenSLR, ParlamentoEJ, TtsDB, BancoVoces,
+)}
@@ -0,0 +1,50 @@
+import os
+
+from model_config_xz import STT_MODELS, INSTALL_DIR
+
+# only the standard library and the model config are imported at module level,
+# the `--check` of every main.py must stay cheap
+
+# argparse dests of the main.py options that name files or directories
+PATH_ARGUMENTS = ('audio_path', 'text_path', 'db_directory', 'directory', 'audio_list', 'delta_from')
+
+
+def check_inputs(args, language_code):
+    """
+    Validates the arguments of a main.py without loading the model or the data.
+
+    :param args: parsed `argparse.Namespace` of the main.py.
+    :param language_code: (str) key of `STT_MODELS` the script runs with.
+    :return: exit status, 0 when the run can start.
+    """
+    errors = []
+    for name in PATH_ARGUMENTS:
+        values = getattr(args, name, None) or []
+        # nargs='+' options hold a list of paths
+        for value in values if isinstance(values, list) else [values]:
+            if not os.path.exists(value):
+                errors.append(f"--{name.replace('_', '-')}: {value} does not exist")
+    if getattr(args, 'workers', 1) < 1:
+        errors.append('--workers must be at least 1')
+
+    if language_code not in STT_MODELS:
+        errors.append(f'Unknown language: {language_code}')
+    elif getattr(args, 'daemon', None):
+        from stt_daemon import wait_ready
+        if not wait_ready(args.daemon, 1):
+            errors.append(f'No STT daemon answering on {args.daemon}')
+    else:
+        from model_registry import resolve_model
+        if resolve_model(INSTALL_DIR, STT_MODELS[language_code]) is None:
+            if getattr(args, 'rescore_only', False):
+                # the cache keys need the registry checksums
+                errors.append(f"{STT_MODELS[language_code]['name']} is not in the local model registry, --rescore-only needs it")
+            else:
+                # not an error, STT falls back to ModelManager
+                print(f"{STT_MODELS[language_code]['name']} is not in the local model registry, it will be resolved with ModelManager.")
+
+    for error in errors:
+        print(f'ERROR: {error}')
+    if not errors:
+        print('OK')
+    return 1 if errors else 0
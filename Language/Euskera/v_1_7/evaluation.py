@@ -0,0 +1,171 @@
+import os
+import argparse
+import logging
+
+from model_config_xz import *
+from logger_config import setup_file_logging
+from clip_index import DEFAULT_PATH as DEFAULT_CLIP_INDEX
+
+# Evaluates several corpora in one process: the model is loaded once, the
+# decoded PCM cache and the worker pool are shared, and every corpus only
+# contributes its records through an adapter (see adapters.py).
+
+
+def results_path(stt, output_dir, corpus, fmt='csv'):
+    model_name = stt.config['name'].replace(' ', '_').replace('.', '_')
+    return os.path.join(output_dir, f"{model_name}_{corpus}.{fmt}")
+
+
+def evaluate_corpus(stt, corpus, adapter, records, results, logger):
+    """
+    Transcribes and scores the records of one corpus into its `ResultsSink`,
+    through the `transcribe_audio` of the corpus.
+    """
+    from tqdm import tqdm
+    from worker_pool import completion_order, request_key
+
+    keys = [request_key(record.audio_path, record.start_time, record.end_time) for record in records]
+    if stt.vocabulary is not None:
+        from wer_kernel import Vocabulary
+        # word ids of one corpus, as in its own --rescore-only run
+        stt.vocabulary = Vocabulary()
+    for position in tqdm(completion_order(stt, keys), total=len(records), desc=corpus):
+        record, key = records[position], keys[position]
+        if key in results:
+            continue
+        result = adapter.transcribe(stt, record, logger)
+        if result is not None:
+            wer, word_count, reference_transformed, hypothesis_transformed, error_count, *edits = result
+            results.append([str(record.audio_file), reference_transformed, hypothesis_transformed, wer, word_count, error_count, *edits], key)
+            logger.info(f"{corpus} {record.audio_file}: WER {wer} ({error_count}/{word_count})")
+    results.close(order=keys)
+    if adapter.clips is not None:
+        logger.info(f"{corpus}: {adapter.clips.hits} clips reused from the clip index {adapter.clips.path}")
+    return results
+
+
+def evaluate(stt, corpora, output_dir, workers=1, resume=False, results_format='csv', logger=logging):
+    """
+    Evaluates a list of corpora with one loaded model.
+
+    :param corpora: list of (name, adapter) pairs.
+    :param output_dir: directory of the per utterance results, one file per corpus.
+    :param workers: (int) processes transcribing, the pool is shared by every corpus.
+    :param resume: (bool) keep the utterances already in the per utterance results.
+    :return: dict of `ResultsSink` by corpus and a dataframe with one summary row per corpus.
+    """
+    import pandas as pd
+    from worker_pool import pooled, request_key
+    from results_sink import ResultsSink
+
+    # every record is known before transcribing, so the pool never drains between corpora
+    records = {name: adapter.records(stt) for name, adapter in corpora}
+    results = {}
+    requests = []
+    durations = {}
+    for name, adapter in corpora:
+        results[name] = ResultsSink(results_path(stt, output_dir, name, results_format), resume)
+        if resume:
+            logger.info(f"Resuming {name}: {len(results[name])} utterances already done")
+        pending = results[name].pending([request_key(record.audio_path, record.start_time, record.end_time)
+                                         for record in records[name] if record.reference and record.reference.strip()])
+        if adapter.clips is not None:
+            pending = [key for key in pending if adapter.clips.get(key[0]) is None]
+            adapter.clips.hits = 0
+        requests += pending
+        durations.update(adapter.durations or {})
+    stt = pooled(stt, requests, workers, durations=durations, logger=logger)
+
+    summary = []
+    for name, adapter in corpora:
+        total_words = stt.transformation.count_words(pd.Series([record.reference for record in records[name] if record.reference], dtype=object))
+        corpus_results = evaluate_corpus(stt, name, adapter, records[name], results[name], logger)
+        total_errors = corpus_results.total_errors
+        wwer = total_errors / total_words if total_words else 0.0
+        summary.append({
+            'model': stt.config['name'].replace(" ", "_"),
+            'language': stt.lang,
+            'database': name,
+            'total_audios': len(records[name]),
+            'total_words': total_words,
+            'total_errors': total_errors,
+            'wwer': wwer,
+            'mean_wer': corpus_results.mean_wer,
+        })
+        logger.info(f"{name}: {len(records[name])} audios, {total_words} words, {total_errors} errors, WWER {wwer}")
+        logger.info(f"Results of {name} saved in {os.path.abspath(corpus_results.path)}")
+    return results, pd.DataFrame(summary)
+
+
+def save_summary(stt, summary_df, output_dir, logger):
+    model_name = stt.config['name'].replace(' ', '_').replace('.', '_')
+    file_name = os.path.join(output_dir, f"{model_name}_summary.csv")
+    summary_df.to_csv(file_name, index=False)
+    logger.info(f"Summary saved in {os.path.abspath(file_name)}")
+
+
+def main():
+    from adapters import ADAPTERS
+
+    parser = argparse.ArgumentParser(description="Evaluate one model on several corpora in a single run.")
+    parser.add_argument('-c', '--corpus', nargs='+', action='append', required=True, metavar=('NAME', 'PATH'),
+                        help=f"Corpus and its paths, in the order of its main.py options. Repeat for every corpus. One of: {', '.join(ADAPTERS)}")
+    parser.add_argument('-l', '--language', default=next(iter(STT_MODELS)), choices=STT_MODELS.keys(), help='Language of the model.')
+    parser.add_argument('-o', '--output', default='evaluation', help='Directory for the results and the log.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes transcribing in parallel, each one loads its own model.')
+    parser.add_argument('--results-format', choices=('csv', 'parquet'), default='csv', help='Format of the per utterance results of every corpus.')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted run from its per utterance results, skipping the utterances already done.')
+    parser.add_argument('--clip-index', default=DEFAULT_CLIP_INDEX, help='SQLite index of the clips already transcribed in any Common Voice release, shared by v9, v12 and v15.')
+    parser.add_argument('--no-clip-index', action='store_true', help='Transcribe every Common Voice clip, without the clip index.')
+    parser.add_argument('--daemon', metavar='SOCKET', help='Unix socket of a running stt_daemon.py, the model is then not loaded by this script.')
+    parser.add_argument('--rescore-only', action='store_true', help='Recompute WER and WWER from the cached hypotheses, without loading the model.')
+    parser.add_argument('--no-manifest', action='store_true', help='Read the transcripts and list the audio files again, without the corpus manifests.')
+    parser.add_argument('--refresh-manifest', action='store_true', help='Rebuild the corpus manifests from the transcripts, only the audio files whose size or mtime changed are probed again.')
+    args = parser.parse_args()
+    if args.refresh_manifest and args.no_manifest:
+        parser.error('--refresh-manifest needs the corpus manifests')
+
+    corpora = []
+    for name, *paths in args.corpus:
+        if name not in ADAPTERS:
+            parser.error(f"Unknown corpus {name}, choose one of: {', '.join(ADAPTERS)}")
+        try:
+            corpora.append((name, ADAPTERS[name](*paths)))
+        except ValueError as e:
+            parser.error(str(e))
+
+    os.makedirs(args.output, exist_ok=True)
+    logger = setup_file_logging(os.path.join(args.output, f'evaluation_{args.language}.log'))
+
+    if not args.no_manifest:
+        from corpus_manifest import CorpusManifest
+        # per language, Parlamento_EJ spells out the numbers of its references in the language of the model
+        for name, adapter in corpora:
+            adapter.manifest = CorpusManifest(os.path.join(args.output, 'manifests', f'{name}_{args.language}.parquet'), refresh=args.refresh_manifest)
+
+    from stt_class_xz import STT
+    from stt_daemon import STTClient
+    if args.rescore_only:
+        stt = STT(args.language, rescore_only=True)
+    else:
+        stt = STTClient(args.daemon, args.language) if args.daemon else STT(args.language)
+
+    if not args.no_clip_index and any(adapter.shares_clips for _, adapter in corpora):
+        from clip_index import ClipIndex
+        clips = ClipIndex(args.clip_index, stt.config['name'], stt.decoder_config())
+        for _, adapter in corpora:
+            if adapter.shares_clips:
+                adapter.clips = clips
+
+    _, summary_df = evaluate(stt, corpora, args.output, args.workers, args.resume, args.results_format, logger)
+    save_summary(stt, summary_df, args.output, logger)
+    print(summary_df.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
+
+# run:
+# python3 evaluation.py -w 16 \
+#     -c Common_Voice_v12 /mnt/corpus/cv12/eu/clips /mnt/corpus/cv12/eu/test.tsv \
+#     -c ADITU /mnt/corpus/ADITU/wav /mnt/corpus/ADITU/spl \
+#     -c banco_voces_corpus /mnt/corpus/banco_voces
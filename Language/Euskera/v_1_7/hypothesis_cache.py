@@ -0,0 +1,81 @@
+import os
+import json
+import math
+import sqlite3
+import hashlib
+
+from model_registry import file_sha256
+
+# Raw hypotheses of previous runs, so that a change in the normalization or in
+# the reporting does not need the model again. An entry is keyed by
+# everything that can change the output of `model.stt`: the content of the
+# audio file, the segment taken from it, the checksums of the acoustic model
+# and the scorer and the decoder parameters. Content hashes of the audio
+# files are kept in the same database and only recomputed when the size or
+# the mtime of a file changes.
+
+
+class HypothesisNotCached(LookupError):
+    """Raised by `STT.run` in rescore-only mode when an utterance was never transcribed."""
+
+
+def segment_offset(value):
+    # same rounding as the checkpoint keys, NaN offsets from a csv are None
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return round(float(value), 3)
+
+
+class HypothesisCache:
+    """
+    SQLite store of raw hypotheses, shared by every run and process.
+
+    :param path: database file.
+    :param decoder: dict with the model checksums and decoder parameters the
+        hypotheses depend on, see `STT.decoder_config`.
+    """
+
+    def __init__(self, path, decoder):
+        self.path = str(path)
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.decoder = json.dumps(decoder, sort_keys=True)
+        # the daemon uses one STT from several threads, always under a lock
+        self.connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS hypotheses (key TEXT PRIMARY KEY, text TEXT NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS audio_files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT)')
+        self.connection.commit()
+
+    def audio_digest(self, audio_path):
+        """sha256 of the file content, computed once per size and mtime."""
+        audio_path = os.path.abspath(str(audio_path))
+        stat = os.stat(audio_path)
+        row = self.connection.execute('SELECT size, mtime_ns, sha256 FROM audio_files WHERE path = ?', (audio_path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        digest = file_sha256(audio_path)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO audio_files VALUES (?, ?, ?, ?)',
+                                    (audio_path, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def key(self, audio_path, start_time=None, end_time=None, stream=False):
+        segmentation = {'start_time': segment_offset(start_time), 'end_time': segment_offset(end_time), 'stream': stream}
+        payload = json.dumps([self.decoder, self.audio_digest(audio_path), segmentation], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        row = self.connection.execute('SELECT text FROM hypotheses WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key, text):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO hypotheses VALUES (?, ?)', (key, text))
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM hypotheses').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+import logging
+import argparse
+
+MANIFEST_NAME = 'model_registry.json'
+
+# Local manifest of the models already under INSTALL_DIR, so that STT can find
+# its .tflite and .scorer files without going through ModelManager. Entries
+# are keyed by model name and remember the URLs they were downloaded from,
+# the absolute file paths, their size, mtime and sha256.
+
+
+class ModelFiles:
+    """Resolved model, with the same path attributes as a ModelManager card."""
+
+    def __init__(self, name, acoustic_path, scorer_path=None, acoustic_sha256=None, scorer_sha256=None):
+        self.name = name
+        self.acoustic_path = acoustic_path
+        self.scorer_path = scorer_path
+        # the checksums identify the model in the hypothesis cache
+        self.acoustic_sha256 = acoustic_sha256
+        self.scorer_sha256 = scorer_sha256
+
+
+def manifest_path(install_dir):
+    return os.path.join(install_dir, MANIFEST_NAME)
+
+
+def load_manifest(install_dir):
+    try:
+        with open(manifest_path(install_dir), 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_manifest(install_dir, manifest):
+    path = manifest_path(install_dir)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=4, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def describe_file(path):
+    stat = os.stat(path)
+    return {
+        'path': os.path.abspath(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(path),
+    }
+
+
+def check_file(entry, verify=False):
+    """Size and mtime are enough on the fast path, `verify` recomputes the checksum."""
+    try:
+        stat = os.stat(entry['path'])
+    except OSError:
+        return False
+    if stat.st_size != entry['size']:
+        return False
+    if verify or stat.st_mtime_ns != entry['mtime_ns']:
+        return file_sha256(entry['path']) == entry['sha256']
+    return True
+
+
+def resolve_model(install_dir, config, verify=False):
+    """
+    Looks a model up in the manifest, without network or ModelManager.
+
+    :param config: entry of `STT_MODELS`.
+    :param verify: (bool) recompute the sha256 of the files instead of trusting size and mtime.
+    :return: `ModelFiles`, or None when the model is not registered, its URLs
+        changed or its files are missing or modified.
+    """
+    entry = load_manifest(install_dir).get(config['name'])
+    if entry is None or entry['acoustic']['url'] != config['acoustic']:
+        return None
+    if not check_file(entry['acoustic'], verify):
+        return None
+
+    scorer_path = scorer_sha256 = None
+    if 'scorer' in config:
+        scorer = entry.get('scorer')
+        if scorer is None or scorer['url'] != config['scorer'] or not check_file(scorer, verify):
+            return None
+        scorer_path, scorer_sha256 = scorer['path'], scorer['sha256']
+    return ModelFiles(config['name'], entry['acoustic']['path'], scorer_path, entry['acoustic']['sha256'], scorer_sha256)
+
+
+def register_model(install_dir, config, acoustic_path, scorer_path=None):
+    """Adds (or refreshes) a downloaded model in the manifest."""
+    manifest = load_manifest(install_dir)
+    entry = {'version': config.get('version'), 'acoustic': describe_file(acoustic_path)}
+    entry['acoustic']['url'] = config['acoustic']
+    if scorer_path is not None and 'scorer' in config:
+        entry['scorer'] = describe_file(scorer_path)
+        entry['scorer']['url'] = config['scorer']
+    manifest[config['name']] = entry
+    save_manifest(install_dir, manifest)
+    logging.info('Registered %s in %s', config['name'], manifest_path(install_dir))
+    scorer = entry.get('scorer', {})
+    return ModelFiles(config['name'], entry['acoustic']['path'], scorer.get('path'), entry['acoustic']['sha256'], scorer.get('sha256'))
+
+
+def main():
+    from model_config_xz import STT_MODELS
+    from model_config_xz import INSTALL_DIR
+    from stt_class_xz import STT
+
+    parser = argparse.ArgumentParser(description="Build the local model manifest from STT_MODELS.")
+    parser.add_argument('--verify', action='store_true', help='Recompute the checksums of the registered files.')
+    args = parser.parse_args()
+
+    for lang, config in STT_MODELS.items():
+        model = resolve_model(INSTALL_DIR, config, verify=args.verify)
+        if model is not None:
+            print(f"{lang}: {config['name']} OK ({model.acoustic_path})")
+            continue
+        # downloads through ModelManager if needed and registers the files
+        print(f"{lang}: {config['name']} missing or changed, resolving it with ModelManager")
+        stt = STT.__new__(STT)
+        stt.lang, stt.config = lang, config
+        stt.download()
+
+if __name__ == "__main__":
+    main()
+
+# run (from the language directory, once per node or after changing model_config_xz.py):
+# python3 model_registry.py
+# python3 model_registry.py --verify
@@ -9,8 +9,10 @@ fi
 
 use_nohup=false
 parent_directory=""
+daemon_socket=""
+resume_args=""
 
-while getopts ":p:n" opt; do
+while getopts ":p:nd:r" opt; do
   case $opt in
     p)
       parent_directory="$OPTARG"
@@ -18,6 +20,12 @@ while getopts ":p:n" opt; do
     n)
       use_nohup=true
       ;;
+    d)
+      daemon_socket="$OPTARG"
+      ;;
+    r)
+      resume_args="--resume"
+      ;;
     \?)
       echo "Invalid option: -$OPTARG" >&2
       exit 1
@@ -35,6 +43,21 @@ if [ -z "$parent_directory" ]; then
     exit 1
 fi
 
+# Keep the model loaded in one daemon instead of loading it for every directory
+daemon_args=""
+if [ -n "$daemon_socket" ]; then
+    if ! python3 stt_daemon.py --socket "$daemon_socket" --wait 1; then
+        python3 stt_daemon.py --socket "$daemon_socket" --languages eu &
+        daemon_pid=$!
+        trap 'kill $daemon_pid' EXIT
+        if ! python3 stt_daemon.py --socket "$daemon_socket" --wait 600; then
+            echo "STT daemon did not start on $daemon_socket"
+            exit 1
+        fi
+    fi
+    daemon_args="--daemon $daemon_socket"
+fi
+
 # Iterate through each 'BLOCK' directory and its 'SES' subdirectories
 for block_directory in "$parent_directory"/*; do
     if [ -d "$block_directory" ]; then
@@ -48,10 +71,10 @@ for block_directory in "$parent_directory"/*; do
                 echo "Processing directory: $ses_directory"
                 if $use_nohup; then
                     mkdir -p "$log_folder" # Create log directory if it doesn't exist
-                    nohup python3 -m ADITU.main -a "$ses_directory" -t "$ses_directory" > "$log_path" 2>&1 &
-                    wait # Wait for the background process to finish before continuing
+                    nohup python3 -m ADITU.main -a "$ses_directory" -t "$ses_directory" $daemon_args $resume_args > "$log_path" 2>&1 &
+                    wait $! # Wait for this job only, the daemon started above is a background process too
                 else
-                    python3 -m ADITU.main -a "$ses_directory" -t "$ses_directory"
+                    python3 -m ADITU.main -a "$ses_directory" -t "$ses_directory" $daemon_args $resume_args
                 fi
             fi
         done
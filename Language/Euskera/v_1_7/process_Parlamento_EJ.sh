@@ -8,9 +8,12 @@ if [[ $CONDA_DEFAULT_ENV != "stt" ]]; then
 fi
 
 use_nohup=false
+stream_args=""
 parent_directory=""
+daemon_socket=""
+resume_args=""
 
-while getopts ":p:n" opt; do
+while getopts ":p:nsd:r" opt; do
   case $opt in
     p)
       parent_directory="$OPTARG"
@@ -18,6 +21,15 @@ while getopts ":p:n" opt; do
     n)
       use_nohup=true
       ;;
+    d)
+      daemon_socket="$OPTARG"
+      ;;
+    s)
+      stream_args="--stream"
+      ;;
+    r)
+      resume_args="--resume"
+      ;;
     \?)
       echo "Invalid option: -$OPTARG" >&2
       exit 1
@@ -35,6 +47,21 @@ if [ -z "$parent_directory" ]; then
     exit 1
 fi
 
+# Keep the model loaded in one daemon instead of loading it for every directory
+daemon_args=""
+if [ -n "$daemon_socket" ]; then
+    if ! python3 stt_daemon.py --socket "$daemon_socket" --wait 1; then
+        python3 stt_daemon.py --socket "$daemon_socket" --languages eu &
+        daemon_pid=$!
+        trap 'kill $daemon_pid' EXIT
+        if ! python3 stt_daemon.py --socket "$daemon_socket" --wait 600; then
+            echo "STT daemon did not start on $daemon_socket"
+            exit 1
+        fi
+    fi
+    daemon_args="--daemon $daemon_socket"
+fi
+
 # Iterate through each sub-directory and its subdirectories
 for sub_directory in "$parent_directory"/*; do
     if [ -d "$sub_directory" ]; then
@@ -48,10 +75,10 @@ for sub_directory in "$parent_directory"/*; do
                 echo "Processing directory: $nested_sub_directory"
                 if $use_nohup; then
                     mkdir -p "$log_folder" # Create log directory if it doesn't exist
-                    nohup python3 -m Parlamento_EJ.main -d "$nested_sub_directory" > "$log_path" 2>&1 &
-                    wait # Wait for the background process to finish before continuing
+                    nohup python3 -m Parlamento_EJ.main -d "$nested_sub_directory" $stream_args $daemon_args $resume_args > "$log_path" 2>&1 &
+                    wait $! # Wait for this job only, the daemon started above is a background process too
                 else
-                    python3 -m Parlamento_EJ.main -d "$nested_sub_directory"
+                    python3 -m Parlamento_EJ.main -d "$nested_sub_directory" $stream_args $daemon_args $resume_args
                 fi
             fi
         done
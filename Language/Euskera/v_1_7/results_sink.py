@@ -0,0 +1,254 @@
+import os
+import csv
+import math
+import time
+import heapq
+import tempfile
+from itertools import islice
+from operator import itemgetter
+
+import pandas as pd
+
+COLUMNS = ('audio_file', 'reference', 'hypothesis', 'wer', 'words', 'errors', 'substitutions', 'deletions', 'insertions')
+# request_key of the utterance, used to resume an interrupted run
+KEY_COLUMNS = ('audio_path', 'start_time', 'end_time')
+FORMATS = ('csv', 'parquet')
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_FLUSH_SECONDS = 60
+SORT_RUN_ROWS = 20000  # rows sorted in memory at once by `ResultsSink.sort`
+
+# Per utterance results of a run. Rows are buffered column by column and
+# appended to a csv every `chunk_size` rows or `flush_seconds`, so a 100k clip
+# corpus never lives in a dataframe; the corpus totals are running sums
+# updated on every row.
+#
+# The csv is also the checkpoint of the run: with `resume` the rows already
+# written are read back, the totals rebuilt from them and their keys skipped.
+# Parquet is only readable once its writer is closed, so a parquet run streams
+# to `<path>.partial.csv` and converts it on `close`.
+#
+# A pooled run appends the rows as the workers finish them, `close(order)`
+# puts them back in the order of the dataframe.
+
+
+def utterances_path(results_file, fmt='csv'):
+    """Per utterance file next to the summary csv written by `save_final_results`."""
+    root, _ = os.path.splitext(results_file)
+    return f'{root}_utterances.{fmt}'
+
+
+def checkpoint_key(audio_path, start_time=None, end_time=None):
+    """Same key as `worker_pool.request_key`, stable across a csv round trip (NaN offsets, float precision)."""
+    def offset(value):
+        return None if value is None or pd.isna(value) else round(float(value), 3)
+    return str(audio_path), offset(start_time), offset(end_time)
+
+
+def read_rows(csv_path, chunk_size):
+    # text columns stay strings ("nan", "null" are words), only empty offsets are missing
+    offsets = KEY_COLUMNS[1:]
+    return pd.read_csv(csv_path, chunksize=chunk_size, keep_default_na=False,
+                       na_values={column: [''] for column in offsets}, dtype={column: float for column in offsets})
+
+
+class ResultsSink:
+    """
+    Append-only writer of the per utterance results.
+
+    :param path: csv or parquet file (chosen by extension), truncated on the
+        first flush unless resuming. None keeps only the totals.
+    :param resume: (bool) keep the rows of a previous run of the same file.
+    :param chunk_size: (int) rows buffered before writing.
+    :param flush_seconds: (float) longest time a row stays only in memory.
+    """
+
+    def __init__(self, path=None, resume=False, columns=COLUMNS, chunk_size=DEFAULT_CHUNK_SIZE, flush_seconds=DEFAULT_FLUSH_SECONDS):
+        self.path = None if path is None else str(path)
+        self.columns = list(columns) + list(KEY_COLUMNS)
+        self.chunk_size = chunk_size
+        self.flush_seconds = flush_seconds
+        self.parquet = self.path is not None and self.path.endswith('.parquet')
+        self.csv_path = f'{self.path}.partial.csv' if self.parquet else self.path
+        self.buffer = {column: [] for column in self.columns}
+        self.buffered = 0
+        self.flushed = 0
+        self.last_flush = time.monotonic()
+        self.done = set()
+
+        self.total_audios = 0
+        self.total_words = 0
+        self.total_errors = 0
+        self.wer_sum = 0.0
+        self.total_substitutions = 0
+        self.total_deletions = 0
+        self.total_insertions = 0
+
+        if self.path is not None and os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if resume and self.path is not None:
+            self.load_checkpoint()
+
+    def __len__(self):
+        return self.total_audios
+
+    def __contains__(self, key):
+        return checkpoint_key(*key) in self.done
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def mean_wer(self):
+        # same as results_df['wer'].mean(), NaN when nothing was transcribed
+        return self.wer_sum / self.total_audios if self.total_audios else math.nan
+
+    def load_checkpoint(self):
+        if os.path.exists(self.csv_path):
+            chunks, rewrite = read_rows(self.csv_path, self.chunk_size), False
+        elif self.parquet and os.path.exists(self.path):
+            # finished parquet run, its rows go back to the partial csv
+            chunks, rewrite = [pd.read_parquet(self.path)], True
+        else:
+            return
+        for chunk in chunks:
+            if list(chunk.columns) != self.columns:
+                raise ValueError(f'{self.path} does not have the columns {", ".join(self.columns)}, it can not be resumed.')
+            self.total_audios += len(chunk)
+            self.total_words += int(chunk['words'].sum())
+            self.total_errors += int(chunk['errors'].sum())
+            self.wer_sum += float(chunk['wer'].sum())
+            self.total_substitutions += int(chunk['substitutions'].sum())
+            self.total_deletions += int(chunk['deletions'].sum())
+            self.total_insertions += int(chunk['insertions'].sum())
+            self.done.update(checkpoint_key(*key) for key in chunk[list(KEY_COLUMNS)].itertuples(index=False))
+            if rewrite:
+                chunk.to_csv(self.csv_path, mode='a' if self.flushed else 'w', header=not self.flushed, index=False, columns=self.columns)
+            self.flushed += len(chunk)
+
+    def pending(self, keys):
+        """The `request_key`s not in the checkpoint, for `pooled`."""
+        return [key for key in keys if key not in self]
+
+    def append(self, row, key):
+        """
+        Adds one row.
+
+        :param row: values in the order of `COLUMNS`.
+        :param key: `request_key` of the utterance.
+        """
+        key = checkpoint_key(*key)
+        for column, value in zip(self.columns, list(row) + list(key)):
+            self.buffer[column].append(value)
+        self.buffered += 1
+        self.done.add(key)
+
+        self.total_audios += 1
+        self.total_words += self.buffer['words'][-1]
+        self.total_errors += self.buffer['errors'][-1]
+        self.wer_sum += self.buffer['wer'][-1]
+        self.total_substitutions += self.buffer['substitutions'][-1]
+        self.total_deletions += self.buffer['deletions'][-1]
+        self.total_insertions += self.buffer['insertions'][-1]
+
+        if self.buffered >= self.chunk_size or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self, force=False):
+        if (self.buffered or force) and self.path is not None:
+            first = self.flushed == 0
+            chunk = pd.DataFrame(self.buffer, columns=self.columns)
+            chunk.to_csv(self.csv_path, mode='w' if first else 'a', header=first, index=False)
+            self.flushed += self.buffered
+        self.buffer = {column: [] for column in self.columns}
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+
+    def write_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        tmp_path = f'{self.path}.tmp'
+        for chunk in read_rows(self.csv_path, self.chunk_size):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            else:
+                # a chunk may infer narrower types (e.g. all-int wer)
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+        if writer is None:
+            pd.DataFrame(columns=self.columns).to_parquet(tmp_path, index=False)
+        else:
+            writer.close()
+        os.replace(tmp_path, self.path)
+        os.remove(self.csv_path)
+
+    def sort(self, order):
+        """
+        Rewrites the rows in the order of `order`, a list of `request_key`s.
+        Rows of other keys go last, and a file already in order is left as it is.
+
+        Runs of `SORT_RUN_ROWS` rows are sorted into temporary files and merged,
+        the rows are never all in memory. They are read and written as text, so
+        their values are not reformatted.
+        """
+        if self.path is None or not os.path.exists(self.csv_path):
+            return
+        rank = {}
+        for key in order:
+            rank.setdefault(checkpoint_key(*key), len(rank))
+
+        with open(self.csv_path, newline='') as csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader)
+            offsets = [header.index(column) for column in KEY_COLUMNS]
+
+            def position(row):
+                audio_path, start_time, end_time = (row[offset] for offset in offsets)
+                return rank.get(checkpoint_key(audio_path, start_time or None, end_time or None), len(rank))
+
+            previous = -1
+            for row in reader:
+                current = position(row)
+                if current < previous:
+                    break
+                previous = current
+            else:
+                return
+
+        runs = []
+        try:
+            with open(self.csv_path, newline='') as csv_file:
+                reader = csv.reader(csv_file)
+                next(reader)
+                while True:
+                    run = sorted(((position(row), row) for row in islice(reader, SORT_RUN_ROWS)), key=itemgetter(0))
+                    if not run:
+                        break
+                    runs.append(tempfile.TemporaryFile('w+', newline=''))
+                    csv.writer(runs[-1], lineterminator='\n').writerows([current, *row] for current, row in run)
+                    runs[-1].seek(0)
+            tmp_path = f'{self.csv_path}.tmp'
+            with open(tmp_path, 'w', newline='') as csv_file:
+                writer = csv.writer(csv_file, lineterminator='\n')
+                writer.writerow(header)
+                # merge keeps the order of the runs on ties, rows of unknown keys stay in file order
+                merged = heapq.merge(*(csv.reader(run) for run in runs), key=lambda row: int(row[0]))
+                writer.writerows(row[1:] for row in merged)
+            os.replace(tmp_path, self.csv_path)
+        finally:
+            for run in runs:
+                run.close()
+
+    def close(self, order=None):
+        """:param order: `request_key`s in the order the rows are written in, see `sort`."""
+        # an empty run still leaves a file with the columns
+        self.flush(force=self.flushed == 0)
+        if order is not None:
+            self.sort(order)
+        if self.parquet:
+            self.write_parquet()
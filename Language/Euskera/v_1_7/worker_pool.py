@@ -0,0 +1,323 @@
+import os
+import time
+import logging
+import functools
+from collections import Counter, defaultdict, deque
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from audio_io import audio_info, slice_segment
+
+DEFAULT_BATCH_SIZE = 8  # files per task
+DEFAULT_BATCH_SECONDS = 120  # seconds of audio per task, a longer file is a task of its own
+DEFAULT_RECYCLE_AFTER = 500  # files a worker transcribes before it is replaced
+MIN_TASKS_PER_WORKER = 4  # smaller tasks on small corpora, so the long files do not share one
+PROBE_THREADS = 16  # threads reading the audio headers for the schedule
+
+_worker_stt = None
+_worker_stream = False
+
+
+def _init_worker(stt_factory, stream):
+    global _worker_stt, _worker_stream
+    _worker_stt = stt_factory()
+    _worker_stream = stream
+
+
+def _run_batch(batch):
+    # every (audio_path, start_time, end_time) request of a batch, decoding each file once
+    started = time.time()
+    results = []
+    loaded_path = None
+    audio = None
+    sample_rate = _worker_stt.sample_rate()
+    for key in batch:
+        audio_path, start_time, end_time = key
+        try:
+            if _worker_stream:
+                text = _worker_stt.run_stream(audio_path)
+            else:
+                if audio_path != loaded_path:
+                    audio = _worker_stt.load_audio(audio_path)
+                    loaded_path = audio_path
+                if start_time is not None and end_time is not None:
+                    text = _worker_stt.run_audio(slice_segment(audio, sample_rate, start_time, end_time))
+                else:
+                    text = _worker_stt.run_audio(audio)
+        except Exception as error:
+            # raised again in the main process, where transcribe_audio handles it
+            text = error
+        results.append((key, text))
+    return results, (os.getpid(), started, time.time())
+
+
+def request_key(audio_path, start_time=None, end_time=None):
+    return str(audio_path), start_time, end_time
+
+
+def make_batches(requests, batch_size=DEFAULT_BATCH_SIZE, costs=None, batch_seconds=DEFAULT_BATCH_SECONDS):
+    """
+    Groups requests into tasks of `batch_size` files, segments of a file stay together.
+
+    :param costs: seconds of audio of every request, see `request_costs`. Files
+        are then sent longest first, and a task holds files of similar
+        durations up to `batch_seconds` of audio.
+    """
+    by_file = {}
+    for key in requests:
+        by_file.setdefault(key[0], []).append(key)
+    files = list(by_file.values())
+    if costs is None:
+        return [sum(files[i:i + batch_size], []) for i in range(0, len(files), batch_size)]
+
+    # longest processing time first: the long files start while every worker
+    # is free, the short ones fill the gaps at the end
+    seconds = [sum(costs.get(key, 0) for key in keys) for keys in files]
+    batches, batch, batch_files, total = [], [], 0, 0
+    for index in sorted(range(len(files)), key=seconds.__getitem__, reverse=True):
+        if batch and (batch_files == batch_size or total + seconds[index] > batch_seconds):
+            batches.append(batch)
+            batch, batch_files, total = [], 0, 0
+        batch += files[index]
+        batch_files += 1
+        total += seconds[index]
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def probe_duration(audio_path):
+    try:
+        return audio_info(audio_path).duration
+    except (OSError, ValueError):
+        # missing files are left to the workers, transcribe_audio reports them
+        return None
+
+
+def request_costs(requests, durations=None, threads=PROBE_THREADS):
+    """
+    Seconds of audio of every request, to schedule the pool.
+
+    :param durations: seconds of the audio files by path, e.g. `audio_durations`
+        of a corpus manifest. The other files have their header read by a pool
+        of threads, segments take their own length.
+    :return: dict of seconds by request key, 0 when unknown.
+    """
+    known = {os.path.normpath(str(path)): seconds for path, seconds in (durations or {}).items()}
+    unknown = list(dict.fromkeys(key[0] for key in requests
+                                 if (key[1] is None or key[2] is None) and os.path.normpath(key[0]) not in known))
+    if unknown:
+        with ThreadPool(threads) as pool:
+            known.update(zip(map(os.path.normpath, unknown), pool.map(probe_duration, unknown, chunksize=64)))
+    costs = {}
+    for key in requests:
+        audio_path, start_time, end_time = key
+        if start_time is not None and end_time is not None:
+            costs[key] = max(end_time - start_time, 0)
+        else:
+            costs[key] = known.get(os.path.normpath(audio_path)) or 0
+    return costs
+
+
+def stt_factory(stt):
+    """Picklable callable that builds the same model `stt` was built with."""
+    if hasattr(stt, 'socket_path'):
+        # STTClient, every worker opens its own connection to the daemon
+        return functools.partial(type(stt), stt.socket_path, stt.lang)
+    cache_dir = stt.pcm_cache.cache_dir if stt.pcm_cache is not None else None
+    # workers only run the model, the main process reads and writes the hypothesis cache
+    return functools.partial(type(stt), stt.lang, 'scorer' in stt.config, cache_dir=cache_dir, hypothesis_cache=None)
+
+
+class PooledSTT:
+    """
+    Drop-in replacement of `STT` for the `process_audios` loops.
+
+    All the requests of the loop are sent up front to a pool of processes,
+    each of them with its own loaded model. Results come back in completion
+    order and are kept until the loop asks for them. A loop iterating
+    `completion_order` asks for them as soon as they arrive, so its rows reach
+    the results sink while the pool is still running. Everything else
+    (transformation, compute_wer, config...) is delegated to the wrapped STT.
+
+    With `costs` the files are sent longest first in tasks of similar
+    durations, and the busy time of every worker is logged once the pool is
+    done.
+    """
+
+    def __init__(self, stt, requests, workers, batch_size=DEFAULT_BATCH_SIZE,
+                 recycle_after=DEFAULT_RECYCLE_AFTER, stream=False, costs=None,
+                 batch_seconds=DEFAULT_BATCH_SECONDS, logger=logging):
+        self.stt = stt
+        self.stream = stream
+        self.workers = workers
+        self.logger = logger
+        self.pending = len(requests)
+        self.expected = Counter(requests)
+        self.results = defaultdict(deque)
+        # files of the batches received, drained by `completion_order`
+        self.arrived = None
+        self.costs = costs or {}
+        # (pid, start, end, requests, seconds of audio) of every task
+        self.usage = []
+        self.started = time.time()
+        if costs:
+            batch_seconds = min(batch_seconds, sum(costs.values()) / (MIN_TASKS_PER_WORKER * workers))
+        batches = make_batches(requests, batch_size, costs, batch_seconds)
+        self.batches = len(batches)
+        self.received = 0
+        # workers are replaced after `recycle_after` files to give back the
+        # native memory the decoder does not release
+        maxtasksperchild = max(1, recycle_after // batch_size)
+        self.pool = Pool(workers, initializer=_init_worker, initargs=(stt_factory(stt), stream),
+                         maxtasksperchild=maxtasksperchild)
+        self.completed = self.pool.imap_unordered(_run_batch, batches)
+        self.logger.info(f'Transcribing {len(requests)} requests in {len(batches)} batches with {workers} workers.')
+
+    def __getattr__(self, name):
+        return getattr(self.stt, name)
+
+    def _receive(self):
+        batch_results, (pid, start, end) = next(self.completed)
+        self.received += 1
+        self.usage.append((pid, start, end, len(batch_results), sum(self.costs.get(result_key, 0) for result_key, _ in batch_results)))
+        for result_key, text in batch_results:
+            self.results[result_key].append(text)
+        if self.arrived is not None:
+            # the segments of a file are always in the same batch
+            self.arrived.extend(dict.fromkeys(result_key[0] for result_key, _ in batch_results))
+
+    def _result(self, key):
+        self.expected[key] -= 1
+        while not self.results[key]:
+            self._receive()
+        text = self.results[key].popleft()
+        self.pending -= 1
+        if self.pending == 0:
+            self.close()
+        if isinstance(text, Exception):
+            raise text
+        self.stt.remember(self.stt.hypothesis_key(*key, stream=self.stream), text)
+        return text
+
+    def completion_order(self, keys):
+        """
+        Yields the positions in `keys` as the pool finishes their files: first
+        the ones it was not sent (done, cached, without a reference...), then
+        every file once its batch is back. Only positions wait here, the loop
+        builds each row when it is reached (see `rows_in_order`).
+
+        :param keys: `request_key` of every item the `process_audios` loop
+            iterates. Only the audio file is used, an item may stand for all
+            the segments of a session.
+        """
+        files = {key[0] for key in self.expected}
+        waiting = defaultdict(list)
+        for position, key in enumerate(keys):
+            # evaluation.py shares the pool between corpora, a file may be back already
+            if key[0] in files and not self.results.get(key):
+                waiting[key[0]].append(position)
+            else:
+                yield position
+        self.arrived = deque()
+        while waiting and (self.arrived or self.received < self.batches):
+            if not self.arrived:
+                self._receive()
+                continue
+            yield from waiting.pop(self.arrived.popleft(), ())
+        # files asked for under another path, `run` still waits for them
+        for remaining in waiting.values():
+            yield from remaining
+
+    def run(self, audio_path, start_time=None, end_time=None):
+        key = request_key(audio_path, start_time, end_time)
+        if self.expected[key] == 0:
+            # not announced to the pool, transcribe it here
+            return self.stt.run(audio_path, start_time, end_time)
+        return self._result(key)
+
+    def run_stream(self, audio_path, **kwargs):
+        key = request_key(audio_path)
+        if self.expected[key] == 0:
+            return self.stt.run_stream(audio_path, **kwargs)
+        return self._result(key)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            self.report()
+
+    def report(self):
+        """Logs the utilization of the pool, its wall time includes loading the models."""
+        if not self.usage:
+            return
+        end = max(task_end for _, _, task_end, _, _ in self.usage)
+        wall = max(end - self.started, 1e-9)
+        workers = defaultdict(lambda: [0.0, 0, 0, 0.0])
+        for pid, start, task_end, requests, seconds in self.usage:
+            worker = workers[pid]
+            worker[0] += task_end - start
+            worker[1] += 1
+            worker[2] += requests
+            worker[3] += seconds
+        busy = sum(worker[0] for worker in workers.values())
+
+        # tail: from the moment the first worker ran out of work to the end
+        running, full_until = 0, self.started
+        for moment, change in sorted([(start, 1) for _, start, _, _, _ in self.usage] +
+                                     [(task_end, -1) for _, _, task_end, _, _ in self.usage]):
+            if change < 0 and running >= self.workers:
+                full_until = moment
+            running += change
+
+        self.logger.info(f'Pool utilization: {busy / (self.workers * wall):.1%} of {self.workers} workers over {wall:.1f}s, '
+                         f'{end - full_until:.1f}s tail with idle workers, {len(workers)} processes.')
+        for pid, (busy, tasks, requests, seconds) in sorted(workers.items()):
+            self.logger.info(f'Worker {pid}: busy {busy:.1f}s ({busy / wall:.1%}), {tasks} tasks, {requests} requests, {seconds:.1f}s of audio.')
+
+
+def is_cached(stt, key, stream=False):
+    audio_path, start_time, end_time = key
+    try:
+        return stt.hypotheses.get(stt.hypothesis_key(audio_path, start_time, end_time, stream)) is not None
+    except OSError:
+        # missing files are left to the workers, transcribe_audio reports them
+        return False
+
+
+def completion_order(stt, keys):
+    """`PooledSTT.completion_order` of a pooled `stt`, otherwise every position of `keys` in order."""
+    if isinstance(stt, PooledSTT):
+        return stt.completion_order(keys)
+    return range(len(keys))
+
+
+def rows_in_order(df, positions):
+    """`df.iterrows()` in the order of `positions`, each row is only built when it is reached."""
+    if isinstance(positions, range):
+        return df.iterrows()
+    return ((df.index[position], df.iloc[position]) for position in positions)
+
+
+def pooled(stt, requests, workers, stream=False, durations=None, logger=logging, **kwargs):
+    """
+    Returns `stt` unchanged for a single worker, otherwise a `PooledSTT`.
+
+    :param requests: list of `request_key(audio_path, start_time, end_time)`, in
+        the order `process_audios` will ask for them.
+    :param workers: (int) number of processes, each loads its own model.
+    :param durations: seconds of the audio files by path, e.g. from a corpus
+        manifest, the headers of the other files are read to schedule the pool.
+    """
+    if workers is None or workers <= 1 or not requests or getattr(stt, 'rescore_only', False):
+        return stt
+    if getattr(stt, 'hypotheses', None) is not None:
+        # cached requests are answered by `stt` itself, without inference
+        requests = [key for key in requests if not is_cached(stt, key, stream)]
+        if not requests:
+            return stt
+    workers = min(workers, os.cpu_count() or workers)
+    costs = request_costs(requests, durations)
+    return PooledSTT(stt, requests, workers, stream=stream, costs=costs, logger=logger, **kwargs)
@@ -2,6 +2,9 @@ import pandas as pd
 import os
 from pathlib import Path
 from tqdm import tqdm
+from worker_pool import completion_order, pooled, request_key, rows_in_order
+from results_sink import ResultsSink
+from hypothesis_cache import HypothesisNotCached
 
 #################
 # PREPROCESSING #
@@ -25,56 +28,79 @@ def create_dir(path):
 
 def load_data(stt, text_path):
     validation_df = pd.read_csv(text_path, sep='\t')
-    total_words = validation_df['sentence'].apply(lambda x: len(stt.transformation(x).split())).sum()
+    total_words = stt.transformation.count_words(validation_df['sentence'])
     return validation_df, total_words
 
 ####################
 # PROCESSING AUDIO #
 ####################
-def transcribe_audio(stt, audio_path, reference, logger):
+def transcribe_audio(stt, audio_path, reference, logger, clips=None):
     try:
-        hypothesis = stt.run(audio_path)
+        # clips shared with an earlier release are not transcribed again
+        hypothesis = clips.get(audio_path) if clips is not None else None
+        if hypothesis is None:
+            hypothesis = stt.run(audio_path)
+            if clips is not None:
+                clips.put(audio_path, hypothesis)
+    except HypothesisNotCached:
+        logger.info(f"No cached hypothesis for {audio_path}. Skipping.")
+        return None
     except FileNotFoundError:
         logger.info(f"File {audio_path} does not exist. Skipping.")
         return None
 
-    reference_transformed = stt.transformation(reference)
-    hypothesis_transformed = stt.transformation(hypothesis)
-
-    wer = stt.compute_wer(reference_transformed, hypothesis_transformed)
-    word_count = stt.compute_word_count(reference_transformed)
-    error_count = stt.compute_error_count(wer, word_count)
-    
-    return wer, word_count, reference_transformed, hypothesis_transformed, error_count
+    return stt.score(reference, hypothesis)
 
-def process_audios(stt, validation_df, total_audios, path, logger):
-    results_df = pd.DataFrame(columns=['audio_file', 'reference', 'hypothesis', 'wer', 'words', 'errors'])
+def process_audios(stt, validation_df, total_audios, path, logger, results_path=None, resume=False, workers=1, clips=None):
+    results = ResultsSink(results_path, resume)
+    if resume:
+        logger.info(f"Resuming from {results_path}: {len(results)} utterances already done")
+    keys = [request_key(path / row['path']) for _, row in validation_df.iterrows()]
+    requests = results.pending(keys)
+    if clips is not None:
+        requests = [key for key in requests if clips.get(key[0]) is None]
+        clips.hits = 0
+    stt = pooled(stt, requests, workers, logger=logger)
 
     # for idx, row in tqdm(validation_df.head(5).iterrows(), total=5, desc="Processing audios"):
-    for idx, row in tqdm(validation_df.iterrows(), total=total_audios, desc="Processing audios"):
+    for idx, row in tqdm(rows_in_order(validation_df, completion_order(stt, keys)), total=total_audios, desc="Processing audios"):
         audio_file = row['path']
         reference = row['sentence']
         audio_path = path / audio_file
 
-        result = transcribe_audio(stt, audio_path, reference, logger)
+        key = request_key(audio_path)
+        if key in results:
+            continue
+        result = transcribe_audio(stt, audio_path, reference, logger, clips)
         if result is not None:
-            wer, word_count, reference_transformed, hypothesis_transformed, error_count = result
-            results_df.loc[idx] = [audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count]
+            wer, word_count, reference_transformed, hypothesis_transformed, error_count, *edits = result
+            results.append([audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, *edits], key)
             processing_info(stt, idx+1, total_audios, audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, logger)
     
-    return results_df
+    results.close(order=keys)
+    if clips is not None:
+        logger.info(f"{clips.hits} clips reused from the clip index {clips.path}")
+    
+    return results
 
-def calculate_wwer(stt, results_df, total_audios, total_words, audio_path, database, logger):
-    total_errors = results_df['errors'].sum()
+def calculate_wwer(stt, results, total_audios, total_words, audio_path, database, logger):
+    total_errors = results.total_errors
     wwer = total_errors / total_words
-    mean_wer = results_df['wer'].mean()
+    mean_wer = results.mean_wer
 
     wwer_info(total_audios, total_words, total_errors, wwer, mean_wer, logger)
+    logger.info(f"Substitutions: \t{results.total_substitutions}")
+    logger.info(f"Deletions: \t{results.total_deletions}")
+    logger.info(f"Insertions: \t{results.total_insertions}")
     save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, logger)
 
 ##################
 # SAVING RESULTS #
 ##################
+def results_file(stt, database):
+    file_name = f"{database}/results/{stt.config['name'].replace(' ', '_')}_{database}.csv"
+    return file_name
+
 def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, logger):
     final_results_df = pd.DataFrame({
         'model': [stt.config['name'].replace(" ", "_")],
@@ -87,7 +113,7 @@ def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_
         'mean_wer': [mean_wer]
     })
 
-    file_name = f"{database}/results/{stt.config['name'].replace(' ', '_')}_{database}.csv"
+    file_name = results_file(stt, database)
     with open(file_name, 'w') as file:
         final_results_df.to_csv(file, index=False)
 
@@ -1,8 +1,12 @@
-from num2words import num2words
 import pandas as pd
 import os
 from pathlib import Path
 from tqdm import tqdm
+from worker_pool import completion_order, pooled, request_key, rows_in_order
+from corpus_manifest import audio_durations
+from number_words import replace_numbers
+from results_sink import ResultsSink
+from hypothesis_cache import HypothesisNotCached
 import re
 
 #################
@@ -38,47 +42,58 @@ def create_dir(path):
 
     return database, sub_database,section
 
-def replace_numbers_in_text(text):
-    for num in re.findall(r'\b\d+\b', text):
-        text = text.replace(num, num2words(num, lang='es'), 1)
-    return text
-
-def load_data(stt, path):
-    wav_files = sorted([file for file in os.listdir(path) if file.endswith('.wav') and 'k_' in file])
+def transcript_file(path):
     txt_file = next((file for file in os.listdir(path) if file.endswith('.txt')), None)
     if txt_file is None:
         raise ValueError("No transcription txt file found in the directory.")
-    
-    with open(os.path.join(path, txt_file), 'r') as file:
+    return os.path.join(path, txt_file)
+
+def read_transcripts(path, lang):
+    wav_files = sorted([file for file in os.listdir(path) if file.endswith('.wav') and 'k_' in file])
+
+    with open(transcript_file(path), 'r') as file:
         lines = file.readlines()
         transcripts = [re.sub(r' \d+(\.\d+)? \d+(\.\d+)?$', '', line).strip() for line in lines]
-        transcripts = [replace_numbers_in_text(transcript) for transcript in transcripts]
+        transcripts = [replace_numbers(transcript, lang) for transcript in transcripts]
 
     if len(transcripts) != len(wav_files):
         raise ValueError("The number of lines in the txt file doesn't match the number of wav files.")
 
-    validation_df = pd.DataFrame({
+    return pd.DataFrame({
         'wav_filename': wav_files,
         'transcript': transcripts
     })
 
-    total_words = validation_df['transcript'].apply(lambda x: len(stt.transformation(x).split())).sum()
+def load_data(stt, path, manifest=None):
+    # numbers are spelled out in the language of the model
+    if manifest is not None:
+        return manifest.load(lambda: read_transcripts(path, stt.lang), stt.transformation, 'wav_filename', 'transcript',
+                             audio_dir=path, sources=[path, transcript_file(path)])
+    validation_df = read_transcripts(path, stt.lang)
+    total_words = stt.transformation.count_words(validation_df['transcript'])
     return validation_df, total_words
 
 
 ####################
 # PROCESSING AUDIO #
 ####################
-def transcribe_audio(stt, audio_path, reference, logger):
+def transcribe_audio(stt, audio_path, reference, logger, stream=False):
     if reference is None or reference.strip() == "":
         logger.info(f"Reference transcription missing or empty for {audio_path}. Skipping.")
         return None
 
     try:
-        hypothesis = stt.run(audio_path)
+        if stream:
+            # fixed size blocks through the streaming API, memory does not grow with the file
+            hypothesis = stt.run_stream(audio_path, on_partial=lambda text: logger.info(f"Partial transcription of {audio_path}: {text}"))
+        else:
+            hypothesis = stt.run(audio_path)
         if hypothesis is None or hypothesis.strip() == "":
             logger.info(f"Hypothesis missing or empty for {audio_path}. Skipping.")
             return None
+    except HypothesisNotCached:
+        logger.info(f"No cached hypothesis for {audio_path}. Skipping.")
+        return None
     except FileNotFoundError:
         logger.info(f"File {audio_path} does not exist. Skipping.")
         return None
@@ -86,44 +101,54 @@ def transcribe_audio(stt, audio_path, reference, logger):
         logger.error(f"OS error occurred when processing file {audio_path}: {e}")
         return None
 
-    reference_transformed = stt.transformation(reference)
-    hypothesis_transformed = stt.transformation(hypothesis)
-
-    wer = stt.compute_wer(reference_transformed, hypothesis_transformed)
-    word_count = stt.compute_word_count(reference_transformed)
-    error_count = stt.compute_error_count(wer, word_count)
-    
-    return wer, word_count, reference_transformed, hypothesis_transformed, error_count
+    return stt.score(reference, hypothesis)
 
 
-def process_audios(stt, validation_df, total_audios, path, logger):
-    results_df = pd.DataFrame(columns=['audio_file', 'reference', 'hypothesis', 'wer', 'words', 'errors'])
+def process_audios(stt, validation_df, total_audios, path, logger, stream=False, results_path=None, resume=False, workers=1):
+    results = ResultsSink(results_path, resume)
+    if resume:
+        logger.info(f"Resuming from {results_path}: {len(results)} utterances already done")
+    keys = [request_key(path / row['wav_filename']) for _, row in validation_df.iterrows()]
+    stt = pooled(stt, results.pending(keys), workers, stream=stream, durations=audio_durations(validation_df), logger=logger)
 
-    for idx, row in tqdm(validation_df.iterrows(), total=total_audios, desc="Processing audios"):
+    for idx, row in tqdm(rows_in_order(validation_df, completion_order(stt, keys)), total=total_audios, desc="Processing audios"):
     # for idx, row in tqdm(validation_df.head(1).iterrows(), total=total_audios, desc="Processing audios"):
         audio_file = row['wav_filename']
         reference = row['transcript']
         audio_path = path / audio_file
 
-        result = transcribe_audio(stt, audio_path, reference, logger)
+        key = request_key(audio_path)
+        if key in results:
+            continue
+        result = transcribe_audio(stt, audio_path, reference, logger, stream)
         if result is not None:
-            wer, word_count, reference_transformed, hypothesis_transformed, error_count = result
-            results_df.loc[idx] = [audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count]
+            wer, word_count, reference_transformed, hypothesis_transformed, error_count, *edits = result
+            results.append([audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, *edits], key)
             processing_info(idx+1, total_audios, audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, logger)
     
-    return results_df
+    results.close(order=keys)
+    
+    return results
 
-def calculate_wwer(stt, results_df, total_audios, total_words, audio_path, database, sub_database, section, logger):
-    total_errors = results_df['errors'].sum()
+def calculate_wwer(stt, results, total_audios, total_words, audio_path, database, sub_database, section, logger):
+    total_errors = results.total_errors
     wwer = total_errors / total_words
-    mean_wer = results_df['wer'].mean()
+    mean_wer = results.mean_wer
 
     wwer_info(total_audios, total_words, total_errors, wwer, mean_wer, logger)
+    logger.info(f"Substitutions: \t{results.total_substitutions}")
+    logger.info(f"Deletions: \t{results.total_deletions}")
+    logger.info(f"Insertions: \t{results.total_insertions}")
     save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, sub_database, section, logger)
 
 ##################
 # SAVING RESULTS #
 ##################
+def results_file(stt, database, sub_database, section):
+    file_name = f"{database}/results/{sub_database}/{stt.config['name'].replace('.', '_')}_{database}_{sub_database}_{section}.csv"
+    file_name = file_name.replace(' ', '_')
+    return file_name
+
 def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, sub_database, section, logger):
     final_results_df = pd.DataFrame({
         'model': [stt.config['name'].replace(" ", "_")],
@@ -138,8 +163,7 @@ def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_
         'mean_wer': [mean_wer]
     })
     try:
-        file_name = f"{database}/results/{sub_database}/{stt.config['name'].replace('.', '_')}_{database}_{sub_database}_{section}.csv"
-        file_name = file_name.replace(' ', '_')
+        file_name = results_file(stt, database, sub_database, section)
         with open(file_name, 'w') as file:
             final_results_df.to_csv(file, index=False)
             logger.info(f"Final results saved in {os.path.abspath(file_name)}")
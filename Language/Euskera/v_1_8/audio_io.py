@@ -0,0 +1,209 @@
+import os
+import itertools
+import functools
+import collections
+import importlib
+from math import gcd
+
+import numpy as np
+
+from audio_probe import probe_header
+
+# containers libsndfile cannot open, they go straight to PyAV
+PYAV_ONLY_EXTENSIONS = ('.m4a', '.mp4', '.aac', '.webm', '.opus')
+
+
+@functools.lru_cache(maxsize=None)
+def _optional_import(name):
+    # decoders are imported on the first decode, not when the scripts start;
+    # libsndfile bindings are optional, PyAV covers every format
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def _check_exists(audio_path):
+    if not os.path.isfile(audio_path):
+        raise FileNotFoundError(f'Audio file not found: {audio_path}')
+
+
+def _to_int16(audio):
+    """Round and clip a float signal into a contiguous int16 buffer."""
+    audio = np.clip(np.rint(audio), -32768, 32767)
+    return np.ascontiguousarray(audio, dtype=np.int16)
+
+
+def resample(audio, orig_sample_rate, desired_sample_rate):
+    if orig_sample_rate == desired_sample_rate:
+        return np.ascontiguousarray(audio, dtype=np.int16)
+    from scipy.signal import resample_poly
+
+    factor = gcd(int(orig_sample_rate), int(desired_sample_rate))
+    up = int(desired_sample_rate) // factor
+    down = int(orig_sample_rate) // factor
+    return _to_int16(resample_poly(audio.astype(np.float32), up, down))
+
+
+def _decode_soundfile(audio_path, desired_sample_rate):
+    soundfile = _optional_import('soundfile')
+    # first channel only, same as split_to_mono()[0] did with pydub
+    audio, sample_rate = soundfile.read(audio_path, dtype='int16', always_2d=True)
+    return resample(audio[:, 0], sample_rate, desired_sample_rate)
+
+
+def _decode_pyav(audio_path, desired_sample_rate):
+    av = _optional_import('av')
+    # libswresample does format conversion and resampling while decoding,
+    # planar output keeps the channels apart so that we can keep the first one
+    resampler = av.AudioResampler(format='s16p', rate=desired_sample_rate)
+    blocks = []
+    with av.open(str(audio_path)) as container:
+        for frame in container.decode(audio=0):
+            for out_frame in resampler.resample(frame):
+                blocks.append(out_frame.to_ndarray()[0])
+        for out_frame in resampler.resample(None):
+            blocks.append(out_frame.to_ndarray()[0])
+    if not blocks:
+        return np.zeros(0, dtype=np.int16)
+    return np.ascontiguousarray(np.concatenate(blocks), dtype=np.int16)
+
+
+def load_audio(audio_path, desired_sample_rate):
+    """
+    Decodes an audio file once, in-process, into the buffer the model expects.
+
+    :param audio_path: Path to any audio file (wav, flac, mp3, m4a...).
+    :param desired_sample_rate: (int) sample rate of the model, `Model.sampleRate()`.
+    :return: Contiguous mono int16 numpy array at `desired_sample_rate`.
+    """
+    audio_path = str(audio_path)
+    _check_exists(audio_path)
+    soundfile = _optional_import('soundfile')
+    av = _optional_import('av')
+    use_soundfile = soundfile is not None and not audio_path.lower().endswith(PYAV_ONLY_EXTENSIONS)
+
+    if use_soundfile:
+        try:
+            return _decode_soundfile(audio_path, desired_sample_rate)
+        except RuntimeError as error:
+            if av is None:
+                raise ValueError('Could not decode audio file.') from error
+
+    if av is None:
+        raise ValueError(f'PyAV is needed to decode {audio_path}.')
+    try:
+        return _decode_pyav(audio_path, desired_sample_rate)
+    except av.error.FFmpegError as error:
+        raise ValueError('Could not decode audio file.') from error
+
+
+def _iter_soundfile_blocks(audio_path, block_size):
+    soundfile = _optional_import('soundfile')
+    for block in soundfile.blocks(audio_path, blocksize=block_size, dtype='int16', always_2d=True):
+        yield np.ascontiguousarray(block[:, 0])
+
+
+def _iter_pyav_blocks(audio_path, desired_sample_rate, block_size):
+    av = _optional_import('av')
+    # frames coming out of the resampler are regrouped into block_size samples
+    resampler = av.AudioResampler(format='s16p', rate=desired_sample_rate)
+    pending = []
+    pending_size = 0
+    try:
+        with av.open(str(audio_path)) as container:
+            # None flushes the resampler once the last frame is decoded
+            for frame in itertools.chain(container.decode(audio=0), [None]):
+                for out_frame in resampler.resample(frame):
+                    pending.append(out_frame.to_ndarray()[0])
+                    pending_size += len(pending[-1])
+                while pending_size >= block_size:
+                    buffer = np.concatenate(pending)
+                    yield np.ascontiguousarray(buffer[:block_size], dtype=np.int16)
+                    pending = [buffer[block_size:]]
+                    pending_size -= block_size
+    except av.error.FFmpegError as error:
+        raise ValueError('Could not decode audio file.') from error
+    if pending_size:
+        yield np.ascontiguousarray(np.concatenate(pending), dtype=np.int16)
+
+
+def iter_blocks(audio_path, desired_sample_rate, block_size):
+    """
+    Decodes an audio file incrementally, for streaming it into the model.
+
+    :param audio_path: Path to any audio file (wav, flac, mp3, m4a...).
+    :param desired_sample_rate: (int) sample rate of the model, `Model.sampleRate()`.
+    :param block_size: (int) number of samples per block, the last one may be shorter.
+    :return: Generator of contiguous mono int16 numpy arrays at `desired_sample_rate`,
+        only one block (plus the decoder state) is kept in memory at a time.
+    """
+    audio_path = str(audio_path)
+    _check_exists(audio_path)
+    soundfile = _optional_import('soundfile')
+    av = _optional_import('av')
+    use_soundfile = soundfile is not None and not audio_path.lower().endswith(PYAV_ONLY_EXTENSIONS)
+
+    if use_soundfile:
+        try:
+            info = soundfile.info(audio_path)
+        except RuntimeError as error:
+            if av is None:
+                raise ValueError('Could not decode audio file.') from error
+        else:
+            if info.samplerate == desired_sample_rate:
+                return _iter_soundfile_blocks(audio_path, block_size)
+            if av is None:
+                # no streaming resampler without PyAV, resample the whole file
+                audio = _decode_soundfile(audio_path, desired_sample_rate)
+                return (audio[start:start + block_size] for start in range(0, len(audio), block_size))
+
+    if av is None:
+        raise ValueError(f'PyAV is needed to decode {audio_path}.')
+    return _iter_pyav_blocks(audio_path, desired_sample_rate, block_size)
+
+
+AudioInfo = collections.namedtuple('AudioInfo', ['duration', 'sample_rate', 'channels'])
+
+
+def audio_info(audio_path):
+    """
+    Duration (seconds), sample rate and channels of an audio file, from its
+    header only: nothing is decoded.
+    """
+    audio_path = str(audio_path)
+    _check_exists(audio_path)
+    # WAV, FLAC, MP3 and MP4 headers are read in Python, the decoders are only opened for the rest
+    info = probe_header(audio_path)
+    if info is not None and None not in info:
+        return AudioInfo(*info)
+    soundfile = _optional_import('soundfile')
+    av = _optional_import('av')
+
+    if soundfile is not None and not audio_path.lower().endswith(PYAV_ONLY_EXTENSIONS):
+        try:
+            info = soundfile.info(audio_path)
+            return AudioInfo(info.duration, info.samplerate, info.channels)
+        except RuntimeError as error:
+            if av is None:
+                raise ValueError('Could not read audio header.') from error
+
+    if av is None:
+        raise ValueError(f'PyAV is needed to read {audio_path}.')
+    try:
+        with av.open(audio_path) as container:
+            stream = container.streams.audio[0]
+            if container.duration is not None:
+                duration = container.duration / av.time_base
+            else:
+                duration = float(stream.duration * stream.time_base) if stream.duration is not None else None
+            return AudioInfo(duration, stream.sample_rate, stream.channels)
+    except (av.error.FFmpegError, IndexError) as error:
+        raise ValueError('Could not read audio header.') from error
+
+
+def slice_segment(audio, sample_rate, start_time, end_time):
+    """Returns a view of `audio` between two times given in seconds."""
+    start = max(int(round(start_time * sample_rate)), 0)
+    end = min(int(round(end_time * sample_rate)), len(audio))
+    return audio[start:end]
@@ -4,6 +4,9 @@ import os
 import logging
 from pathlib import Path
 from tqdm import tqdm
+from worker_pool import completion_order, pooled, request_key, rows_in_order
+from results_sink import ResultsSink
+from hypothesis_cache import HypothesisNotCached
 import codecs
 import time
 import re
@@ -33,7 +36,7 @@ def load_data(stt, path):
         entry['audio_filepath'] = entry['audio_filepath'].replace("/bips_asierhv", "")
 
     validation_df = pd.DataFrame(data)
-    total_words = validation_df['text'].apply(lambda x: len(stt.transformation(x).split())).sum()
+    total_words = stt.transformation.count_words(validation_df['text'])
     return validation_df, total_words
 
 ####################
@@ -42,6 +45,9 @@ def load_data(stt, path):
 def transcribe_audio(stt, audio_path, reference, logger):
     try:
         hypothesis = stt.run(audio_path)
+    except HypothesisNotCached:
+        logger.info(f"No cached hypothesis for {audio_path}. Skipping.")
+        return None
     except FileNotFoundError:
         logger.info(f"File {audio_path} does not exist. Skipping.")
         return None
@@ -49,43 +55,52 @@ def transcribe_audio(stt, audio_path, reference, logger):
         logger.error(f"OS error occurred when processing file {audio_path}: {e}")
         return None
 
-    reference_transformed = stt.transformation(reference)
-    hypothesis_transformed = stt.transformation(hypothesis)
-
-    wer = stt.compute_wer(reference_transformed, hypothesis_transformed)
-    word_count = stt.compute_word_count(reference_transformed)
-    error_count = stt.compute_error_count(wer, word_count)
-    
-    return wer, word_count, reference_transformed, hypothesis_transformed, error_count
+    return stt.score(reference, hypothesis)
 
-def process_audios(stt, validation_df, total_audios, path, logger):
-    results_df = pd.DataFrame(columns=['audio_file', 'reference', 'hypothesis', 'wer', 'words', 'errors'])
+def process_audios(stt, validation_df, total_audios, path, logger, results_path=None, resume=False, workers=1):
+    results = ResultsSink(results_path, resume)
+    if resume:
+        logger.info(f"Resuming from {results_path}: {len(results)} utterances already done")
+    keys = [request_key(path / row['audio_filepath']) for _, row in validation_df.iterrows()]
+    stt = pooled(stt, results.pending(keys), workers, logger=logger)
     n_audios = 1
-    for idx, row in tqdm(validation_df.iterrows(), total=total_audios, desc="Processing audios"):
+    for idx, row in tqdm(rows_in_order(validation_df, completion_order(stt, keys)), total=total_audios, desc="Processing audios"):
     # for idx, row in tqdm(validation_df.head(n_audios).iterrows(), total=n_audios, desc="Processing audios"):
         audio_file = row['audio_filepath']
         reference = row['text']
         audio_path = path / audio_file
 
+        key = request_key(audio_path)
+        if key in results:
+            continue
         result = transcribe_audio(stt, audio_path, reference, logger)
         if result is not None:
-            wer, word_count, reference_transformed, hypothesis_transformed, error_count = result
-            results_df.loc[idx] = [audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count]
+            wer, word_count, reference_transformed, hypothesis_transformed, error_count, *edits = result
+            results.append([audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, *edits], key)
             processing_info(stt, idx+1, total_audios, audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, logger)
     
-    return results_df
+    results.close(order=keys)
+    
+    return results
 
-def calculate_wwer(stt, results_df, total_audios, total_words, audio_path, database, logger):
-    total_errors = results_df['errors'].sum()
+def calculate_wwer(stt, results, total_audios, total_words, audio_path, database, logger):
+    total_errors = results.total_errors
     wwer = total_errors / total_words
-    mean_wer = results_df['wer'].mean()
+    mean_wer = results.mean_wer
 
     wwer_info(total_audios, total_words, total_errors, wwer, mean_wer, logger)
+    logger.info(f"Substitutions: \t{results.total_substitutions}")
+    logger.info(f"Deletions: \t{results.total_deletions}")
+    logger.info(f"Insertions: \t{results.total_insertions}")
     save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, logger)
 
 ##################
 # SAVING RESULTS #
 ##################
+def results_file(stt, database):
+    file_name = f"{database}/results/{stt.config['name'].replace(' ', '_')}_{database}.csv"
+    return file_name
+
 def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, logger):
     final_results_df = pd.DataFrame({
         'model': [stt.config['name'].replace(" ", "_")],
@@ -98,7 +113,7 @@ def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_
         'mean_wer': [mean_wer]
     })
 
-    file_name = f"{database}/results/{stt.config['name'].replace(' ', '_')}_{database}.csv"
+    file_name = results_file(stt, database)
     with open(file_name, 'w') as file:
         final_results_df.to_csv(file, index=False)
 
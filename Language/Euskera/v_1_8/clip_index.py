@@ -0,0 +1,94 @@
+import os
+import json
+import sqlite3
+import hashlib
+
+DEFAULT_PATH = 'common_voice_clips.sqlite'
+# size of the clips imported from results whose audio is gone, they match by name only
+UNKNOWN_SIZE = -1
+
+# Common Voice releases share most of their clips: the file of a clip keeps its
+# name (`common_voice_<lang>_<id>.mp3`, the `path` column of the tsv) and its
+# content from one release to the next. The index maps a clip, by name and
+# size, to the hypothesis of a model, so a later release only transcribes the
+# clips that are new in it and reuses the rest. Only a stat is needed per
+# clip, the audio is not read. Hypotheses are kept per model name and decoder
+# configuration (checksums, scorer, beam width...), as in the hypothesis cache.
+
+
+def clip_key(audio_path):
+    return os.path.basename(str(audio_path)), os.path.getsize(audio_path)
+
+
+class ClipIndex:
+    """
+    Hypotheses of Common Voice clips by clip name and size, shared by the releases.
+
+    :param path: database file.
+    :param model: (str) name of the model the hypotheses come from.
+    :param decoder: dict returned by `STT.decoder_config`.
+    """
+
+    def __init__(self, path, model, decoder):
+        self.path = str(path)
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # the model column holds the name and a digest of the decoder configuration
+        digest = hashlib.sha256(json.dumps(decoder, sort_keys=True).encode('utf-8')).hexdigest()
+        self.model = f'{model} {digest[:16]}'
+        self.hits = 0
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS clips (model TEXT, clip TEXT, size INTEGER, hypothesis TEXT NOT NULL, '
+                                'PRIMARY KEY (model, clip, size))')
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM clips WHERE model = ?', (self.model,)).fetchone()[0]
+
+    def get(self, audio_path):
+        """Hypothesis of the clip, None when it was never transcribed or the file is missing."""
+        try:
+            clip, size = clip_key(audio_path)
+        except OSError:
+            # missing files are left to stt.run, transcribe_audio reports them
+            return None
+        row = self.connection.execute('SELECT hypothesis FROM clips WHERE model = ? AND clip = ? AND size IN (?, ?) '
+                                      'ORDER BY size = ? LIMIT 1', (self.model, clip, size, UNKNOWN_SIZE, UNKNOWN_SIZE)).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, audio_path, hypothesis):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?)', (self.model, *clip_key(audio_path), hypothesis))
+
+    def import_results(self, results_path):
+        """
+        Adds the clips of the per utterance results of an earlier release,
+        written by `process_audios` with the same model. Those hypotheses are
+        already normalized, normalizing them again leaves them unchanged.
+
+        :return: (int) number of clips imported.
+        """
+        import pandas as pd
+
+        if str(results_path).endswith('.parquet'):
+            results_df = pd.read_parquet(results_path, columns=['audio_path', 'hypothesis'])
+        else:
+            # hypotheses stay strings, an empty one is a valid result
+            results_df = pd.read_csv(results_path, usecols=['audio_path', 'hypothesis'], keep_default_na=False)
+        rows = []
+        for audio_path, hypothesis in results_df[['audio_path', 'hypothesis']].itertuples(index=False):
+            try:
+                clip, size = clip_key(audio_path)
+            except OSError:
+                clip, size = os.path.basename(audio_path), UNKNOWN_SIZE
+            rows.append((self.model, clip, size, hypothesis))
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,166 @@
+import os
+import stat
+import json
+import logging
+from multiprocessing.pool import ThreadPool
+
+DEFAULT_WORKERS = 16  # threads reading audio headers
+# bumped when the stored columns or the normalization change, older manifests are rebuilt
+MANIFEST_VERSION = 1
+METADATA_KEY = b'corpus_manifest'
+AUDIO_COLUMNS = ['audio_size', 'audio_mtime_ns', 'duration', 'sample_rate', 'channels']
+AUDIO_DTYPES = {'audio_size': 'Int64', 'audio_mtime_ns': 'Int64', 'duration': 'float64', 'sample_rate': 'Int64', 'channels': 'Int64'}
+
+# Parquet index of a corpus, so that `load_data` does not list directories,
+# parse transcripts and stat every audio file on each run. The manifest is the
+# table `load_data` builds (paths, references, segment offsets...) plus, for
+# every row, the size, mtime, duration, sample rate and channels of its audio
+# file and the normalized reference with its number of words.
+#
+# The manifest is reused while its sources are unchanged: a transcript file by
+# its size and mtime, a directory by its mtime, which changes when entries are
+# added, removed or renamed. Nothing else is read on that path. Transcripts
+# edited in place inside a listed directory, or audio files replaced under the
+# same name, need a refresh: the table is built again and only the audio files
+# whose size or mtime changed have their header read again, by a pool of
+# threads.
+
+
+def fingerprint(sources):
+    stamps = []
+    for source in sources:
+        source = os.path.abspath(str(source))
+        source_stat = os.stat(source)
+        if stat.S_ISDIR(source_stat.st_mode):
+            stamps.append([source, source_stat.st_mtime_ns])
+        else:
+            stamps.append([source, source_stat.st_mtime_ns, source_stat.st_size])
+    return stamps
+
+
+def probe(audio_path, previous=None):
+    """
+    :param previous: values of `AUDIO_COLUMNS` stored for the file, returned
+        unchanged when its size and mtime did not change.
+    :return: values of `AUDIO_COLUMNS`, None for what could not be read.
+    """
+    from audio_io import audio_info
+
+    try:
+        audio_stat = os.stat(audio_path)
+    except OSError:
+        # the row is kept, transcribe_audio reports the missing file
+        return None, None, None, None, None
+    if previous is not None and previous[:2] == (audio_stat.st_size, audio_stat.st_mtime_ns):
+        return previous
+    try:
+        info = audio_info(audio_path)
+    except (OSError, ValueError):
+        return audio_stat.st_size, audio_stat.st_mtime_ns, None, None, None
+    return audio_stat.st_size, audio_stat.st_mtime_ns, info.duration, info.sample_rate, info.channels
+
+
+def audio_durations(df):
+    """Seconds of every audio file of a table loaded with a manifest, by path, None without a manifest."""
+    if 'duration' not in df.columns:
+        return None
+    known = df.dropna(subset=['duration'])
+    return dict(zip(known['audio_path'].tolist(), known['duration'].tolist()))
+
+
+class CorpusManifest:
+    """
+    Parquet manifest of one corpus, see above.
+
+    :param path: parquet file.
+    :param refresh: (bool) build the table again even if its sources did not change.
+    :param workers: (int) threads reading the audio headers.
+    """
+
+    def __init__(self, path, refresh=False, workers=DEFAULT_WORKERS):
+        self.path = str(path)
+        self.refresh = refresh
+        self.workers = workers
+
+    def read(self):
+        """Stored table and its metadata, (None, None) when there is none."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        try:
+            table = pq.read_table(self.path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None, None
+        metadata = (table.schema.metadata or {}).get(METADATA_KEY, b'').decode()
+        return table.to_pandas(), metadata
+
+    def write(self, df, metadata):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as error:
+            logging.warning(f'Corpus manifest {self.path} not written: {error}')
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), METADATA_KEY: metadata.encode()})
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def load(self, build, normalizer, audio_column, reference_column, audio_dir='', sources=()):
+        """
+        Corpus table of `load_data`, from the manifest when its sources did not change.
+
+        :param build: callable returning the corpus table, the code `load_data` runs without a manifest.
+        :param normalizer: `stt.transformation`, it gets the stored normalized references.
+        :param audio_column: column of the audio files, relative to `audio_dir` or absolute.
+        :param reference_column: column of the references.
+        :param sources: transcript files and directories the table is read from.
+        :return: (table, total_words), as `load_data`.
+        """
+        metadata = json.dumps({
+            'version': MANIFEST_VERSION,
+            'sources': fingerprint(sources),
+            'audio_dir': os.path.abspath(str(audio_dir)),
+            'columns': [audio_column, reference_column],
+        }, sort_keys=True)
+        previous, previous_metadata = self.read()
+        if previous is not None and previous_metadata == metadata and not self.refresh:
+            df = previous
+            logging.info(f'Corpus manifest {self.path}: {len(df)} rows, sources unchanged.')
+        else:
+            df = self.rebuild(build, normalizer, audio_column, reference_column, str(audio_dir), previous)
+            self.write(df, metadata)
+        normalizer.remember(df[reference_column], df['normalized_reference'])
+        return df, int(df['words'].sum())
+
+    def rebuild(self, build, normalizer, audio_column, reference_column, audio_dir, previous=None):
+        import pandas as pd
+
+        df = build().reset_index(drop=True)
+        df = df.drop(columns=['audio_path', 'normalized_reference', 'words', *AUDIO_COLUMNS], errors='ignore')
+
+        known = {}
+        if previous is not None and set(AUDIO_COLUMNS) <= set(previous.columns):
+            previous = previous.dropna(subset=['audio_size'])
+            known = dict(zip(previous['audio_path'].tolist(), previous[AUDIO_COLUMNS].itertuples(index=False, name=None)))
+
+        paths = [os.path.join(audio_dir, str(audio_file)) for audio_file in df[audio_column].tolist()]
+        # segments of a file share its header
+        files = list(dict.fromkeys(paths))
+        with ThreadPool(self.workers) as pool:
+            rows = pool.starmap(probe, [(path, known.get(path)) for path in files], chunksize=64)
+        probed = sum(row is not known.get(path) for path, row in zip(files, rows))
+        logging.info(f'Corpus manifest {self.path}: {len(df)} rows, {probed} of {len(files)} audio files probed.')
+
+        by_path = dict(zip(files, rows))
+        values = zip(*[by_path[path] for path in paths]) if paths else [[]] * len(AUDIO_COLUMNS)
+        # column by column, a missing file would turn the mtimes into floats
+        audio = [pd.Series(column, index=df.index, name=name, dtype=AUDIO_DTYPES[name]) for name, column in zip(AUDIO_COLUMNS, values)]
+        normalized = normalizer.normalize_references(df[reference_column])
+        words = pd.Series([len(text.split()) for text in normalized.tolist()], index=df.index, dtype='int64')
+        return pd.concat([df, pd.Series(paths, index=df.index, name='audio_path'), *audio,
+                          normalized.rename('normalized_reference'), words.rename('words')], axis=1)
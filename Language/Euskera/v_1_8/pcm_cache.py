@@ -0,0 +1,109 @@
+import os
+import time
+import hashlib
+import logging
+
+import numpy as np
+
+from audio_io import load_audio
+
+DEFAULT_MAX_BYTES = 50 * 1024 ** 3
+# a temporary file this old was left by a process that died while writing it
+STALE_TMP_SECONDS = 60 * 60
+
+
+class PCMCache:
+    """
+    On-disk cache of decoded and resampled audio.
+
+    Every entry is a mono int16 `.npy` file named after the source path, its
+    mtime and size and the target sample rate, so touching the source file
+    invalidates it. Hits are memory-mapped, and the modification time of an
+    entry is used as its last access time for LRU eviction once the cache
+    grows over `max_bytes`.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = str(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.entries = {}
+        self.total_bytes = 0
+        self._scan()
+
+    def _scan(self):
+        self.entries = {}
+        writing_bytes = 0
+        now = time.time()
+        for entry in os.scandir(self.cache_dir):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith('.npy'):
+                self.entries[entry.path] = (stat.st_size, stat.st_mtime)
+            elif entry.name.endswith('.tmp'):
+                if now - stat.st_mtime > STALE_TMP_SECONDS:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+                else:
+                    # being written by another process, it counts towards the limit
+                    writing_bytes += stat.st_size
+        self.total_bytes = writing_bytes + sum(size for size, _ in self.entries.values())
+
+    def entry_path(self, audio_path, sample_rate):
+        audio_path = os.path.abspath(str(audio_path))
+        stat = os.stat(audio_path)
+        key = f'{audio_path}|{stat.st_mtime_ns}|{stat.st_size}|{sample_rate}'
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{digest}.npy')
+
+    def get(self, audio_path, sample_rate):
+        path = self.entry_path(audio_path, sample_rate)
+        try:
+            audio = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return audio
+
+    def put(self, audio_path, sample_rate, audio):
+        path = self.entry_path(audio_path, sample_rate)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.save(file, np.ascontiguousarray(audio, dtype=np.int16))
+        os.replace(tmp_path, path)  # readers never see half written entries
+
+        size = os.path.getsize(path)
+        previous_size, _ = self.entries.get(path, (0, 0))
+        self.entries[path] = (size, os.path.getmtime(path))
+        self.total_bytes += size - previous_size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # other processes may share the directory, start from what is on disk
+        self._scan()
+        for path, (size, _) in sorted(self.entries.items(), key=lambda item: item[1][1]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            del self.entries[path]
+            self.total_bytes -= size
+        logging.debug('PCM cache evicted down to %d bytes.', self.total_bytes)
+
+    def load(self, audio_path, sample_rate):
+        """Returns the cached buffer, decoding and storing the file on a miss."""
+        audio = self.get(audio_path, sample_rate)
+        if audio is None:
+            audio = load_audio(audio_path, sample_rate)
+            self.put(audio_path, sample_rate, audio)
+        return audio
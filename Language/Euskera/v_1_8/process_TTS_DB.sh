@@ -8,8 +8,10 @@ fi
 
 use_nohup=false
 parent_directory=""
+daemon_socket=""
+resume_args=""
 
-while getopts ":p:n" opt; do
+while getopts ":p:nd:r" opt; do
   case $opt in
     p)
       parent_directory="$OPTARG"
@@ -17,6 +19,12 @@ while getopts ":p:n" opt; do
     n)
       use_nohup=true
       ;;
+    d)
+      daemon_socket="$OPTARG"
+      ;;
+    r)
+      resume_args="--resume"
+      ;;
     \?)
       echo "Invalid option: -$OPTARG" >&2
       exit 1
@@ -33,15 +41,30 @@ if [ -z "$parent_directory" ]; then
     exit 1
 fi
 
+# Keep the model loaded in one daemon instead of loading it for every directory
+daemon_args=""
+if [ -n "$daemon_socket" ]; then
+    if ! python3 stt_daemon.py --socket "$daemon_socket" --wait 1; then
+        python3 stt_daemon.py --socket "$daemon_socket" --languages eu &
+        daemon_pid=$!
+        trap 'kill $daemon_pid' EXIT
+        if ! python3 stt_daemon.py --socket "$daemon_socket" --wait 600; then
+            echo "STT daemon did not start on $daemon_socket"
+            exit 1
+        fi
+    fi
+    daemon_args="--daemon $daemon_socket"
+fi
+
 for block_directory in "$parent_directory"/*; do
     if [ -d "$block_directory" ]; then
         block_dir_name=$(basename "$block_directory")
 
         # Check if the directory should be processed with a single path or separate wav/txt paths
         if [ "$block_dir_name" == "urkullu_eu" ]; then
-            command="python3 -m TTS_DB.main -a $block_directory"
+            command="python3 -m TTS_DB.main -a $block_directory $daemon_args $resume_args"
         else
-            command="python3 -m TTS_DB.main -a $block_directory/wav/ -t $block_directory/txt/"
+            command="python3 -m TTS_DB.main -a $block_directory/wav/ -t $block_directory/txt/ $daemon_args $resume_args"
         fi
 
         log_folder="/home/aholab/santi/Documents/audio_process/Language/Euskera/v_1_8/TTS_DB/nohup_logs/${block_dir_name}"
@@ -51,7 +74,7 @@ for block_directory in "$parent_directory"/*; do
         if $use_nohup; then
             mkdir -p "$log_folder"
             nohup $command > "$log_path" 2>&1 &
-            wait
+            wait $! # Wait for this job only, the daemon started above is a background process too
         else
             $command
         fi
@@ -1,53 +1,28 @@
 import os
 import time
 import logging
-import pydub
-import numpy as np
-from stt import Model
-from scipy.io import wavfile
-from coqui_stt_model_manager.modelmanager import ModelManager
-import jiwer
 from model_config_xz import *
+from audio_io import load_audio, slice_segment, iter_blocks
+from pcm_cache import PCMCache, DEFAULT_MAX_BYTES
+from model_registry import resolve_model, register_model
+from hypothesis_cache import HypothesisCache, HypothesisNotCached
+from scoring import score
+from wer_kernel import Vocabulary
+from text_normalizer import TextNormalizer
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO)
-logging.getLogger("pydub.converter").setLevel(logging.WARNING)
 
-INSTALL_DIR = "/home/aholab/santi/Documents/audio_process/Test/Language/models"
-
-def ensure_samplerate(audio_path, desired_sample_rate):
-    try:
-        sound = pydub.AudioSegment.from_file(audio_path)
-    except pydub.exceptions.CouldntDecodeError as error:
-        raise ValueError('Could not decode audio file.') from error
-
-    sample_rate = sound.frame_rate
-    if sample_rate != desired_sample_rate:
-        sound = sound.set_frame_rate(desired_sample_rate)
-        # sound.export(audio_path, format='wav') # this is not used
-    return sound
-
-def convert_to_mono(sound):
-    if sound.channels > 1:
-        sound = sound.split_to_mono()[0]
-    return sound
+PCM_CACHE_DIR = os.path.join(os.path.dirname(INSTALL_DIR), "pcm_cache")
+HYPOTHESIS_CACHE_PATH = os.path.join(os.path.dirname(INSTALL_DIR), "hypotheses.sqlite")
 
 def read_wav(audio_path, desired_sample_rate):
-    sound = ensure_samplerate(audio_path, desired_sample_rate)
-    sound = convert_to_mono(sound)
-    audio = np.array(sound.get_array_of_samples())
-
-    # It needs to be in 16-bit precision:
-    if audio.dtype == 'int8':
-        audio = np.array(audio.astype(float) * (2**8), dtype=np.int16)
-    elif audio.dtype == 'int32':
-        audio = np.array(audio.astype(float) / (2**16), dtype=np.int16)
-    elif audio.dtype == 'float32':
-        audio = np.array(audio.astype(float) / (2**16), dtype=np.int16)
-    return audio
+    # single in-process decode, mono int16 at the model sample rate
+    return load_audio(audio_path, desired_sample_rate)
 
 class STT:
-    def __init__(self, lang, scorer=True):
+    def __init__(self, lang, scorer=True, cache_dir=PCM_CACHE_DIR, cache_max_bytes=DEFAULT_MAX_BYTES,
+                 hypothesis_cache=HYPOTHESIS_CACHE_PATH, rescore_only=False):
         self.lang = lang
         if self.lang not in STT_MODELS:
             raise ValueError(f'Unknown language: {self.lang}')
@@ -55,24 +30,43 @@ class STT:
         if not scorer and 'scorer' in self.config:
             del self.config['scorer']
         
-        self.transformation = jiwer.Compose([
-        jiwer.RemoveMultipleSpaces(),
-        jiwer.RemovePunctuation(),
-        jiwer.ToLowerCase(),
-        jiwer.Strip(),
-        ])
+        # same output as the jiwer RemoveMultipleSpaces, RemovePunctuation, ToLowerCase, Strip pipeline
+        self.transformation = TextNormalizer()
         
         os.makedirs(INSTALL_DIR, exist_ok=True)
 
+        # decoded 16-bit PCM is reused across runs, cache_dir=None disables it
+        self.pcm_cache = PCMCache(cache_dir, cache_max_bytes) if cache_dir else None
+
         self.model = None
-        logging.info('Downloading %s model...', lang)
-        self.download()
-        logging.info('Model downloaded.')
-        logging.info('Loading %s model...', lang)
-        self.load()
-        logging.info('Model loaded.')
+        self.rescore_only = rescore_only
+        # word ids of the bit-parallel WER kernel, only used when rescoring
+        self.vocabulary = Vocabulary() if rescore_only else None
+        if rescore_only:
+            # every hypothesis comes from the cache, the model is never loaded
+            self.card = resolve_model(INSTALL_DIR, self.config)
+            if self.card is None or hypothesis_cache is None:
+                raise ValueError(f"Rescoring needs {self.config['name']} in the local model registry and a hypothesis cache.")
+        else:
+            logging.info('Downloading %s model...', lang)
+            self.download()
+            logging.info('Model downloaded.')
+            logging.info('Loading %s model...', lang)
+            self.load()
+            logging.info('Model loaded.')
+
+        # raw hypotheses are reused across runs, hypothesis_cache=None disables it
+        self.hypotheses = HypothesisCache(hypothesis_cache, self.decoder_config()) if hypothesis_cache else None
 
     def download(self):
+        # models already in the local manifest need neither network nor ModelManager
+        self.card = resolve_model(INSTALL_DIR, self.config)
+        if self.card is not None:
+            logging.info('Found %s in the local model registry.', self.config['name'])
+            return
+
+        from coqui_stt_model_manager.modelmanager import ModelManager
+
         self.manager = ModelManager(install_dir=INSTALL_DIR)
         self.manager.download_model(STT_MODELS[self.lang])
 
@@ -82,7 +76,12 @@ class STT:
             while not self.config['name'] in self.manager.models_dict():
                 time.sleep(1)
 
-        self.card = self.manager.models_dict()[self.config['name']]
+        card = self.manager.models_dict()[self.config['name']]
+        self.card = register_model(INSTALL_DIR, self.config, self.model_path(card.acoustic_path),
+                                   self.model_path(card.scorer_path) if 'scorer' in self.config else None)
+
+    def model_path(self, path):
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
 
     def scorer(self, scorer_path):
         if scorer_path is None:
@@ -93,17 +92,15 @@ class STT:
     def load(self):
         if self.model is not None:
             return
-        acoustic_path = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)),
-            self.card.acoustic_path
-        ) # join initial path + acoustic model path
+        from stt import Model  # the TFLite runtime is only imported when a model is loaded
+
+        acoustic_path = self.model_path(self.card.acoustic_path) # join initial path + acoustic model path
         self.model = Model(acoustic_path)
         if 'scorer' in self.config:
-            scorer_path = os.path.join(
-                os.path.dirname(os.path.abspath(__file__)),
-                self.card.scorer_path
-            )
+            scorer_path = self.model_path(self.card.scorer_path)
             self.scorer(scorer_path)
+        if 'beam_width' in self.config:
+            self.model.setBeamWidth(self.config['beam_width'])
         
         # setting hyperparameters from config
         if 'lm_alpha' in self.config and 'lm_beta' in self.config:
@@ -117,22 +114,107 @@ class STT:
         else:
             logging.info("Alpha and Beta hyperparameters are not set in config.")
 
+    def decoder_config(self):
+        # everything besides the audio that changes the output of model.stt
+        return {
+            'acoustic': self.card.acoustic_sha256,
+            'scorer': self.card.scorer_sha256 if 'scorer' in self.config else None,
+            'lm_alpha': self.config.get('lm_alpha'),
+            'lm_beta': self.config.get('lm_beta'),
+            'beam_width': self.config.get('beam_width'),
+        }
+
+    def hypothesis_key(self, audio_path, start_time=None, end_time=None, stream=False):
+        if self.hypotheses is None:
+            return None
+        return self.hypotheses.key(audio_path, start_time, end_time, stream)
+
+    def cached_hypothesis(self, key):
+        text = self.hypotheses.get(key) if key is not None else None
+        if text is None and self.rescore_only:
+            raise HypothesisNotCached('No cached hypothesis, the utterance was never transcribed with this model.')
+        return text
+
+    def remember(self, key, text):
+        if key is not None:
+            self.hypotheses.put(key, text)
+
+    def sample_rate(self):
+        # --rescore-only has no model, but still decodes audio to find its segments
+        return self.model.sampleRate() if self.model is not None else MODEL_SAMPLE_RATE
+
+    def load_audio(self, audio_path):
+        if self.pcm_cache is not None:
+            return self.pcm_cache.load(audio_path, self.sample_rate())
+        return read_wav(audio_path, self.sample_rate())
+
     def run(self, audio_path, start_time=None, end_time=None):
+        key = self.hypothesis_key(audio_path, start_time, end_time)
+        text = self.cached_hypothesis(key)
+        if text is not None:
+            return text
+        audio = self.load_audio(audio_path)
         if start_time is not None and end_time is not None:
-            sound = pydub.AudioSegment.from_file(audio_path)
-            segment = sound[start_time * 1000:end_time * 1000]
-            if segment.frame_rate != self.model.sampleRate():
-                segment = segment.set_frame_rate(self.model.sampleRate())
-            audio = np.array(segment.get_array_of_samples())
-        else:
-            # logging.debug('[STT:%s] Audio path: %s', self.lang, audio_path)
-            desired_sample_rate = self.model.sampleRate()
-            audio = read_wav(audio_path, desired_sample_rate)
+            audio = slice_segment(audio, self.sample_rate(), start_time, end_time)
+        text = self.run_audio(audio)
+        self.remember(key, text)
+        return text
+
+    def run_segment(self, audio_path, start_time, end_time, audio):
+        """
+        `run` for a recording already decoded into `audio`, sliced on a cache
+        miss. Without `start_time` and `end_time` the whole recording is transcribed.
+        """
+        key = self.hypothesis_key(audio_path, start_time, end_time)
+        text = self.cached_hypothesis(key)
+        if text is not None:
+            return text
+        if start_time is not None and end_time is not None:
+            audio = slice_segment(audio, self.sample_rate(), start_time, end_time)
+        text = self.run_audio(audio)
+        self.remember(key, text)
+        return text
 
+    def run_audio(self, audio):
+        # audio is an int16 buffer at the model sample rate, views are fine
         text = self.model.stt(audio)
         return text
 
+    def run_stream(self, audio_path, block_seconds=1.0, on_partial=None, partial_every=30):
+        """
+        Transcribes a file block by block through the streaming API, so memory
+        does not grow with the length of the recording.
+
+        :param block_seconds: (float) seconds of audio fed to the model at a time.
+        :param on_partial: callable receiving the intermediate transcription.
+        :param partial_every: (int) number of blocks between intermediate decodes.
+        """
+        key = self.hypothesis_key(audio_path, stream=True)
+        text = self.cached_hypothesis(key)
+        if text is not None:
+            return text
+        sample_rate = self.sample_rate()
+        block_size = int(block_seconds * sample_rate)
+        stream = self.model.createStream()
+        try:
+            for i, block in enumerate(iter_blocks(audio_path, sample_rate, block_size), start=1):
+                stream.feedAudioContent(block)
+                if on_partial is not None and i % partial_every == 0:
+                    on_partial(stream.intermediateDecode())
+        except BaseException:
+            stream.freeStream()
+            raise
+        text = stream.finishStream()
+        self.remember(key, text)
+        return text
+
+    def score(self, reference, hypothesis):
+        # one normalization and one alignment, exact substitutions, deletions and insertions
+        return score(self.transformation, reference, hypothesis, self.vocabulary)
+
     def compute_wer(self, reference, hypothesis):
+        import jiwer
+
         reference_transformed = self.transformation(reference)
         hypothesis_transformed = self.transformation(hypothesis)
         return jiwer.wer(reference_transformed, hypothesis_transformed)
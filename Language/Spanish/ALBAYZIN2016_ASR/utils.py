@@ -2,9 +2,17 @@ import pandas as pd
 import os
 from pathlib import Path
 from tqdm import tqdm
+from worker_pool import completion_order, pooled, request_key
+from corpus_manifest import audio_durations
+from results_sink import ResultsSink
+from hypothesis_cache import HypothesisNotCached
 import xml.etree.ElementTree as ET
+from multiprocessing import Pool
 import re
 
+ALT_PATTERN = re.compile(r'{%.*?%}')
+COMMENT_PATTERN = re.compile(r'\{.*?\}')
+
 #################
 # PREPROCESSING #
 #################
@@ -21,65 +29,85 @@ def create_dir(path):
 
 def parse_xml(xml_file):
     """Parse the XML file and return the transcription data."""
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-
     all_data = []
-
-    for unit in root.findall(".//UNIT"):
-        start_time = float(unit.attrib["startTime"])
-        end_time = float(unit.attrib["endTime"])
-        transcription = unit.text if unit.text else ""  # noneyype
-        transcription = transcription.strip()
-        all_data.append({
-            'transcript': transcription,
-            'start_time': start_time,
-            'end_time': end_time
-        })
+    # UNITs are streamed, every element is emptied once it is closed
+    for _, element in ET.iterparse(xml_file):
+        if element.tag == 'UNIT':
+            start_time = float(element.attrib["startTime"])
+            end_time = float(element.attrib["endTime"])
+            transcription = element.text if element.text else ""  # noneyype
+            transcription = transcription.strip()
+            all_data.append({
+                'transcript': transcription,
+                'start_time': start_time,
+                'end_time': end_time
+            })
+        element.clear()
     return all_data
 
 def clean_transcriptions(transcription):
+    # same steps in the same order, removing one mark can complete another one
     transcription = transcription.replace("¤", "").replace("=", "").replace("xxx", "").replace("hhh", "")
-    alt_pattern = re.compile(r'{%.*?%}')
-    transcription = re.sub(alt_pattern, '', transcription)
-    comment_pattern = re.compile(r'\{.*?\}')
-    transcription = re.sub(comment_pattern, '', transcription)
+    if "{" in transcription:  # both patterns start with a brace
+        transcription = ALT_PATTERN.sub('', transcription)
+        transcription = COMMENT_PATTERN.sub('', transcription)
     transcription = transcription.replace(" / ", " ").replace(" // ", " ").replace("[/]", "")
     transcription = transcription.replace(">", "").replace("eh", "").replace("mm", "").replace("&eh", "").replace("ah e a", "")
-    transcription = " ".join(transcription.split()).strip()
-    transcription = transcription.lstrip()
-    return transcription
+    return " ".join(transcription.split())
 
-def load_data(stt, prompt_path, wave_path):
-    all_data = []
-    
+def read_session(xml_path, audio_path):
+    """Cleaned UNITs of one session, as (transcript, start_time, end_time, wav_filename) rows."""
+    return [(clean_transcriptions(entry['transcript']), entry['start_time'], entry['end_time'], audio_path)
+            for entry in parse_xml(xml_path)]
+
+def read_sessions(prompt_path, wave_path, workers=None):
+    sessions = []
     for xml_file in os.listdir(prompt_path):
         if xml_file.endswith('.xml'):
             print(f"Processing ---> {xml_file}")
-            parsed_data = parse_xml(os.path.join(prompt_path, xml_file))
-            for entry in parsed_data:
-                entry['transcript'] = clean_transcriptions(entry['transcript'])
-                full_audio_path = os.path.join(wave_path, xml_file.replace('.xml', '.wav'))
-                if os.path.exists(full_audio_path):
-                    entry['wav_filename'] = full_audio_path
-                    all_data.append(entry)
-
-    df = pd.DataFrame(all_data)
-    total_words = df['transcript'].apply(lambda x: len(stt.transformation(x).split())).sum()
+            full_audio_path = os.path.join(wave_path, xml_file.replace('.xml', '.wav'))
+            # sessions without their recording are left out
+            if os.path.exists(full_audio_path):
+                sessions.append((os.path.join(prompt_path, xml_file), full_audio_path))
+
+    # the sessions are parsed by a pool of processes, in their listing order
+    workers = min(workers or os.cpu_count() or 1, len(sessions))
+    if workers > 1:
+        with Pool(workers) as pool:
+            rows = pool.starmap(read_session, sessions)
+    else:
+        rows = [read_session(xml_path, audio_path) for xml_path, audio_path in sessions]
+
+    return pd.DataFrame([row for session in rows for row in session], columns=['transcript', 'start_time', 'end_time', 'wav_filename'])
+
+def load_data(stt, prompt_path, wave_path, manifest=None):
+    if manifest is not None:
+        xml_files = [os.path.join(prompt_path, xml_file) for xml_file in os.listdir(prompt_path) if xml_file.endswith('.xml')]
+        return manifest.load(lambda: read_sessions(prompt_path, wave_path), stt.transformation, 'wav_filename', 'transcript',
+                             audio_dir=wave_path, sources=[prompt_path, wave_path, *xml_files])
+    df = read_sessions(prompt_path, wave_path)
+    total_words = stt.transformation.count_words(df['transcript'])
     return df, int(total_words)
 
 ####################
 # PROCESSING AUDIO #
 ####################
-def transcribe_audio(stt, audio_path, reference, start_time, end_time, logger):
+def transcribe_audio(stt, audio_path, reference, start_time, end_time, logger, audio=None):
     if reference is None or reference.strip() == "":
         logger.info(f"Reference transcription missing or empty for {audio_path}. Skipping.")
         return None
     try:
-        hypothesis = stt.run(audio_path, start_time=start_time, end_time=end_time)
+        if audio is not None:
+            # the recording is already decoded, a cache miss takes a view of the segment
+            hypothesis = stt.run_segment(audio_path, start_time, end_time, audio)
+        else:
+            hypothesis = stt.run(audio_path, start_time=start_time, end_time=end_time)
         if hypothesis is None or hypothesis.strip() == "":
             logger.info(f"Hypothesis missing or empty for {audio_path}. Skipping.")
             return None
+    except HypothesisNotCached:
+        logger.info(f"No cached hypothesis for {audio_path}. Skipping.")
+        return None
     except FileNotFoundError:
         logger.info(f"File {audio_path} does not exist. Skipping.")
         return None
@@ -88,48 +116,79 @@ def transcribe_audio(stt, audio_path, reference, start_time, end_time, logger):
         return None
 
     try:
-        reference_transformed = stt.transformation(reference)
-        hypothesis_transformed = stt.transformation(hypothesis)
-
-        wer = stt.compute_wer(reference_transformed, hypothesis_transformed)
-        word_count = stt.compute_word_count(reference_transformed)
-        error_count = stt.compute_error_count(wer, word_count)
-    
-        return wer, word_count, reference_transformed, hypothesis_transformed, error_count
+        return stt.score(reference, hypothesis)
     except ValueError as e:
         logger.error(f"Error computing WER for file {audio_path}: {e}")
         return None
 
-def process_audios(stt, validation_df, total_audios, path, logger):
-    results_df = pd.DataFrame(columns=['audio_file', 'reference', 'hypothesis', 'wer', 'words', 'errors'])
-
-    for idx, row in tqdm(validation_df.iterrows(), total=total_audios, desc="Processing audios"):
-    # for idx, row in tqdm(validation_df.head(1).iterrows(), total=total_audios, desc="Processing audios"):
-        # if idx < 520:
-        #     continue
-        audio_file = row['wav_filename']
-        reference = row['transcript']
-        audio_path = path / audio_file
-
-        result = transcribe_audio(stt, audio_path, reference, row['start_time'], row['end_time'], logger)
-        if result is not None:
-            wer, word_count, reference_transformed, hypothesis_transformed, error_count = result
-            results_df.loc[idx] = [audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count]
-            processing_info(idx+1, total_audios, audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, logger)
-    return results_df
-
-def calculate_wwer(stt, results_df, total_audios, total_words, audio_path, database, logger):
-    total_errors = results_df['errors'].sum()
+def process_audios(stt, validation_df, total_audios, path, logger, results_path=None, resume=False, workers=1):
+    results = ResultsSink(results_path, resume)
+    if resume:
+        logger.info(f"Resuming from {results_path}: {len(results)} utterances already done")
+    keys = [request_key(path / row['wav_filename'], row['start_time'], row['end_time']) for _, row in validation_df.iterrows()]
+    stt = pooled(stt, results.pending(keys), workers, durations=audio_durations(validation_df), logger=logger)
+
+    # every session file holds many segments, decode it once and slice the rest
+    with tqdm(total=total_audios, desc="Processing audios") as progress:
+        # a session comes back from the pool with all its segments
+        sessions = validation_df.groupby('wav_filename', sort=False)
+        session_files = validation_df['wav_filename'].unique()
+        for position in completion_order(stt, [request_key(path / audio_file) for audio_file in session_files]):
+            audio_file = session_files[position]
+            segments_df = sessions.get_group(audio_file)
+            audio_path = path / audio_file
+            if all(request_key(audio_path, start_time, end_time) in results
+                   for start_time, end_time in zip(segments_df['start_time'], segments_df['end_time'])):
+                progress.update(len(segments_df))
+                continue
+            try:
+                # with workers the segments are decoded and sliced in the pool,
+                # --rescore-only reads every segment from the hypothesis cache
+                audio = stt.load_audio(audio_path) if workers <= 1 and not stt.rescore_only else None
+            except FileNotFoundError:
+                logger.info(f"File {audio_path} does not exist. Skipping.")
+                progress.update(len(segments_df))
+                continue
+            except OSError as e:
+                logger.error(f"OS error occurred when processing file {audio_path}: {e}")
+                progress.update(len(segments_df))
+                continue
+
+            for idx, row in segments_df.iterrows():
+                reference = row['transcript']
+                key = request_key(audio_path, row['start_time'], row['end_time'])
+                if key in results:
+                    progress.update(1)
+                    continue
+                result = transcribe_audio(stt, audio_path, reference, row['start_time'], row['end_time'], logger, audio=audio)
+                if result is not None:
+                    wer, word_count, reference_transformed, hypothesis_transformed, error_count, *edits = result
+                    results.append([audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, *edits], key)
+                    processing_info(idx+1, total_audios, audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, logger)
+                progress.update(1)
+    results.close(order=keys)
+    return results
+
+def calculate_wwer(stt, results, total_audios, total_words, audio_path, database, logger):
+    total_errors = results.total_errors
     wwer = total_errors / total_words
-    mean_wer = results_df['wer'].mean()
+    mean_wer = results.mean_wer
 
     wwer_info(total_audios, total_words, total_errors, wwer, mean_wer, logger)
+    logger.info(f"Substitutions: \t{results.total_substitutions}")
+    logger.info(f"Deletions: \t{results.total_deletions}")
+    logger.info(f"Insertions: \t{results.total_insertions}")
     save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, logger)
 
 
 ##################
 # SAVING RESULTS #
 ##################
+def results_file(stt, database):
+    file_name = f"{database}/results/{stt.config['name'].replace('.', '_')}_{database}.csv"
+    file_name = file_name.replace(' ', '_')
+    return file_name
+
 def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, logger):
     final_results_df = pd.DataFrame({
         'model': [stt.config['name'].replace(" ", "_")],
@@ -142,8 +201,7 @@ def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_
         'mean_wer': [mean_wer]
     })
     try:
-        file_name = f"{database}/results/{stt.config['name'].replace('.', '_')}_{database}.csv"
-        file_name = file_name.replace(' ', '_')
+        file_name = results_file(stt, database)
         with open(file_name, 'w') as file:
             final_results_df.to_csv(file, index=False)
             logger.info(f"Final results saved in {os.path.abspath(file_name)}")
@@ -2,6 +2,9 @@ import pandas as pd
 import os
 from pathlib import Path
 from tqdm import tqdm
+from worker_pool import completion_order, pooled, request_key
+from results_sink import ResultsSink
+from hypothesis_cache import HypothesisNotCached
 import codecs
 
 #################
@@ -45,15 +48,22 @@ def load_data(prompt_path, wave_path):
 ####################
 # PROCESSING AUDIO #
 ####################
-def transcribe_audio(stt, audio_path, reference, start_time, end_time, logger):
+def transcribe_audio(stt, audio_path, reference, start_time, end_time, logger, audio=None):
     if reference is None or reference.strip() == "":
         logger.info(f"Reference transcription missing or empty for {audio_path}. Skipping.")
         return None
     try:
-        hypothesis = stt.run(audio_path, start_time=start_time, end_time=end_time)
+        if audio is not None:
+            # the recording is already decoded, a cache miss takes a view of the segment
+            hypothesis = stt.run_segment(audio_path, start_time, end_time, audio)
+        else:
+            hypothesis = stt.run(audio_path, start_time=start_time, end_time=end_time)
         if hypothesis is None or hypothesis.strip() == "":
             logger.info(f"Hypothesis missing or empty for {audio_path}. Skipping.")
             return None
+    except HypothesisNotCached:
+        logger.info(f"No cached hypothesis for {audio_path}. Skipping.")
+        return None
     except FileNotFoundError:
         logger.info(f"File {audio_path} does not exist. Skipping.")
         return None
@@ -61,43 +71,76 @@ def transcribe_audio(stt, audio_path, reference, start_time, end_time, logger):
         logger.error(f"OS error occurred when processing file {audio_path}: {e}")
         return None
 
-    reference_transformed = stt.transformation(reference)
-    hypothesis_transformed = stt.transformation(hypothesis)
-
-    wer = stt.compute_wer(reference_transformed, hypothesis_transformed)
-    word_count = stt.compute_word_count(reference_transformed)
-    error_count = stt.compute_error_count(wer, word_count)
-    
-    return wer, word_count, reference_transformed, hypothesis_transformed, error_count
-
-def process_audios(stt, validation_df, total_audios, path, logger):
-    results_df = pd.DataFrame(columns=['audio_file', 'reference', 'hypothesis', 'wer', 'words', 'errors'])
-
-    for idx, row in tqdm(validation_df.iterrows(), total=total_audios, desc="Processing audios"):
-    # for idx, row in tqdm(validation_df.head(5).iterrows(), total=total_audios, desc="Processing audios"):
-        audio_file = row['wav_filename']
-        reference = row['transcript']
-        audio_path = path / audio_file
-
-        result = transcribe_audio(stt, audio_path, reference, row['start_time'], row['end_time'], logger)
-        if result is not None:
-            wer, word_count, reference_transformed, hypothesis_transformed, error_count = result
-            results_df.loc[idx] = [audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count]
-            processing_info(idx+1, total_audios, audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, logger)
-    return results_df
-
-def calculate_wwer(stt, results_df, total_audios, total_words, audio_path, database, logger):
-    total_errors = results_df['errors'].sum()
+    return stt.score(reference, hypothesis)
+
+def process_audios(stt, validation_df, total_audios, path, logger, results_path=None, resume=False, workers=1):
+    results = ResultsSink(results_path, resume)
+    if resume:
+        logger.info(f"Resuming from {results_path}: {len(results)} utterances already done")
+    keys = [request_key(path / row['wav_filename'], row['start_time'], row['end_time']) for _, row in validation_df.iterrows()]
+    stt = pooled(stt, results.pending(keys), workers, logger=logger)
+
+    # every session file holds many segments, decode it once and slice the rest
+    with tqdm(total=total_audios, desc="Processing audios") as progress:
+        # a session comes back from the pool with all its segments
+        sessions = validation_df.groupby('wav_filename', sort=False)
+        session_files = validation_df['wav_filename'].unique()
+        for position in completion_order(stt, [request_key(path / audio_file) for audio_file in session_files]):
+            audio_file = session_files[position]
+            segments_df = sessions.get_group(audio_file)
+            audio_path = path / audio_file
+            if all(request_key(audio_path, start_time, end_time) in results
+                   for start_time, end_time in zip(segments_df['start_time'], segments_df['end_time'])):
+                progress.update(len(segments_df))
+                continue
+            try:
+                # with workers the segments are decoded and sliced in the pool,
+                # --rescore-only reads every segment from the hypothesis cache
+                audio = stt.load_audio(audio_path) if workers <= 1 and not stt.rescore_only else None
+            except FileNotFoundError:
+                logger.info(f"File {audio_path} does not exist. Skipping.")
+                progress.update(len(segments_df))
+                continue
+            except OSError as e:
+                logger.error(f"OS error occurred when processing file {audio_path}: {e}")
+                progress.update(len(segments_df))
+                continue
+
+            for idx, row in segments_df.iterrows():
+                reference = row['transcript']
+                key = request_key(audio_path, row['start_time'], row['end_time'])
+                if key in results:
+                    progress.update(1)
+                    continue
+                result = transcribe_audio(stt, audio_path, reference, row['start_time'], row['end_time'], logger, audio=audio)
+                if result is not None:
+                    wer, word_count, reference_transformed, hypothesis_transformed, error_count, *edits = result
+                    results.append([audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, *edits], key)
+                    processing_info(idx+1, total_audios, audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, logger)
+                progress.update(1)
+    results.close(order=keys)
+    return results
+
+def calculate_wwer(stt, results, total_audios, total_words, audio_path, database, logger):
+    total_errors = results.total_errors
     wwer = total_errors / total_words
-    mean_wer = results_df['wer'].mean()
+    mean_wer = results.mean_wer
 
     wwer_info(total_audios, total_words, total_errors, wwer, mean_wer, logger)
+    logger.info(f"Substitutions: \t{results.total_substitutions}")
+    logger.info(f"Deletions: \t{results.total_deletions}")
+    logger.info(f"Insertions: \t{results.total_insertions}")
     save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, logger)
 
 
 ##################
 # SAVING RESULTS #
 ##################
+def results_file(stt, database):
+    file_name = f"{database}/results/{stt.config['name'].replace('.', '_')}_{database}.csv"
+    file_name = file_name.replace(' ', '_')
+    return file_name
+
 def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, logger):
     final_results_df = pd.DataFrame({
         'model': [stt.config['name'].replace(" ", "_")],
@@ -110,8 +153,7 @@ def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_
         'mean_wer': [mean_wer]
     })
     try:
-        file_name = f"{database}/results/{stt.config['name'].replace('.', '_')}_{database}.csv"
-        file_name = file_name.replace(' ', '_')
+        file_name = results_file(stt, database)
         with open(file_name, 'w') as file:
             final_results_df.to_csv(file, index=False)
             logger.info(f"Final results saved in {os.path.abspath(file_name)}")
@@ -1,19 +1,43 @@
-from model_config_xz import *
-from stt_class_xz import STT
-from .utils import *
-
 from logger_config import setup_file_logging
+from cli_check import check_inputs
+from clip_index import DEFAULT_PATH as DEFAULT_CLIP_INDEX
 from pathlib import Path
 import argparse
+import sys
 
 def main():
     parser = argparse.ArgumentParser(description="Insert the audio and text file to be processed.")
     parser.add_argument('-a', '--audio-path', required=True, help='Path to audio files directory.')
     parser.add_argument('-t', '--text-path', required=True, help='Path to text metadata file.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes transcribing in parallel, each one loads its own model.')
+    parser.add_argument('--results-format', choices=('csv', 'parquet'), default='csv', help='Format of the per utterance results, written next to the summary csv.')
+    parser.add_argument('--clip-index', default=DEFAULT_CLIP_INDEX, help='SQLite index of the clips already transcribed in any Common Voice release, shared by v9, v12 and v15.')
+    parser.add_argument('--no-clip-index', action='store_true', help='Transcribe every clip, without the clip index.')
+    parser.add_argument('--delta-from', nargs='+', metavar='RESULTS', help='Per utterance results of earlier releases with the same model: their clips are added to the clip index, so only the new clips are transcribed.')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted run from its per utterance results, skipping the utterances already done.')
+    parser.add_argument('--daemon', metavar='SOCKET', help='Unix socket of a running stt_daemon.py, the model is then not loaded by this script.')
+    parser.add_argument('--rescore-only', action='store_true', help='Recompute WER and WWER from the cached hypotheses, without loading the model.')
+    parser.add_argument('--check', action='store_true', help='Only validate the arguments, the paths and the model files, without loading anything.')
     args = parser.parse_args()
+    if args.delta_from and args.no_clip_index:
+        parser.error('--delta-from needs the clip index')
 
     language_code = 'es'
-    stt = STT(language_code)
+
+    if args.check:
+        sys.exit(check_inputs(args, language_code))
+
+    # pandas, the STT runtime and the decoders are only imported once the arguments are valid
+    from stt_class_xz import STT
+    from stt_daemon import STTClient
+    from results_sink import utterances_path
+    from clip_index import ClipIndex
+    from .utils import calculate_wwer, create_dir, header_info, load_data, process_audios, results_file, short_db_name
+
+    if args.rescore_only:
+        stt = STT(language_code, rescore_only=True)
+    else:
+        stt = STTClient(args.daemon, language_code) if args.daemon else STT(language_code)
 
     path = Path(args.audio_path)
     database = create_dir(path)
@@ -25,8 +49,12 @@ def main():
     sub_db_name = short_db_name(path)
     header_info(stt, path, total_audios, total_words, sub_db_name, logger)
 
-    results_df = process_audios(stt, validation_df, total_audios, path, logger)
-    calculate_wwer(stt, results_df, total_audios, total_words, path, database, logger)
+    results_path = utterances_path(results_file(stt, database), args.results_format)
+    clips = None if args.no_clip_index else ClipIndex(args.clip_index, stt.config['name'], stt.decoder_config())
+    for delta_path in args.delta_from or []:
+        logger.info(f"{clips.import_results(delta_path)} clips imported from {delta_path}")
+    results = process_audios(stt, validation_df, total_audios, path, logger, results_path=results_path, resume=args.resume, workers=args.workers, clips=clips)
+    calculate_wwer(stt, results, total_audios, total_words, path, database, logger)
 
 if __name__ == "__main__":
     main()
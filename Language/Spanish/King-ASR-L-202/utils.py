@@ -2,6 +2,10 @@ import pandas as pd
 import os
 from pathlib import Path
 from tqdm import tqdm
+from worker_pool import completion_order, pooled, request_key, rows_in_order
+from corpus_manifest import audio_durations
+from results_sink import ResultsSink
+from hypothesis_cache import HypothesisNotCached
 import codecs
 
 #################
@@ -18,7 +22,7 @@ def create_dir(path):
         os.makedirs(f'{database}/results/')
     return database
 
-def load_data(stt, prompt_path, wave_path):
+def read_transcripts(prompt_path, wave_path):
     all_data = []
     for txt_file in os.listdir(prompt_path):
         print(f"Processing text file ----> {txt_file}")
@@ -37,8 +41,15 @@ def load_data(stt, prompt_path, wave_path):
                         })
                 else:
                     continue
-    df = pd.DataFrame(all_data)
-    total_words = df['transcript'].apply(lambda x: len(stt.transformation(x).split())).sum()
+    return pd.DataFrame(all_data)
+
+def load_data(stt, prompt_path, wave_path, manifest=None):
+    if manifest is not None:
+        txt_files = [os.path.join(prompt_path, txt_file) for txt_file in os.listdir(prompt_path)]
+        return manifest.load(lambda: read_transcripts(prompt_path, wave_path), stt.transformation, 'wav_filename', 'transcript',
+                             audio_dir=wave_path, sources=[prompt_path, wave_path, *txt_files])
+    df = read_transcripts(prompt_path, wave_path)
+    total_words = stt.transformation.count_words(df['transcript'])
     return df, int(total_words)
 
 
@@ -54,6 +65,9 @@ def transcribe_audio(stt, audio_path, reference, logger):
         if hypothesis is None or hypothesis.strip() == "":
             logger.info(f"Hypothesis missing or empty for {audio_path}. Skipping.")
             return None
+    except HypothesisNotCached:
+        logger.info(f"No cached hypothesis for {audio_path}. Skipping.")
+        return None
     except FileNotFoundError:
         logger.info(f"File {audio_path} does not exist. Skipping.")
         return None
@@ -61,44 +75,54 @@ def transcribe_audio(stt, audio_path, reference, logger):
         logger.error(f"OS error occurred when processing file {audio_path}: {e}")
         return None
 
-    reference_transformed = stt.transformation(reference)
-    hypothesis_transformed = stt.transformation(hypothesis)
-
-    wer = stt.compute_wer(reference_transformed, hypothesis_transformed)
-    word_count = stt.compute_word_count(reference_transformed)
-    error_count = stt.compute_error_count(wer, word_count)
-    
-    return wer, word_count, reference_transformed, hypothesis_transformed, error_count
+    return stt.score(reference, hypothesis)
 
-def process_audios(stt, validation_df, total_audios, path, logger):
-    results_df = pd.DataFrame(columns=['audio_file', 'reference', 'hypothesis', 'wer', 'words', 'errors'])
+def process_audios(stt, validation_df, total_audios, path, logger, results_path=None, resume=False, workers=1):
+    results = ResultsSink(results_path, resume)
+    if resume:
+        logger.info(f"Resuming from {results_path}: {len(results)} utterances already done")
+    keys = [request_key(path / row['wav_filename']) for _, row in validation_df.iterrows()]
+    stt = pooled(stt, results.pending(keys), workers, durations=audio_durations(validation_df), logger=logger)
 
-    for idx, row in tqdm(validation_df.iterrows(), total=total_audios, desc="Processing audios"):
+    for idx, row in tqdm(rows_in_order(validation_df, completion_order(stt, keys)), total=total_audios, desc="Processing audios"):
     # for idx, row in tqdm(validation_df.head(1).iterrows(), total=5, desc="Processing audios"):
         audio_file = row['wav_filename']
         reference = row['transcript']
         audio_path = path / audio_file
 
+        key = request_key(audio_path)
+        if key in results:
+            continue
         result = transcribe_audio(stt, audio_path, reference, logger)
         if result is not None:
-            wer, word_count, reference_transformed, hypothesis_transformed, error_count = result
-            results_df.loc[idx] = [audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count]
+            wer, word_count, reference_transformed, hypothesis_transformed, error_count, *edits = result
+            results.append([audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, *edits], key)
             processing_info(idx+1, total_audios, audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, logger)
     
-    return results_df
+    results.close(order=keys)
+    
+    return results
 
-def calculate_wwer(stt, results_df, total_audios, total_words, audio_path, database, logger):
-    total_errors = results_df['errors'].sum()
+def calculate_wwer(stt, results, total_audios, total_words, audio_path, database, logger):
+    total_errors = results.total_errors
     wwer = total_errors / total_words
-    mean_wer = results_df['wer'].mean()
+    mean_wer = results.mean_wer
 
     wwer_info(total_audios, total_words, total_errors, wwer, mean_wer, logger)
+    logger.info(f"Substitutions: \t{results.total_substitutions}")
+    logger.info(f"Deletions: \t{results.total_deletions}")
+    logger.info(f"Insertions: \t{results.total_insertions}")
     save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, logger)
 
 
 ##################
 # SAVING RESULTS #
 ##################
+def results_file(stt, database):
+    file_name = f"{database}/results/{stt.config['name'].replace('.', '_')}_{database}.csv"
+    file_name = file_name.replace(' ', '_')
+    return file_name
+
 def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, logger):
     final_results_df = pd.DataFrame({
         'model': [stt.config['name'].replace(" ", "_")],
@@ -111,8 +135,7 @@ def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_
         'wer': [mean_wer]
     })
     try:
-        file_name = f"{database}/results/{stt.config['name'].replace('.', '_')}_{database}.csv"
-        file_name = file_name.replace(' ', '_')
+        file_name = results_file(stt, database)
         with open(file_name, 'w') as file:
             final_results_df.to_csv(file, index=False)
             logger.info(f"Final results saved in {os.path.abspath(file_name)}")
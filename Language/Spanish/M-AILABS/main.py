@@ -1,32 +1,56 @@
-from model_config_xz import *
-from stt_class_xz import STT
-from .utils import *
-
 from logger_config import setup_file_logging
+from cli_check import check_inputs
 from pathlib import Path
 import argparse
+import sys
 
 def main():
     parser = argparse.ArgumentParser(description="Insert the audio and text file to be processed.")
     parser.add_argument('-a', '--audio-path', required=True, help='Path to audio files directory.')
     parser.add_argument('-t', '--text-path', required=True, help='Path to text metadata file.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes transcribing in parallel, each one loads its own model.')
+    parser.add_argument('--results-format', choices=('csv', 'parquet'), default='csv', help='Format of the per utterance results, written next to the summary csv.')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted run from its per utterance results, skipping the utterances already done.')
+    parser.add_argument('--daemon', metavar='SOCKET', help='Unix socket of a running stt_daemon.py, the model is then not loaded by this script.')
+    parser.add_argument('--rescore-only', action='store_true', help='Recompute WER and WWER from the cached hypotheses, without loading the model.')
+    parser.add_argument('--no-manifest', action='store_true', help='Read the transcripts and list the audio files again, without the corpus manifest.')
+    parser.add_argument('--refresh-manifest', action='store_true', help='Rebuild the corpus manifest from the transcripts, only the audio files whose size or mtime changed are probed again.')
+    parser.add_argument('--check', action='store_true', help='Only validate the arguments, the paths and the model files, without loading anything.')
     args = parser.parse_args()
+    if args.refresh_manifest and args.no_manifest:
+        parser.error('--refresh-manifest needs the corpus manifest')
 
     language_code = 'es'
-    stt = STT(language_code)
+
+    if args.check:
+        sys.exit(check_inputs(args, language_code))
+
+    # pandas, the STT runtime and the decoders are only imported once the arguments are valid
+    from stt_class_xz import STT
+    from stt_daemon import STTClient
+    from results_sink import utterances_path
+    from corpus_manifest import CorpusManifest
+    from .utils import calculate_wwer, create_dir, header_info, load_data, long_db_name, process_audios, results_file, short_db_name
+
+    if args.rescore_only:
+        stt = STT(language_code, rescore_only=True)
+    else:
+        stt = STTClient(args.daemon, language_code) if args.daemon else STT(language_code)
 
     path = Path(args.audio_path)
     database = create_dir(path)
 
     logger = setup_file_logging(f'{database}/logs/{database}_{language_code}_model.log')
 
-    validation_df, total_words = load_data(stt, args.text_path)
+    manifest = None if args.no_manifest else CorpusManifest(f'{database}/manifests/{long_db_name(path)}.parquet', refresh=args.refresh_manifest)
+    validation_df, total_words = load_data(stt, args.text_path, path, manifest=manifest)
     total_audios = len(validation_df)
     sub_db_name = short_db_name(path)
     header_info(stt, path, total_audios, total_words, sub_db_name, logger)
 
-    results_df = process_audios(stt, validation_df, total_audios, path, logger)
-    calculate_wwer(stt, results_df, total_audios, total_words, path, database, logger)
+    results_path = utterances_path(results_file(stt, database), args.results_format)
+    results = process_audios(stt, validation_df, total_audios, path, logger, results_path=results_path, resume=args.resume, workers=args.workers)
+    calculate_wwer(stt, results, total_audios, total_words, path, database, logger)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,9 +2,12 @@ import pandas as pd
 import os
 from pathlib import Path
 from tqdm import tqdm
-from pydub import AudioSegment
-from pydub.silence import split_on_silence
-from stt_class_xz import *
+from silence import silence_chunks
+from audio_probe import header_duration
+from hypothesis_cache import HypothesisNotCached
+
+SEGMENT_THRESHOLD = 11  # seconds, longer recordings are split on silences
+
 #################
 # PREPROCESSING #
 #################
@@ -69,10 +72,10 @@ def load_data(stt, prompt_path, wave_path, logger):
 ####################
 # PROCESSING AUDIO #
 ####################
-def segment_audio(audio_path, logger, min_silence_len=500, silence_thresh=-30, keep_silence=200):
-    sound = AudioSegment.from_file(audio_path)
-    chunks = split_on_silence(
-        sound,
+def segment_audio(audio, sample_rate, logger, min_silence_len=500, silence_thresh=-30, keep_silence=200):
+    chunks = silence_chunks(
+        audio,
+        sample_rate,
         min_silence_len=min_silence_len,
         silence_thresh=silence_thresh,
         keep_silence=keep_silence
@@ -80,34 +83,38 @@ def segment_audio(audio_path, logger, min_silence_len=500, silence_thresh=-30, k
     logger.info(f"Total segments created: {len(chunks)}")
     return chunks
 
-def transcribe_chunks(stt, chunks, sample_rate, logger):
+def transcribe_chunks(stt, audio_path, audio, sample_rate, chunks, logger):
     transcriptions = []
-    for i, chunk in enumerate(chunks):
-        temp_file_path = f"/tmp/chunk_{i}.wav"
-        chunk.export(temp_file_path, format="wav")
-        logger.info(f"Exporting chunk {i} to {temp_file_path}")
-
-        audio_data = read_wav(temp_file_path, sample_rate)
-        transcription = stt.model.stt(audio_data)
+    for i, (start, end) in enumerate(chunks):
+        # every chunk is a segment of the hypothesis cache, a miss transcribes a view of the decoded recording
+        transcription = stt.run_segment(audio_path, start / sample_rate, end / sample_rate, audio)
         transcriptions.append(transcription)
-
-        os.remove(temp_file_path)
-        logger.info(f"Processed and removed temporary file: {temp_file_path}")
+        logger.info(f"Processed chunk {i} [samples {start}:{end}]")
     return transcriptions
 
 def transcribe_audio(stt, audio_path, reference, logger):
     try:
-        sound = AudioSegment.from_file(audio_path)
-        duration_seconds = len(sound) / 1000
-
-        if duration_seconds >= 11:
-            logger.info(f"Audio is {duration_seconds} long, which is over 11 seconds, segmenting audio")
-            chunks = segment_audio(audio_path, logger)
-            transcriptions = transcribe_chunks(stt, chunks, stt.model.sampleRate(), logger=logger)
+        sample_rate = stt.sample_rate()
+        # the header is enough to choose, short files are decoded by stt.run (or not at all on a cache hit)
+        duration_seconds = header_duration(audio_path)
+        audio = None
+        if duration_seconds is None:
+            audio = stt.load_audio(audio_path)
+            duration_seconds = len(audio) / sample_rate
+
+        if duration_seconds >= SEGMENT_THRESHOLD:
+            logger.info(f"Audio is {duration_seconds} long, which is over {SEGMENT_THRESHOLD} seconds, segmenting audio")
+            if audio is None:
+                audio = stt.load_audio(audio_path)
+            chunks = segment_audio(audio, sample_rate, logger)
+            transcriptions = transcribe_chunks(stt, audio_path, audio, sample_rate, chunks, logger=logger)
             hypothesis = " ".join(transcriptions)  # concatenate transcriptions
         else:
-            logger.info(f"Audio is {duration_seconds} long, which is less than 11 seconds, processing whole audio")
-            hypothesis = stt.run(audio_path)
+            logger.info(f"Audio is {duration_seconds} long, which is less than {SEGMENT_THRESHOLD} seconds, processing whole audio")
+            hypothesis = stt.run_segment(audio_path, None, None, audio) if audio is not None else stt.run(audio_path)
+    except HypothesisNotCached:
+        logger.info(f"No cached hypothesis for {audio_path}. Skipping.")
+        return None
     except FileNotFoundError:
         logger.info(f"File {audio_path} does not exist. Skipping.")
         return None
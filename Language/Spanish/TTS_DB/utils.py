@@ -2,6 +2,10 @@ import pandas as pd
 import os
 from pathlib import Path
 from tqdm import tqdm
+from worker_pool import completion_order, pooled, request_key, rows_in_order
+from corpus_manifest import audio_durations
+from results_sink import ResultsSink
+from hypothesis_cache import HypothesisNotCached
 import re
 
 #################
@@ -36,11 +40,7 @@ def clean_text(text):
     text = re.sub(r'lehendakari', 'lendakari', text)
     return text
 
-def load_data(stt, prompt_path=None, wave_path=None, combined_path=None):
-    if combined_path:
-        prompt_path = combined_path
-        wave_path = combined_path
-
+def read_transcripts(prompt_path, wave_path):
     wav_files = [file for file in os.listdir(wave_path) if file.endswith('.wav')]
     if not wav_files:
         raise ValueError("No audio file found in the directory.")
@@ -69,7 +69,18 @@ def load_data(stt, prompt_path=None, wave_path=None, combined_path=None):
         'transcript': transcripts
     })
 
-    total_words = validation_df['transcript'].apply(lambda x: len(stt.transformation(x).split())).sum()
+    return validation_df
+
+def load_data(stt, prompt_path=None, wave_path=None, combined_path=None, manifest=None):
+    if combined_path:
+        prompt_path = combined_path
+        wave_path = combined_path
+
+    if manifest is not None:
+        return manifest.load(lambda: read_transcripts(prompt_path, wave_path), stt.transformation, 'wav_filename', 'transcript',
+                             audio_dir=wave_path, sources=[prompt_path, wave_path])
+    validation_df = read_transcripts(prompt_path, wave_path)
+    total_words = stt.transformation.count_words(validation_df['transcript'])
     return validation_df, total_words
 
 ####################
@@ -85,17 +96,15 @@ def transcribe_audio(stt, audio_path, reference, logger):
             logger.info(f"Hypothesis missing or empty for {audio_path}. Skipping.")
             return None
 
-        reference_transformed = stt.transformation(reference)
-        hypothesis_transformed = stt.transformation(hypothesis)
+        result = stt.score(reference, hypothesis)
 
-        if not reference_transformed.strip() or not hypothesis_transformed.strip():
+        if not result.reference.strip() or not result.hypothesis.strip():
             logger.info(f"Empty transformed reference or hypothesis for {audio_path}. Skipping WER calculation.")
             return None
-
-        wer = stt.compute_wer(reference_transformed, hypothesis_transformed)
-        word_count = stt.compute_word_count(reference_transformed)
-        error_count = stt.compute_error_count(wer, word_count)
     
+    except HypothesisNotCached:
+        logger.info(f"No cached hypothesis for {audio_path}. Skipping.")
+        return None
     except FileNotFoundError:
         logger.info(f"File {audio_path} does not exist. Skipping.")
         return None
@@ -103,36 +112,52 @@ def transcribe_audio(stt, audio_path, reference, logger):
         logger.error(f"OS error occurred when processing file {audio_path}: {e}")
         return None
 
-    return wer, word_count, reference_transformed, hypothesis_transformed, error_count
+    return result
 
-def process_audios(stt, validation_df, total_audios, path, logger):
-    results_df = pd.DataFrame(columns=['audio_file', 'reference', 'hypothesis', 'wer', 'words', 'errors'])
+def process_audios(stt, validation_df, total_audios, path, logger, results_path=None, resume=False, workers=1):
+    results = ResultsSink(results_path, resume)
+    if resume:
+        logger.info(f"Resuming from {results_path}: {len(results)} utterances already done")
+    keys = [request_key(path / row['wav_filename']) for _, row in validation_df.iterrows()]
+    stt = pooled(stt, results.pending(keys), workers, durations=audio_durations(validation_df), logger=logger)
     n_audios = 1
-    for idx, row in tqdm(validation_df.iterrows(), total=total_audios, desc="Processing audios"):
+    for idx, row in tqdm(rows_in_order(validation_df, completion_order(stt, keys)), total=total_audios, desc="Processing audios"):
     # for idx, row in tqdm(validation_df.head(n_audios).iterrows(), total=n_audios, desc="Processing audios"):
         audio_file = row['wav_filename']
         reference = row['transcript']
         audio_path = path / audio_file
 
+        key = request_key(audio_path)
+        if key in results:
+            continue
         result = transcribe_audio(stt, audio_path, reference, logger)
         if result is not None:
-            wer, word_count, reference_transformed, hypothesis_transformed, error_count = result
-            results_df.loc[idx] = [audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count]
+            wer, word_count, reference_transformed, hypothesis_transformed, error_count, *edits = result
+            results.append([audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, *edits], key)
             processing_info(idx+1, total_audios, audio_file, reference_transformed, hypothesis_transformed, wer, word_count, error_count, logger)
-    return results_df
+    results.close(order=keys)
+    return results
 
-def calculate_wwer(stt, results_df, total_audios, total_words, audio_path, database, speaker, logger):
-    total_errors = results_df['errors'].sum()
+def calculate_wwer(stt, results, total_audios, total_words, audio_path, database, speaker, logger):
+    total_errors = results.total_errors
     wwer = total_errors / total_words
-    mean_wer = results_df['wer'].mean()
+    mean_wer = results.mean_wer
 
     wwer_info(total_audios, total_words, total_errors, wwer, mean_wer, logger)
+    logger.info(f"Substitutions: \t{results.total_substitutions}")
+    logger.info(f"Deletions: \t{results.total_deletions}")
+    logger.info(f"Insertions: \t{results.total_insertions}")
     save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, speaker, logger)
 
 
 ##################
 # SAVING RESULTS #
 ##################
+def results_file(stt, database, speaker):
+    file_name = f"{database}/results/{speaker}/{stt.config['name'].replace('.', '_')}_{database}_{speaker}.csv"
+    file_name = file_name.replace(' ', '_')
+    return file_name
+
 def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_wer, audio_path, database, speaker, logger):
     final_results_df = pd.DataFrame({
         'model': [stt.config['name']],
@@ -146,8 +171,7 @@ def save_final_results(stt, total_audios, total_words, total_errors, wwer, mean_
         'wer': [mean_wer]
     })
     try:
-        file_name = f"{database}/results/{speaker}/{stt.config['name'].replace('.', '_')}_{database}_{speaker}.csv"
-        file_name = file_name.replace(' ', '_')
+        file_name = results_file(stt, database, speaker)
         with open(file_name, 'w') as file:
             final_results_df.to_csv(file, index=False)
     except Exception as e:
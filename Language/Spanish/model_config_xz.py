@@ -1,3 +1,9 @@
+# models are downloaded here, also read by the --check of every main.py
+INSTALL_DIR = "/home/aholab/santi/Documents/audio_process/Test/Language/models"
+
+# every model of STT_MODELS takes 16 kHz audio, known without loading one (--rescore-only)
+MODEL_SAMPLE_RATE = 16000
+
 STT_HOST = 'https://coqui.gateway.scarf.sh'
 STT_HOST_AHOLAB = 'https://aholab.ehu.eus/~xzuazo/models'
 
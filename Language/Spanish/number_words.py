@@ -0,0 +1,68 @@
+import re
+from functools import lru_cache
+
+# Numbers of a transcript spelled out, as the models output them. Every
+# number goes through one compiled `re.sub`, and its words come from a
+# memoized table per language: parliamentary transcripts repeat the same
+# years and article numbers on every line.
+#
+# num2words has no Basque, `eu` is converted here (vigesimal tens, "eta"
+# before the last part: 1984 -> "mila bederatziehun eta laurogeita lau").
+
+NUMBER = re.compile(r'\b\d+\b')
+NUMBER_CACHE_SIZE = 4096  # distinct (number, language) pairs kept
+
+BASQUE_UNITS = ('zero', 'bat', 'bi', 'hiru', 'lau', 'bost', 'sei', 'zazpi', 'zortzi', 'bederatzi',
+                'hamar', 'hamaika', 'hamabi', 'hamahiru', 'hamalau', 'hamabost', 'hamasei', 'hamazazpi',
+                'hemezortzi', 'hemeretzi')
+BASQUE_TWENTIES = ('', 'hogei', 'berrogei', 'hirurogei', 'laurogei')
+BASQUE_HUNDREDS = ('', 'ehun', 'berrehun', 'hirurehun', 'laurehun', 'bostehun', 'seiehun', 'zazpiehun',
+                   'zortziehun', 'bederatziehun')
+
+
+def _basque_below_hundred(number):
+    twenties, units = divmod(number, 20)
+    if not twenties:
+        return BASQUE_UNITS[units]
+    if not units:
+        return BASQUE_TWENTIES[twenties]
+    return f'{BASQUE_TWENTIES[twenties]}ta {BASQUE_UNITS[units]}'
+
+
+def basque_words(number):
+    """Basque cardinal of a non-negative integer."""
+    if number == 0:
+        return BASQUE_UNITS[0]
+    millions, rest = divmod(number, 1000000)
+    thousands, rest = divmod(rest, 1000)
+    hundreds, rest = divmod(rest, 100)
+    parts = []
+    if millions:
+        parts.append('milioi bat' if millions == 1 else f'{basque_words(millions)} milioi')
+    if thousands:
+        parts.append('mila' if thousands == 1 else f'{basque_words(thousands)} mila')
+    if hundreds:
+        parts.append(BASQUE_HUNDREDS[hundreds])
+    if rest:
+        parts.append(_basque_below_hundred(rest))
+    if len(parts) == 1:
+        return parts[0]
+    return f"{' '.join(parts[:-1])} eta {parts[-1]}"
+
+
+@lru_cache(maxsize=NUMBER_CACHE_SIZE)
+def number_to_words(number, lang):
+    """
+    :param number: string of digits.
+    :param lang: language code, `eu` or one of num2words.
+    """
+    if lang == 'eu':
+        return basque_words(int(number))
+    from num2words import num2words
+
+    return num2words(number, lang=lang)
+
+
+def replace_numbers(text, lang):
+    """Spells out every number of `text` in `lang`, where it stands."""
+    return NUMBER.sub(lambda match: number_to_words(match.group(), lang), text)
@@ -0,0 +1,63 @@
+from collections import namedtuple
+
+import jiwer
+
+from wer_kernel import edit_distance
+
+# Scoring of one utterance: both strings are normalized once and aligned once,
+# and the error count comes from the alignment instead of `wer * words`. The
+# first five fields are in the order `transcribe_audio` returns them.
+#
+# Every utterance, a MintzAI-ST talk included, goes through the same
+# `jiwer.process_words`, so the S/D/I split never depends on the length. Since
+# jiwer 3 the alignment is rapidfuzz's, whose memory stays linear in the length
+# (100k words take about 30 MB).
+#
+# --rescore-only scores whole corpora from the hypothesis cache. There the
+# errors come from the bit-parallel distance of wer_kernel.py, over word ids of
+# one `Vocabulary` per corpus. The split into S/D/I is forced when the distance
+# is 0 or the length difference (only deletions or only insertions), jiwer only
+# aligns the other utterances.
+
+
+class Score(namedtuple('Score', ['wer', 'words', 'reference', 'hypothesis', 'errors',
+                                 'substitutions', 'deletions', 'insertions'])):
+    """
+    :param wer: (float) word error rate of the utterance, as `jiwer.wer`.
+    :param words: (int) words in the normalized reference.
+    :param reference: normalized reference.
+    :param hypothesis: normalized hypothesis.
+    :param errors: (int) substitutions + deletions + insertions.
+    """
+
+    @property
+    def edits(self):
+        return self.substitutions, self.deletions, self.insertions
+
+
+def score(transformation, reference, hypothesis, vocabulary=None):
+    """
+    Normalizes `reference` and `hypothesis` with `transformation` and aligns them.
+
+    :param vocabulary: `wer_kernel.Vocabulary`, the errors are then computed
+        by the kernel and jiwer only aligns when the S/D/I split needs it.
+    :return: `Score` with the exact edit counts.
+    """
+    reference_transformed = transformation(reference)
+    hypothesis_transformed = transformation(hypothesis)
+    if vocabulary is not None:
+        reference_ids = vocabulary.word_ids(reference_transformed)
+        hypothesis_ids = vocabulary.word_ids(hypothesis_transformed)
+        words, errors = len(reference_ids), edit_distance(reference_ids, hypothesis_ids)
+        if errors == abs(words - len(hypothesis_ids)):
+            deletions, insertions = max(words - len(hypothesis_ids), 0), max(len(hypothesis_ids) - words, 0)
+            wer = errors / words if words else float(errors)
+            return Score(wer, words, reference_transformed, hypothesis_transformed, errors, 0, deletions, insertions)
+    # the strings are already normalized, process_words only splits them into words
+    output = jiwer.process_words(reference_transformed, hypothesis_transformed)
+    words = output.hits + output.substitutions + output.deletions
+    errors = output.substitutions + output.deletions + output.insertions
+    # as jiwer, the WER of an empty reference is its number of insertions
+    wer = errors / words if words else float(errors)
+    return Score(wer, words, reference_transformed, hypothesis_transformed, errors,
+                 output.substitutions, output.deletions, output.insertions)
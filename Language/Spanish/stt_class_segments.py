@@ -1,18 +1,15 @@
 from model_config_general import *
 
 from stt import Model
-import pydub
-import numpy as np
 import jiwer
-
-import logging
-logger = logging.getLogger("pydub.converter")
-logger.setLevel(logging.WARNING)
+from audio_io import load_audio, slice_segment
 
 class STT:
     def __init__(self, config):
         self.config = config
         self.model = None
+        self.audio_path = None
+        self.audio = None
         self.transformation = jiwer.Compose([
             jiwer.RemovePunctuation(),
             jiwer.ToLowerCase(),
@@ -23,13 +20,17 @@ class STT:
             self.model = Model(self.config['acoustic'])
             self.model.enableExternalScorer(self.config['scorer'])
 
+    def load_audio(self, audio_path):
+        # consecutive segments of the same recording reuse the decoded buffer
+        if audio_path != self.audio_path:
+            self.audio = load_audio(audio_path, self.model.sampleRate())
+            self.audio_path = audio_path
+        return self.audio
+
     def transcribe(self, audio_path, start_time, end_time):
-        sound = pydub.AudioSegment.from_file(audio_path)
-        segment = sound[start_time * 1000:end_time * 1000]
-        if segment.frame_rate != self.model.sampleRate():
-            segment = segment.set_frame_rate(self.config['desired_sample_rate'])
-        audio = np.array(segment.get_array_of_samples())
-        return self.model.stt(audio)
+        audio = self.load_audio(audio_path)
+        segment = slice_segment(audio, self.model.sampleRate(), start_time, end_time)
+        return self.model.stt(segment)
 
     def compute_wer(self, reference, hypothesis):
         reference_transformed = self.transformation(reference)
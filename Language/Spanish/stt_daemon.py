@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+
+import numpy as np
+
+from model_config_xz import *
+from stt_class_xz import STT, read_wav
+from audio_io import slice_segment
+from text_normalizer import TextNormalizer
+
+# Long-lived process keeping the STT models loaded, so that the shell drivers
+# can run `<DB>.main` once per directory without paying for the model and
+# scorer load every time. It talks JSON lines over a Unix socket:
+#
+#   {"op": "run", "lang": "es", "audio_path": "/abs/file.wav", "start_time": null, "end_time": null}
+#   {"op": "run_stream", "lang": "es", "audio_path": "/abs/file.wav"}
+#   {"op": "run_audio", "lang": "es", "pcm_bytes": 32000}  followed by the raw int16 samples
+#   {"op": "info", "lang": "es"}, {"op": "ping"}, {"op": "shutdown"}
+#
+# and answers {"ok": true, "text": ...} or {"ok": false, "error": "FileNotFoundError", "message": ...}.
+# run_stream may send {"ok": true, "partial": ...} lines before the final answer.
+
+# exceptions the client raises again with the same type, anything else is a RuntimeError
+REMOTE_ERRORS = {error.__name__: error for error in (FileNotFoundError, OSError, ValueError)}
+
+
+class ModelRegistry:
+    """One STT per language, loaded on first use and shared by every connection."""
+
+    def __init__(self):
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def get(self, lang):
+        with self.lock:
+            if lang not in self.models:
+                # the model is not thread safe, requests for a language take turns
+                self.models[lang] = (STT(lang), threading.Lock())
+            return self.models[lang]
+
+
+class STTRequestHandler(socketserver.StreamRequestHandler):
+
+    def send(self, message):
+        self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+    def handle(self):
+        for line in self.rfile:
+            request = json.loads(line)
+            op = request.get('op')
+            if op == 'ping':
+                self.send({'ok': True})
+                continue
+            if op == 'shutdown':
+                self.send({'ok': True})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+            pcm = None
+            if op == 'run_audio':
+                pcm = np.frombuffer(self.rfile.read(request['pcm_bytes']), dtype=np.int16)
+            try:
+                self.send(self.process(op, request, pcm))
+            except Exception as error:
+                logging.error(f"Request {op} failed: {error}")
+                self.send({'ok': False, 'error': type(error).__name__, 'message': str(error)})
+
+    def process(self, op, request, pcm):
+        stt, lock = self.server.registry.get(request['lang'])
+        with lock:
+            if op == 'info':
+                return {'ok': True, 'sample_rate': stt.sample_rate(), 'decoder': stt.decoder_config()}
+            if op == 'run':
+                return {'ok': True, 'text': stt.run(request['audio_path'], request.get('start_time'), request.get('end_time'))}
+            if op == 'run_audio':
+                return {'ok': True, 'text': stt.run_audio(pcm)}
+            if op == 'run_stream':
+                on_partial = lambda text: self.send({'ok': True, 'partial': text})
+                return {'ok': True, 'text': stt.run_stream(request['audio_path'], on_partial=on_partial)}
+        raise ValueError(f'Unknown operation: {op}')
+
+
+class STTServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, registry):
+        self.registry = registry
+        super().__init__(socket_path, STTRequestHandler)
+
+
+def serve(socket_path, languages=()):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    registry = ModelRegistry()
+    for lang in languages:
+        registry.get(lang)
+    with STTServer(socket_path, registry) as server:
+        logging.info(f'STT daemon listening on {socket_path}')
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+class RemoteModel:
+    """The part of `stt.Model` the dataset scripts use directly."""
+
+    def __init__(self, client, sample_rate):
+        self.client = client
+        self.sample_rate = sample_rate
+
+    def sampleRate(self):
+        return self.sample_rate
+
+    def stt(self, audio):
+        return self.client.run_audio(audio)
+
+
+class STTClient(STT):
+    """
+    Thin client of a running daemon with the interface of `STT`.
+
+    Nothing is loaded here: text normalization and WER are computed locally,
+    transcription is sent to the daemon. Audio paths are made absolute since
+    the daemon may run from another directory.
+    """
+
+    def __init__(self, socket_path, lang):
+        self.socket_path = os.path.abspath(socket_path)
+        self.lang = lang
+        if self.lang not in STT_MODELS:
+            raise ValueError(f'Unknown language: {self.lang}')
+        self.config = STT_MODELS[self.lang]
+
+        # same output as the jiwer RemoveMultipleSpaces, RemovePunctuation, ToLowerCase, Strip pipeline
+        self.transformation = TextNormalizer()
+
+        self.pcm_cache = None
+        # the daemon keeps its own hypothesis cache
+        self.hypotheses = None
+        self.rescore_only = False
+        self.vocabulary = None
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+        self.file = self.sock.makefile('rwb')
+        logging.info('Connected to STT daemon at %s', self.socket_path)
+        info = self.request({'op': 'info'})
+        self.model = RemoteModel(self, info['sample_rate'])
+        self.decoder = info['decoder']
+
+    def request(self, message, payload=None, on_partial=None):
+        message['lang'] = self.lang
+        self.file.write(json.dumps(message).encode('utf-8') + b'\n')
+        if payload is not None:
+            self.file.write(payload)
+        self.file.flush()
+        while True:
+            line = self.file.readline()
+            if not line:
+                raise ConnectionError('STT daemon closed the connection.')
+            response = json.loads(line)
+            if 'partial' not in response:
+                break
+            if on_partial is not None:
+                on_partial(response['partial'])
+        if not response['ok']:
+            raise REMOTE_ERRORS.get(response['error'], RuntimeError)(response['message'])
+        return response
+
+    def decoder_config(self):
+        # the one of the model loaded by the daemon
+        return self.decoder
+
+    def sample_rate(self):
+        return self.model.sampleRate()
+
+    def load_audio(self, audio_path):
+        return read_wav(audio_path, self.sample_rate())
+
+    def run(self, audio_path, start_time=None, end_time=None):
+        message = {'op': 'run', 'audio_path': os.path.abspath(str(audio_path)), 'start_time': start_time, 'end_time': end_time}
+        return self.request(message)['text']
+
+    def run_audio(self, audio):
+        payload = np.ascontiguousarray(audio, dtype=np.int16).tobytes()
+        return self.request({'op': 'run_audio', 'pcm_bytes': len(payload)}, payload)['text']
+
+    def run_segment(self, audio_path, start_time, end_time, audio):
+        if start_time is not None and end_time is not None:
+            audio = slice_segment(audio, self.sample_rate(), start_time, end_time)
+        return self.run_audio(audio)
+
+    def run_stream(self, audio_path, block_seconds=1.0, on_partial=None, partial_every=30):
+        message = {'op': 'run_stream', 'audio_path': os.path.abspath(str(audio_path))}
+        return self.request(message, on_partial=on_partial)['text']
+
+
+def send(socket_path, message):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        return json.loads(sock.makefile('rb').readline())
+
+
+def wait_ready(socket_path, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return send(socket_path, {'op': 'ping'})['ok']
+        except (FileNotFoundError, ConnectionRefusedError):
+            time.sleep(0.5)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep STT models loaded and serve transcriptions over a Unix socket.")
+    parser.add_argument('-s', '--socket', required=True, help='Path of the Unix socket.')
+    parser.add_argument('-l', '--languages', nargs='*', default=[], help='Languages to load at start up, the rest are loaded on first use.')
+    parser.add_argument('--wait', type=float, metavar='SECONDS', help='Wait until a daemon answers on the socket and exit.')
+    parser.add_argument('--stop', action='store_true', help='Stop the daemon listening on the socket.')
+    args = parser.parse_args()
+
+    if args.wait is not None:
+        sys.exit(0 if wait_ready(args.socket, args.wait) else 1)
+    if args.stop:
+        send(args.socket, {'op': 'shutdown'})
+        return
+    serve(args.socket, args.languages)
+
+if __name__ == "__main__":
+    main()
+
+# run:
+# python3 stt_daemon.py --socket /tmp/stt_es.sock --languages es &
+# python3 -m TTS_DB.main -a <wav dir> -t <txt dir> --daemon /tmp/stt_es.sock
+# python3 stt_daemon.py --socket /tmp/stt_es.sock --stop
@@ -1,50 +1,20 @@
 import os
 import time
 import logging
-import pydub
-import numpy as np
 from stt import Model
-from scipy.io import wavfile
 from coqui_stt_model_manager.modelmanager import ModelManager
 import jiwer
 from model_config_xz import *
+from audio_io import load_audio
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO)
-logging.getLogger("pydub.converter").setLevel(logging.WARNING)
 
 INSTALL_DIR = "/home/aholab/santi/Documents/audio_process/Test/Language/models"
 
-def ensure_samplerate(audio_path, desired_sample_rate):
-    try:
-        sound = pydub.AudioSegment.from_file(audio_path)
-    except pydub.exceptions.CouldntDecodeError as error:
-        raise ValueError('Could not decode audio file.') from error
-
-    sample_rate = sound.frame_rate
-    if sample_rate != desired_sample_rate:
-        sound = sound.set_frame_rate(desired_sample_rate)
-        # sound.export(audio_path, format='wav') # this is not used
-    return sound
-
-def convert_to_mono(sound):
-    if sound.channels > 1:
-        sound = sound.split_to_mono()[0]
-    return sound
-
 def read_wav(audio_path, desired_sample_rate):
-    sound = ensure_samplerate(audio_path, desired_sample_rate)
-    sound = convert_to_mono(sound)
-    audio = np.array(sound.get_array_of_samples())
-
-    # It needs to be in 16-bit precision:
-    if audio.dtype == 'int8':
-        audio = np.array(audio.astype(float) * (2**8), dtype=np.int16)
-    elif audio.dtype == 'int32':
-        audio = np.array(audio.astype(float) / (2**16), dtype=np.int16)
-    elif audio.dtype == 'float32':
-        audio = np.array(audio.astype(float) / (2**16), dtype=np.int16)
-    return audio
+    # single in-process decode, mono int16 at the model sample rate
+    return load_audio(audio_path, desired_sample_rate)
 
 class STT:
     def __init__(self, lang, scorer=True):
@@ -117,6 +87,9 @@ class STT:
         else:
             logging.info("Alpha and Beta hyperparameters are not set in config.")
 
+    def load_audio(self, audio_path):
+        return read_wav(audio_path, self.model.sampleRate())
+
     def run(self, audio_path):
         # logging.debug('[STT:%s] Audio path: %s', self.lang, audio_path) # indicate language and audio
         desired_sample_rate = self.model.sampleRate() # change the sr
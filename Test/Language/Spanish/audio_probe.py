@@ -0,0 +1,251 @@
+import os
+import struct
+
+# Duration, sample rate and channels of an audio file from its container
+# header, in pure Python: a few small reads, nothing is decoded and neither
+# libsndfile nor FFmpeg is opened. Covers the formats of the corpora: WAV/RIFF
+# (and RF64), FLAC, MP3 and MP4/M4A. `probe_header` returns None for anything
+# else, or for a header it cannot make sense of, and callers then ask the
+# decoders (audio_io.audio_info).
+#
+# MP3 durations are exact with a Xing/Info or VBRI header (the encoder delay
+# and padding of the LAME tag are removed, as the decoders do); without one the
+# stream is taken as constant bitrate.
+
+MP3_SYNC_WINDOW = 64 * 1024  # bytes searched for the first MP3 frame
+# encoders writing the LAME tag, with the delay and padding, after the Xing/Info header
+MP3_ENCODER_TAGS = (b'LAME', b'Lavf', b'Lavc')
+
+MP3_BITRATES = {
+    # (MPEG-1, layer): kbps by bitrate index
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+WAV_FORMATS = (0x0001, 0x0003, 0x0006, 0x0007, 0xFFFE)  # PCM, float, A-law, mu-law, extensible
+
+
+def _wav(file, size):
+    riff, _, wave = struct.unpack('<4sI4s', file.read(12))
+    if riff not in (b'RIFF', b'RF64') or wave != b'WAVE':
+        return None
+    fmt = data_size = data_offset = fact_frames = ds64_size = None
+    position = 12
+    while position + 8 <= size and (fmt is None or data_size is None):
+        file.seek(position)
+        chunk_id, chunk_size = struct.unpack('<4sI', file.read(8))
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', file.read(16))
+        elif chunk_id == b'ds64':
+            # RF64: the sizes that do not fit in 32 bits
+            _, ds64_size, fact_frames = struct.unpack('<QQQ', file.read(24))
+        elif chunk_id == b'fact' and fact_frames is None:
+            fact_frames, = struct.unpack('<I', file.read(4))
+        elif chunk_id == b'data':
+            data_offset = position + 8
+            data_size = ds64_size if riff == b'RF64' and ds64_size is not None else chunk_size
+            if data_size in (0, 0xFFFFFFFF) or data_offset + data_size > size:
+                # written by a stream that never went back to the header
+                data_size = size - data_offset
+        position += 8 + chunk_size + (chunk_size & 1)
+    if fmt is None or data_size is None:
+        return None
+    audio_format, channels, sample_rate, _, block_align, _ = fmt
+    if not sample_rate or not channels:
+        return None
+    if audio_format in WAV_FORMATS and block_align:
+        return data_size // block_align / sample_rate, sample_rate, channels
+    if fact_frames:
+        return fact_frames / sample_rate, sample_rate, channels
+    return None
+
+
+def _flac(file, size):
+    if file.read(4) != b'fLaC':
+        return None
+    header = file.read(4)
+    if len(header) < 4 or header[0] & 0x7F != 0:
+        return None
+    streaminfo = file.read(34)
+    if len(streaminfo) < 18:
+        return None
+    # 20 bits sample rate, 3 bits channels - 1, 5 bits bits per sample - 1, 36 bits total samples
+    bits = int.from_bytes(streaminfo[10:18], 'big')
+    sample_rate = bits >> 44
+    channels = ((bits >> 41) & 0x7) + 1
+    total_samples = bits & 0xFFFFFFFFF
+    if not sample_rate or not total_samples:
+        return None
+    return total_samples / sample_rate, sample_rate, channels
+
+
+def _mp3_frame(header):
+    """(frame length, samples per frame, sample rate, channels, MPEG-1, bitrate) of a frame header, None if it is not one."""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x3
+    layer = 4 - ((header[1] >> 1) & 0x3)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = MP3_BITRATES[mpeg1, layer][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    padding = (header[2] >> 1) & 0x1
+    channels = 1 if header[3] >> 6 == 3 else 2
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate, channels, mpeg1, bitrate
+    samples = 1152 if layer == 2 or mpeg1 else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate, channels, mpeg1, bitrate
+
+
+def _mp3(file, size):
+    start = 0
+    head = file.read(10)
+    if head[:3] == b'ID3' and len(head) == 10:
+        # ID3v2 tag, its size is a syncsafe integer
+        start = 10 + ((head[6] & 0x7F) << 21 | (head[7] & 0x7F) << 14 | (head[8] & 0x7F) << 7 | (head[9] & 0x7F))
+        if head[5] & 0x10:
+            start += 10
+    file.seek(start)
+    window = file.read(MP3_SYNC_WINDOW)
+    offset = window.find(b'\xff')
+    while offset != -1:
+        frame = _mp3_frame(window[offset:offset + 4])
+        if frame is not None:
+            # a real frame is followed by another one, or by the end of the file
+            following = offset + frame[0]
+            if following + 4 > len(window) or _mp3_frame(window[following:following + 4]) is not None:
+                break
+        offset = window.find(b'\xff', offset + 1)
+    if offset == -1:
+        return None
+    length, samples, sample_rate, channels, mpeg1, bitrate = frame
+    frame_bytes = window[offset:offset + length]
+
+    # Xing/Info after the side information, VBRI at a fixed offset
+    side_info = (17 if channels == 1 else 32) if mpeg1 else (9 if channels == 1 else 17)
+    xing = frame_bytes[4 + side_info:]
+    if xing[:4] in (b'Xing', b'Info') and len(xing) >= 12:
+        flags, = struct.unpack('>I', xing[4:8])
+        if flags & 0x1:
+            frames, = struct.unpack('>I', xing[8:12])
+            lame = 8 + 4 * bool(flags & 0x1) + 4 * bool(flags & 0x2) + 100 * bool(flags & 0x4) + 4 * bool(flags & 0x8)
+            total = frames * samples
+            if xing[lame:lame + 4] in MP3_ENCODER_TAGS and len(xing) >= lame + 24:
+                # the decoders drop the encoder delay and padding
+                gapless = int.from_bytes(xing[lame + 21:lame + 24], 'big')
+                total -= (gapless >> 12) + (gapless & 0xFFF)
+            return max(total, 0) / sample_rate, sample_rate, channels
+    vbri = frame_bytes[36:]
+    if vbri[:4] == b'VBRI' and len(vbri) >= 18:
+        frames, = struct.unpack('>I', vbri[14:18])
+        return frames * samples / sample_rate, sample_rate, channels
+
+    audio_bytes = size - start - offset
+    file.seek(max(size - 128, 0))
+    if file.read(3) == b'TAG':
+        audio_bytes -= 128
+    return audio_bytes * 8 / bitrate, sample_rate, channels
+
+
+def _boxes(file, start, end):
+    # (type, body offset, body end) of the MP4 boxes between start and end
+    position = start
+    while position + 8 <= end:
+        file.seek(position)
+        box_size, box_type = struct.unpack('>I4s', file.read(8))
+        header = 8
+        if box_size == 1:
+            box_size, = struct.unpack('>Q', file.read(8))
+            header = 16
+        elif box_size == 0:
+            box_size = end - position
+        if box_size < header:
+            return
+        yield box_type, position + header, min(position + box_size, end)
+        position += box_size
+
+
+def _find_box(file, start, end, path):
+    for box_type, body, body_end in _boxes(file, start, end):
+        if box_type == path[0]:
+            return (body, body_end) if len(path) == 1 else _find_box(file, body, body_end, path[1:])
+    return None
+
+
+def _mp4(file, size):
+    file.seek(4)
+    if file.read(4) not in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'):
+        return None
+    moov = _find_box(file, 0, size, [b'moov'])
+    if moov is None:
+        return None
+    mvhd = _find_box(file, *moov, [b'mvhd'])
+    if mvhd is None:
+        return None
+    file.seek(mvhd[0])
+    version = file.read(4)[0]
+    if version == 1:
+        _, _, timescale, duration = struct.unpack('>QQIQ', file.read(28))
+    else:
+        _, _, timescale, duration = struct.unpack('>IIII', file.read(16))
+    if not timescale:
+        return None
+
+    # sample rate and channels of the first audio track
+    sample_rate = channels = None
+    for box_type, body, body_end in _boxes(file, *moov):
+        if box_type != b'trak':
+            continue
+        hdlr = _find_box(file, body, body_end, [b'mdia', b'hdlr'])
+        if hdlr is None:
+            continue
+        file.seek(hdlr[0] + 8)
+        if file.read(4) != b'soun':
+            continue
+        stsd = _find_box(file, body, body_end, [b'mdia', b'minf', b'stbl', b'stsd'])
+        if stsd is not None:
+            # full box header and entry count, then the first sample entry
+            file.seek(stsd[0] + 8 + 8 + 16)
+            channels, _, _, _, rate = struct.unpack('>HHHHI', file.read(12))
+            sample_rate = rate >> 16
+        break
+    return duration / timescale, sample_rate or None, channels or None
+
+
+def probe_header(audio_path):
+    """
+    :param audio_path: Path to a WAV, FLAC, MP3 or MP4/M4A file.
+    :return: (duration in seconds, sample rate, channels), None when the header
+        is not one of those or cannot be read.
+    """
+    audio_path = str(audio_path)
+    size = os.path.getsize(audio_path)
+    extension = os.path.splitext(audio_path)[1].lower()
+    with open(audio_path, 'rb') as file:
+        head = file.read(12)
+        file.seek(0)
+        try:
+            if head[:4] in (b'RIFF', b'RF64'):
+                return _wav(file, size)
+            if head[:4] == b'fLaC':
+                return _flac(file, size)
+            if head[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'):
+                return _mp4(file, size)
+            if head[:3] == b'ID3' or extension == '.mp3':
+                return _mp3(file, size)
+        except (struct.error, IndexError, ZeroDivisionError):
+            return None
+    return None
+
+
+def header_duration(audio_path):
+    """Duration in seconds from the header, None when it has to be decoded to be known."""
+    info = probe_header(audio_path)
+    return info[0] if info is not None else None
@@ -0,0 +1,72 @@
+import argparse
+import time
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.silence import detect_nonsilent as pydub_detect_nonsilent
+from pydub.silence import split_on_silence
+
+from audio_io import load_audio
+from silence import detect_nonsilent, silence_chunks
+
+PARAMS = [
+    # (min_silence_len, silence_thresh, keep_silence) used by the segmentation scripts
+    (400, -50, 350),
+    (400, -40, 200),
+    (500, -30, 200),
+]
+
+
+def synthetic_audio(minutes, sample_rate, seed=0):
+    """Alternating speech-like noise bursts and near silence."""
+    rng = np.random.default_rng(seed)
+    parts = []
+    total = 0
+    while total < minutes * 60 * sample_rate:
+        voiced = rng.normal(0, 3000, int(sample_rate * rng.uniform(0.3, 3.0)))
+        pause = rng.normal(0, 20, int(sample_rate * rng.uniform(0.1, 1.5)))
+        parts.extend([voiced, pause])
+        total += len(voiced) + len(pause)
+    return np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def compare(name, audio, sample_rate):
+    sound = AudioSegment(data=audio.tobytes(), sample_width=2, frame_rate=sample_rate, channels=1)
+    print(f"\n{name}: {len(audio) / sample_rate:.1f}s")
+    for min_silence_len, silence_thresh, keep_silence in PARAMS:
+        expected = pydub_detect_nonsilent(sound, min_silence_len, silence_thresh)
+        ranges = detect_nonsilent(audio, sample_rate, min_silence_len, silence_thresh)
+
+        pydub_chunks, pydub_time = timed(split_on_silence, sound, min_silence_len, silence_thresh, keep_silence)
+        numpy_chunks, numpy_time = timed(silence_chunks, audio, sample_rate, min_silence_len, silence_thresh, keep_silence)
+
+        same = ranges == expected and len(pydub_chunks) == len(numpy_chunks)
+        print(f"  {(min_silence_len, silence_thresh, keep_silence)}: "
+              f"{len(numpy_chunks)} chunks, identical={same}, "
+              f"pydub {pydub_time:.3f}s, numpy {numpy_time:.3f}s, x{pydub_time / max(numpy_time, 1e-9):.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the NumPy silence splitter with pydub.')
+    parser.add_argument('audio_files', nargs='*', help='Audio files to split, a synthetic signal is used if none.')
+    parser.add_argument('--minutes', type=float, default=5, help='Length of the synthetic signal.')
+    parser.add_argument('--sample-rate', type=int, default=16000)
+    args = parser.parse_args()
+
+    if not args.audio_files:
+        compare('synthetic', synthetic_audio(args.minutes, args.sample_rate), args.sample_rate)
+    for audio_file in args.audio_files:
+        compare(audio_file, load_audio(audio_file, args.sample_rate), args.sample_rate)
+
+
+if __name__ == '__main__':
+    main()
+
+# run:
+# python3 benchmark_silence.py /mnt/corpus/MintzAI-ST/v1.0/es-eu/test/audio/<file>.m4a
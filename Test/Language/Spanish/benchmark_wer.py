@@ -0,0 +1,94 @@
+import argparse
+import gc
+import time
+
+import jiwer
+import numpy as np
+
+from wer_kernel import Vocabulary, distances, score_batch
+
+
+def synthetic_pairs(utterances, vocabulary_size=5000, error_rate=0.2, seed=0):
+    """Reference sentences of 3 to 40 words and hypotheses with substitutions, deletions and insertions."""
+    rng = np.random.default_rng(seed)
+    words = [f'word{i}' for i in range(vocabulary_size)]
+    references, hypotheses = [], []
+    for _ in range(utterances):
+        reference = [words[i] for i in rng.integers(0, vocabulary_size, rng.integers(3, 41))]
+        hypothesis = []
+        for word in reference:
+            edit = rng.random()
+            if edit < error_rate / 2:
+                hypothesis.append(words[rng.integers(0, vocabulary_size)])
+            elif edit < error_rate * 3 / 4:
+                continue
+            else:
+                hypothesis.append(word)
+            if rng.random() < error_rate / 4:
+                hypothesis.append(words[rng.integers(0, vocabulary_size)])
+        references.append(' '.join(reference))
+        hypotheses.append(' '.join(hypothesis))
+    return references, hypotheses
+
+
+def results_pairs(results_file):
+    """Normalized references and hypotheses of a per utterance results file."""
+    import pandas as pd
+
+    if results_file.endswith('.parquet'):
+        results_df = pd.read_parquet(results_file, columns=['reference', 'hypothesis'])
+    else:
+        results_df = pd.read_csv(results_file, usecols=['reference', 'hypothesis'], keep_default_na=False)
+    return results_df['reference'].tolist(), results_df['hypothesis'].tolist()
+
+
+def timed(function, *args, **kwargs):
+    # garbage of the previous run is not charged to this one
+    gc.collect()
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def compare(name, references, hypotheses):
+    print(f"\n{name}: {len(references)} utterances, {sum(len(r.split()) for r in references)} reference words")
+
+    jiwer_wer, pairs_time = timed(lambda: [jiwer.wer(r, h) for r, h in zip(references, hypotheses)])
+    jiwer_errors, batch_time = timed(lambda: [(lambda o: o.substitutions + o.deletions + o.insertions)(jiwer.process_words(r, h))
+                                              for r, h in zip(references, hypotheses)])
+
+    (errors, words, wer), kernel_time = timed(score_batch, references, hypotheses)
+    # a sweep rescoring the same references with another set of hypotheses
+    vocabulary = Vocabulary()
+    score_batch(references, references, vocabulary)
+    _, sweep_time = timed(score_batch, references, hypotheses, vocabulary)
+    # the kernel alone, on words already interned
+    encoded = vocabulary.encode(references) + vocabulary.encode(hypotheses)
+    _, kernel_only_time = timed(distances, *encoded)
+
+    same = list(errors) == jiwer_errors and list(wer) == jiwer_wer
+    print(f"  identical={same}, WWER {errors.sum() / max(words.sum(), 1):.4f}")
+    print(f"  jiwer.wer per pair       {pairs_time:.3f}s")
+    print(f"  jiwer.process_words      {batch_time:.3f}s")
+    print(f"  score_batch              {kernel_time:.3f}s, x{pairs_time / max(kernel_time, 1e-9):.1f}")
+    print(f"  score_batch, warm vocab  {sweep_time:.3f}s, x{pairs_time / max(sweep_time, 1e-9):.1f}")
+    print(f"  distances, encoded       {kernel_only_time:.3f}s, x{pairs_time / max(kernel_only_time, 1e-9):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the bit-parallel WER kernel with jiwer.')
+    parser.add_argument('results_files', nargs='*', help='Per utterance results (csv or parquet) to rescore, synthetic pairs are used if none.')
+    parser.add_argument('--utterances', type=int, default=50000, help='Number of synthetic pairs.')
+    args = parser.parse_args()
+
+    if not args.results_files:
+        compare('synthetic', *synthetic_pairs(args.utterances))
+    for results_file in args.results_files:
+        compare(results_file, *results_pairs(results_file))
+
+
+if __name__ == '__main__':
+    main()
+
+# run:
+# python3 benchmark_wer.py ../../../Language/Spanish/Common_Voice_v15/results/<model>_Common_Voice_v15_utterances.csv
@@ -1,13 +1,11 @@
 import os
 import time
 import logging
-import pydub
-import numpy as np
 from stt import Model
-from scipy.io import wavfile
 from coqui_stt_model_manager.modelmanager import ModelManager
 import argparse
 import jiwer
+from audio_io import load_audio
 
 STT_HOST = 'https://coqui.gateway.scarf.sh'
 STT_HOST_AHOLAB = 'https://aholab.ehu.eus/~xzuazo/models'
@@ -37,42 +35,9 @@ INSTALL_DIR = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), 'Language', 'models'
 )
 
-def ensure_samplerate(audio_path, desired_sample_rate):
-    try:
-        sound = pydub.AudioSegment.from_file(audio_path)
-    except pydub.exceptions.CouldntDecodeError as error:
-        raise ValueError('Could not decode audio file.') from error
-
-    sample_rate = sound.frame_rate
-    if sample_rate != desired_sample_rate:
-        sound = sound.set_frame_rate(desired_sample_rate)
-        sound.export(audio_path, format='wav')
-
-
 def read_wav(audio_path, desired_sample_rate):
-    try:
-        sound = pydub.AudioSegment.from_file(audio_path)
-    except pydub.exceptions.CouldntDecodeError as error:
-        raise ValueError('Could not decode audio file.') from error
-    
-    sample_rate = sound.frame_rate
-    if sample_rate != desired_sample_rate:
-        sound = sound.set_frame_rate(desired_sample_rate)
-    
-    if sound.channels > 1:
-        sounds = sound.split_to_mono() 
-        sound = sounds[0] 
-    audio = np.array(sound.get_array_of_samples())
-
-    # It needs to be in 16-bit precision:
-    if audio.dtype == 'int8':
-        audio = np.array(audio.astype(float) * (2**8), dtype=np.int16)
-    elif audio.dtype == 'int32':
-        audio = np.array(audio.astype(float) / (2**16), dtype=np.int16)
-    elif audio.dtype == 'float32':
-        audio = np.array(audio.astype(float) / (2**16), dtype=np.int16)
-    
-    return audio
+    # single in-process decode, mono int16 at the model sample rate
+    return load_audio(audio_path, desired_sample_rate)
 
 class STT:
     def __init__(self, lang, scorer=True):
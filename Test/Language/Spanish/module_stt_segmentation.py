@@ -1,14 +1,15 @@
 import os
 import time
 import logging
-import pydub
-import numpy as np
 import argparse
+import functools
 from stt import Model
 from coqui_stt_model_manager.modelmanager import ModelManager
-from pydub import AudioSegment
-from pydub.silence import split_on_silence
 import jiwer
+from audio_io import load_audio
+from audio_probe import header_duration
+from silence import silence_chunks
+from silence_tuning import tune_silence_params, sample_corpus
 
 STT_HOST = 'https://coqui.gateway.scarf.sh'
 STT_HOST_AHOLAB = 'https://aholab.ehu.eus/~xzuazo/models'
@@ -36,68 +37,25 @@ INSTALL_DIR = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), 'models', 'stt'
 )
 
-def ensure_samplerate(audio_path, desired_sample_rate):
-    try:
-        sound = pydub.AudioSegment.from_file(audio_path)
-    except pydub.exceptions.CouldntDecodeError as error:
-        raise ValueError('Could not decode audio file.') from error
-
-    # get the frame rate and
-    sample_rate = sound.frame_rate
-    # check if it is the desired sample rate
-    if sample_rate != desired_sample_rate:
-        sound = sound.set_frame_rate(desired_sample_rate)
-	# if so, save it in wav format (whatever)
-        # sound.export(audio_path, format='wav')
-    return sound
-
-def ensure_mono(sound):
-    if sound.channels > 1:  # force mono | channel one
-        sounds = sound.split_to_mono() # split the audio into mono
-        sound = sounds[0] # keep just the first channel
-    return sound
-
 def read_wav(audio_path, desired_sample_rate):
-    try:
-        sound = pydub.AudioSegment.from_file(audio_path)
-    except pydub.exceptions.CouldntDecodeError as error:
-        raise ValueError('Could not decode audio file.') from error
-    
-    sample_rate = sound.frame_rate
-    if sample_rate != desired_sample_rate:
-        sound = sound.set_frame_rate(desired_sample_rate)
-
-    sound = ensure_samplerate(audio_path, desired_sample_rate)
-    sound = ensure_mono(sound)
-    audio = np.array(sound.get_array_of_samples())
-
-    logging.debug(f"Audio type: {audio.dtype}")
-    # It needs to be in 16-bit precision:
-    if audio.dtype == 'int8':
-        audio = np.array(audio.astype(float) * (2**8), dtype=np.int16)
-    
-    elif audio.dtype == 'int32':
-        audio = np.array(audio.astype(float) / (2**16), dtype=np.int16)
-    
-    elif audio.dtype == 'float32':
-        audio = np.array(audio.astype(float) / (2**16), dtype=np.int16)
-    
-    return audio
+    # single in-process decode, mono int16 at the model sample rate
+    return load_audio(audio_path, desired_sample_rate)
 
-# def segment_audio(audio_path, min_silence_len=500, silence_thresh=-50, keep_silence=400):
-def segment_audio(audio_path, min_silence_len=400, silence_thresh=-50, keep_silence=350):
+# def segment_audio(audio, sample_rate, min_silence_len=500, silence_thresh=-50, keep_silence=400):
+def segment_audio(audio, sample_rate, min_silence_len=400, silence_thresh=-50, keep_silence=350):
     """
-    Splits the audio file into chunks based on silence.
+    Splits a decoded audio buffer into chunks based on silence.
     
-    :param audio_path: The path to the audio file.
+    :param audio: int16 numpy array with the whole recording, as returned by read_wav.
+    :param sample_rate: (int) sample rate of the audio.
     :param min_silence_len: (int) minimum length of a silence to be used for a split. Default to 1000ms.
     :param silence_thresh: (int) the upper bound for what is considered silence. Default to -40 dBFS.
     :param keep_silence: (int) amount of silence to leave at the beginning and end of each chunk. Default to 200ms.
-    :return: List of AudioSegment instances representing the chunks.
+    :return: List of (start, end) sample offsets of the chunks in the audio.
     """
-    sound = AudioSegment.from_file(audio_path)
-    chunks = split_on_silence(
-        sound,
+    chunks = silence_chunks(
+        audio,
+        sample_rate,
         min_silence_len=min_silence_len,
         silence_thresh=silence_thresh,
         keep_silence=keep_silence
@@ -105,16 +63,12 @@ def segment_audio(audio_path, min_silence_len=400, silence_thresh=-50, keep_sile
     
     return chunks
 
-def transcribe_chunks(stt, chunks, sample_rate):
+def transcribe_chunks(stt, audio, chunks):
     transcriptions = []
-    for i, chunk in enumerate(chunks):
-        chunk.export(f"/tmp/chunk_{i}.wav", format="wav")
-        
-        audio_data = read_wav(f"/tmp/chunk_{i}.wav", sample_rate)
-        transcription = stt.model.stt(audio_data)
+    for start, end in chunks:
+        # the chunk is a view of the decoded buffer, no temporary wav files
+        transcription = stt.model.stt(audio[start:end])
         transcriptions.append(transcription)
-        
-        os.remove(f"/tmp/chunk_{i}.wav")
     return transcriptions
 
 
@@ -126,6 +80,13 @@ class STT:
         self.config = STT_MODELS[self.lang]
         if not scorer and 'scorer' in self.config:
             del self.config['scorer']
+
+        self.transformation = jiwer.Compose([
+        jiwer.RemoveMultipleSpaces(),
+        jiwer.RemovePunctuation(),
+        jiwer.ToLowerCase(),
+        jiwer.Strip(),
+        ])
         
         os.makedirs(INSTALL_DIR, exist_ok=True)
         self.model = None
@@ -189,33 +150,37 @@ class STT:
 
 
 
-def find_best_silence_params(stt, audio_path, correct_reference):
-    min_silence_lens = range(400, 1001, 200)
-    silence_threshs = range(-50, -20, 10)
-    keep_silences = range(100, 501, 100)
-    best_wer = float('inf')
-    best_params = None
-
-    for min_silence_len in min_silence_lens:
-        for silence_thresh in silence_threshs:
-            for keep_silence in keep_silences:
-                chunks = segment_audio(audio_path, min_silence_len, silence_thresh, keep_silence)
-                transcriptions = transcribe_chunks(stt, chunks, stt.model.sampleRate())
-                full_transcript = ' '.join(transcriptions)
-                wer = stt.compute_wer(correct_reference, full_transcript)
+def find_best_silence_params(stt, audio_path, correct_reference, workers=1):
+    best_params, best_wer, _ = find_best_corpus_silence_params(stt, [(audio_path, correct_reference)], workers=workers)
+    return best_params, best_wer
 
-                if wer < best_wer:
-                    best_wer = wer
-                    best_params = (min_silence_len, silence_thresh, keep_silence)
+def stt_factory(stt):
+    """Picklable callable that builds the same model `stt` was built with, as `worker_pool.stt_factory`."""
+    return functools.partial(type(stt), stt.lang, 'scorer' in stt.config)
 
-    return best_params, best_wer
+def find_best_corpus_silence_params(stt, samples, sample_size=None, workers=1):
+    # decodes every file once, scores each distinct chunking once and
+    # transcribes each distinct chunk once, spread over `workers` processes
+    samples = sample_corpus(samples, sample_size)
+    return tune_silence_params(stt, samples, workers=workers, stt_factory=stt_factory(stt))
 
+def read_tuning_list(list_path):
+    samples = []
+    with open(list_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                audio_path, reference = line.rstrip('\n').split('\t', 1)
+                samples.append((audio_path, reference))
+    return samples
 
 
 def main():
     parser = argparse.ArgumentParser(description='Transcribe an audio file.')
-    parser.add_argument('audio_file', help='Path to the audio file to transcribe.')
+    parser.add_argument('audio_file', nargs='?', help='Path to the audio file to transcribe.')
     parser.add_argument('--language', '-l', default='en', choices=STT_MODELS.keys(), help='Language of the transcription model.')
+    parser.add_argument('--tune', help='Tab separated list of "audio_path<TAB>reference" to tune the silence parameters on.')
+    parser.add_argument('--sample', type=int, default=None, help='Number of files of the --tune list to use.')
+    parser.add_argument('--workers', type=int, default=1, help='Processes used to transcribe chunks while tuning.')
     args = parser.parse_args()
 
     audio_path = args.audio_file
@@ -226,20 +191,36 @@ def main():
 
     stt = STT(language)
 
+    if args.tune:
+        samples = read_tuning_list(args.tune)
+        best_params, best_wer, _ = find_best_corpus_silence_params(stt, samples, args.sample, args.workers)
+        print(f"\nBest (min_silence_len, silence_thresh, keep_silence): {best_params} WER: {best_wer}")
+        return
+    if audio_path is None:
+        parser.error('audio_file is required unless --tune is given')
+
     try:
         threshold = 11
-        sound = AudioSegment.from_file(audio_path)
-        duration_seconds = len(sound) / 1000
+        sample_rate = stt.model.sampleRate()
+        # duration from the header, decoded length when the header does not tell
+        duration_seconds = header_duration(audio_path)
+        audio = None
+        if duration_seconds is None:
+            audio = read_wav(audio_path, sample_rate)
+            duration_seconds = len(audio) / sample_rate
 
         if duration_seconds > threshold:  # if the audio is longer than x seconds
             logging.debug(f"Segmenting file {audio_path} [ {duration_seconds}s ] because its duration is longer than {threshold} seconds...")
-            chunks = segment_audio(audio_path)
+            if audio is None:
+                audio = read_wav(audio_path, sample_rate)
+            chunks = segment_audio(audio, sample_rate)
             logging.debug(f"There are {len(chunks)} chunks taken from {audio_path.split('/')[-1]}")
-            transcriptions = transcribe_chunks(stt, chunks, stt.model.sampleRate())
+            transcriptions = transcribe_chunks(stt, audio, chunks)
             full_transcript = ' '.join(transcriptions)
         else:
             logging.debug(f"Transcribing file {audio_path} as a single chunk because its duration is less than {threshold} seconds...")
-            full_transcript = stt.run(audio_path)
+            # a short file is only decoded here, unless the header had no duration
+            full_transcript = stt.model.stt(audio) if audio is not None else stt.run(audio_path)
 
         logging.debug("Transcription completed.")
         print(f"\nFull Transcription: \n{full_transcript}")
@@ -251,3 +232,4 @@ if __name__ == '__main__':
 
 # run:
 # python script_name.py path_to_audio_file.wav --language es
+# python script_name.py --language es --tune tuning_list.tsv --sample 50 --workers 8
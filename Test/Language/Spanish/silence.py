@@ -0,0 +1,123 @@
+import numpy as np
+
+# Silence detection on decoded int16 buffers, following the semantics of
+# pydub.silence (split_on_silence / detect_nonsilent) but computing every
+# window RMS at once from a cumulative energy prefix instead of slicing the
+# AudioSegment one millisecond at a time.
+
+MAX_POSSIBLE_AMPLITUDE = 2 ** 15  # 16-bit samples
+
+
+def ms_to_samples(ms, sample_rate):
+    # same rounding pydub uses when slicing an AudioSegment
+    return int(ms * sample_rate / 1000.0)
+
+
+def length_ms(audio, sample_rate):
+    # len() of the equivalent AudioSegment
+    return round(1000 * (len(audio) / sample_rate))
+
+
+def energy_prefix(audio):
+    """Cumulative sum of squared samples, prefix[k] is the energy of audio[:k]."""
+    prefix = np.zeros(len(audio) + 1, dtype=np.int64)
+    np.cumsum(np.square(audio, dtype=np.int64), out=prefix[1:])
+    return prefix
+
+
+def window_rms(prefix, sample_rate, starts_ms, window_ms):
+    """
+    RMS of every `window_ms` long window starting at `starts_ms`.
+
+    Windows are mapped to samples exactly like `AudioSegment[i:i + window_ms]`,
+    frames past the end of the buffer count as silence, and the result is
+    truncated to an integer as audioop.rms does.
+    """
+    total_samples = len(prefix) - 1
+    starts = (starts_ms * sample_rate / 1000.0).astype(np.int64)
+    ends = ((starts_ms + window_ms) * sample_rate / 1000.0).astype(np.int64)
+    energy = prefix[np.minimum(ends, total_samples)] - prefix[np.minimum(starts, total_samples)]
+    frames = np.maximum(ends - starts, 1)
+    return np.floor(np.sqrt(energy.astype(np.float64) / frames))
+
+
+def detect_silence(audio, sample_rate, min_silence_len=1000, silence_thresh=-16, seek_step=1, prefix=None):
+    """Returns the silent [start, end] ranges of `audio`, in milliseconds."""
+    seg_len = length_ms(audio, sample_rate)
+    if seg_len < min_silence_len:
+        return []
+    if prefix is None:
+        prefix = energy_prefix(audio)
+
+    threshold = (10 ** (silence_thresh / 20.0)) * MAX_POSSIBLE_AMPLITUDE
+    last_slice_start = seg_len - min_silence_len
+    slice_starts = np.arange(0, last_slice_start + 1, seek_step, dtype=np.int64)
+    if last_slice_start % seek_step:
+        slice_starts = np.append(slice_starts, last_slice_start)
+
+    rms = window_rms(prefix, sample_rate, slice_starts, min_silence_len)
+    silence_starts = slice_starts[rms <= threshold]
+    if len(silence_starts) == 0:
+        return []
+
+    # a new range starts where two silent windows neither touch nor overlap
+    gaps = np.diff(silence_starts)
+    breaks = np.flatnonzero((gaps != seek_step) & (gaps > min_silence_len))
+    range_starts = np.concatenate(([silence_starts[0]], silence_starts[breaks + 1]))
+    range_ends = np.concatenate((silence_starts[breaks], [silence_starts[-1]])) + min_silence_len
+    return [[int(start), int(end)] for start, end in zip(range_starts, range_ends)]
+
+
+def detect_nonsilent(audio, sample_rate, min_silence_len=1000, silence_thresh=-16, seek_step=1, prefix=None):
+    """Returns the non-silent [start, end] ranges of `audio`, in milliseconds."""
+    silent_ranges = detect_silence(audio, sample_rate, min_silence_len, silence_thresh, seek_step, prefix)
+    seg_len = length_ms(audio, sample_rate)
+
+    if not silent_ranges:
+        return [[0, seg_len]]
+    if silent_ranges[0][0] == 0 and silent_ranges[0][1] == seg_len:
+        return []
+
+    prev_end = 0
+    nonsilent_ranges = []
+    for start, end in silent_ranges:
+        nonsilent_ranges.append([prev_end, start])
+        prev_end = end
+    if end != seg_len:
+        nonsilent_ranges.append([prev_end, seg_len])
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
+    return nonsilent_ranges
+
+
+def pad_ranges(nonsilent_ranges, keep_silence, seg_len):
+    """keep_silence handling of pydub.silence.split_on_silence, on [start, end] ms ranges."""
+    if isinstance(keep_silence, bool):
+        keep_silence = seg_len if keep_silence else 0
+
+    output_ranges = [[start - keep_silence, end + keep_silence] for start, end in nonsilent_ranges]
+    for range_i, range_ii in zip(output_ranges, output_ranges[1:]):
+        last_end = range_i[1]
+        next_start = range_ii[0]
+        if next_start < last_end:
+            range_i[1] = (last_end + next_start) // 2
+            range_ii[0] = range_i[1]
+
+    return [[max(start, 0), min(end, seg_len)] for start, end in output_ranges]
+
+
+def silence_chunks(audio, sample_rate, min_silence_len=1000, silence_thresh=-16, keep_silence=100, seek_step=1, prefix=None):
+    """
+    Splits a decoded recording on silence without copying it into chunks.
+
+    :param audio: int16 numpy array, as returned by `audio_io.load_audio`.
+    :param sample_rate: (int) sample rate of `audio`.
+    :param min_silence_len: (int) minimum length of a silence to be used for a split, in ms.
+    :param silence_thresh: (int) the upper bound for what is considered silence, in dBFS.
+    :param keep_silence: (int) amount of silence to leave at the beginning and end of each chunk, in ms.
+    :param prefix: energy_prefix(audio), to reuse it across several calls on the same audio.
+    :return: List of (start, end) sample offsets, `audio[start:end]` is the chunk.
+    """
+    nonsilent_ranges = detect_nonsilent(audio, sample_rate, min_silence_len, silence_thresh, seek_step, prefix)
+    output_ranges = pad_ranges(nonsilent_ranges, keep_silence, length_ms(audio, sample_rate))
+    return [(ms_to_samples(start, sample_rate), ms_to_samples(end, sample_rate)) for start, end in output_ranges]
@@ -0,0 +1,119 @@
+import random
+import logging
+import itertools
+from multiprocessing import Pool
+
+import numpy as np
+
+from audio_io import load_audio
+from silence import energy_prefix, detect_nonsilent, pad_ranges, length_ms, ms_to_samples
+
+MIN_SILENCE_LENS = range(400, 1001, 200)
+SILENCE_THRESHS = range(-50, -20, 10)
+KEEP_SILENCES = range(100, 501, 100)
+
+
+def param_grid(min_silence_lens=MIN_SILENCE_LENS, silence_threshs=SILENCE_THRESHS, keep_silences=KEEP_SILENCES):
+    return list(itertools.product(min_silence_lens, silence_threshs, keep_silences))
+
+
+def sample_corpus(samples, sample_size=None, seed=0):
+    """Random subset of (audio_path, reference) pairs to tune on."""
+    samples = list(samples)
+    if sample_size is None or sample_size >= len(samples):
+        return samples
+    return random.Random(seed).sample(samples, sample_size)
+
+
+def boundary_sets(audio, sample_rate, grid):
+    """
+    Maps every distinct chunking of `audio` to the parameter sets that produce it.
+
+    The energy prefix is computed once for the file and the silence detection
+    once per (min_silence_len, silence_thresh): keep_silence only pads the
+    ranges, so it never needs another pass over the audio.
+    """
+    prefix = energy_prefix(audio)
+    seg_len = length_ms(audio, sample_rate)
+    nonsilent = {}
+    groups = {}
+    for min_silence_len, silence_thresh, keep_silence in grid:
+        key = (min_silence_len, silence_thresh)
+        if key not in nonsilent:
+            nonsilent[key] = detect_nonsilent(audio, sample_rate, min_silence_len, silence_thresh, prefix=prefix)
+        ranges = pad_ranges(nonsilent[key], keep_silence, seg_len)
+        chunks = tuple((ms_to_samples(start, sample_rate), ms_to_samples(end, sample_rate)) for start, end in ranges)
+        groups.setdefault(chunks, []).append((min_silence_len, silence_thresh, keep_silence))
+    return groups
+
+
+_worker_stt = None
+
+
+def _init_worker(stt_factory):
+    global _worker_stt
+    _worker_stt = stt_factory()
+
+
+def _transcribe_chunk(task):
+    key, chunk = task
+    return key, _worker_stt.model.stt(chunk)
+
+
+def transcribe_unique_chunks(stt, audio, chunk_keys, pool=None):
+    """Transcribes every (start, end) chunk of `audio` exactly once."""
+    # longest chunks first so that the pool does not wait on a straggler
+    chunk_keys = sorted(chunk_keys, key=lambda key: key[1] - key[0], reverse=True)
+    if pool is None:
+        return {key: stt.model.stt(audio[key[0]:key[1]]) for key in chunk_keys}
+
+    tasks = ((key, np.ascontiguousarray(audio[key[0]:key[1]])) for key in chunk_keys)
+    return dict(pool.imap_unordered(_transcribe_chunk, tasks, chunksize=4))
+
+
+def tune_silence_params(stt, samples, grid=None, workers=1, stt_factory=None, logger=logging):
+    """
+    Finds the silence parameters with the lowest weighted WER over `samples`.
+
+    The recordings are decoded and transcribed one at a time, only one of
+    them is in memory however many are sampled.
+
+    :param stt: loaded STT, used for scoring and for in-process transcription.
+    :param samples: list of (audio_path, reference) pairs, see `sample_corpus`.
+    :param grid: list of (min_silence_len, silence_thresh, keep_silence), `param_grid()` by default.
+    :param workers: (int) number of processes transcribing chunks.
+    :param stt_factory: picklable callable returning a loaded STT in each worker process.
+    :return: best parameters, their weighted WER and a dict with the WER of every parameter set.
+    """
+    grid = grid or param_grid()
+    sample_rate = stt.model.sampleRate()
+
+    errors = dict.fromkeys(grid, 0.0)
+    total_words = 0
+    # the workers load their model once and are shared by every file
+    pool = Pool(workers, initializer=_init_worker, initargs=(stt_factory,)) if workers > 1 and stt_factory is not None else None
+    try:
+        for audio_path, reference in samples:
+            audio = load_audio(audio_path, sample_rate)
+            groups = boundary_sets(audio, sample_rate, grid)
+            chunk_keys = {chunk for chunks in groups for chunk in chunks}
+            logger.info(f"{audio_path}: {len(groups)} distinct chunkings for {len(grid)} parameter sets, {len(chunk_keys)} distinct chunks")
+            transcriptions = transcribe_unique_chunks(stt, audio, chunk_keys, pool)
+            del audio
+
+            word_count = stt.compute_word_count(reference)
+            total_words += word_count
+            for chunks, params_list in groups.items():
+                hypothesis = ' '.join(transcriptions[chunk] for chunk in chunks)
+                wer = stt.compute_wer(reference, hypothesis)
+                for params in params_list:
+                    errors[params] += wer * word_count
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    wwers = {params: errors[params] / total_words if total_words else 0.0 for params in grid}
+    # first minimum in grid order, as the nested loops used to pick it
+    best_params = min(grid, key=lambda params: wwers[params])
+    return best_params, wwers[best_params], wwers
@@ -0,0 +1,65 @@
+import os
+import random
+import sys
+
+import jiwer
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'Language', 'Spanish'))
+
+from scoring import score  # noqa: E402
+from text_normalizer import TextNormalizer  # noqa: E402
+from wer_kernel import Vocabulary  # noqa: E402
+
+# S/D/I of `scoring.score` against jiwer's own alignment, for utterances on
+# both sides of 2000 words (the length where scoring used to switch engines)
+# and for a MintzAI-ST sized talk.
+
+
+def synthetic_pair(words, error_rate=0.2, seed=0):
+    """Reference of `words` words from a small vocabulary, so that many alignments tie, and a noisy hypothesis."""
+    rng = random.Random(seed)
+    vocabulary = [f'word{i}' for i in range(50)]
+    reference = [rng.choice(vocabulary) for _ in range(words)]
+    hypothesis = []
+    for word in reference:
+        edit = rng.random()
+        if edit < error_rate / 3:
+            hypothesis.append(rng.choice(vocabulary))
+        elif edit < 2 * error_rate / 3:
+            continue
+        elif edit < error_rate:
+            hypothesis.extend([word, rng.choice(vocabulary)])
+        else:
+            hypothesis.append(word)
+    return ' '.join(reference), ' '.join(hypothesis)
+
+
+@pytest.mark.parametrize('words', [10, 500, 1999, 2000, 2001, 5000, 8000])
+def test_edits_are_jiwer(words):
+    transformation = TextNormalizer()
+    for seed in range(3):
+        reference, hypothesis = synthetic_pair(words, seed=seed)
+        result = score(transformation, reference, hypothesis)
+        expected = jiwer.process_words(reference, hypothesis)
+        assert result.edits == (expected.substitutions, expected.deletions, expected.insertions)
+        assert result.words == words
+        assert result.errors == sum(result.edits)
+        assert result.wer == pytest.approx(expected.wer)
+
+
+def test_empty_reference():
+    result = score(TextNormalizer(), '', 'hello there')
+    assert result.edits == (0, 0, 2)
+    assert result.words == 0
+
+
+@pytest.mark.parametrize('error_rate', [0.0, 0.2])
+def test_rescoring_kernel_is_jiwer(error_rate):
+    # --rescore-only: errors from wer_kernel, jiwer only for the splits the lengths do not force
+    transformation = TextNormalizer()
+    vocabulary = Vocabulary()
+    pairs = [synthetic_pair(words, error_rate, seed) for words in (1, 5, 40, 100, 2500) for seed in range(5)]
+    pairs += [('uno dos tres', 'uno dos'), ('uno dos', 'uno dos tres cuatro'), ('uno dos', ''), ('', 'uno')]
+    for reference, hypothesis in pairs:
+        assert score(transformation, reference, hypothesis, vocabulary) == score(transformation, reference, hypothesis)
@@ -0,0 +1,190 @@
+import re
+from itertools import chain
+
+import numpy as np
+
+# Word level edit distance of many utterances per call, for rescoring sweeps
+# over cached hypotheses. Words are interned into integer ids of a shared
+# vocabulary and the distance is the bit-parallel algorithm of Myers (1999) in
+# the formulation of Hyyrö (2003): a column of the DP matrix is two bit
+# vectors over the reference words, updated with a few integer operations per
+# hypothesis word. References of up to 64 words run in NumPy with one uint64
+# lane per utterance, longer ones with Python ints.
+#
+# The distance is S + D + I of any optimal alignment, so errors, words and WER
+# are those of jiwer. How the errors split into S, D and I depends on how the
+# alignment breaks ties, `scoring.score` gives jiwer's split.
+
+LANE_BITS = 64
+DEFAULT_CHUNK_SIZE = 8192
+
+
+def split_words(sentence):
+    # the words of jiwer's default transform (RemoveMultipleSpaces, Strip, ReduceToListOfListOfWords)
+    return [word for word in re.sub(r"\s\s+", " ", sentence).strip().split(" ") if word]
+
+
+class Vocabulary:
+    """Interns words into consecutive integer ids."""
+
+    def __init__(self):
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def word_ids(self, sentence):
+        """Ids of the words of one normalized string, without NumPy: for scoring one utterance at a time."""
+        ids = self.ids
+        words = sentence.split() if sentence.isprintable() else split_words(sentence)
+        return [ids.setdefault(word, len(ids)) for word in words]
+
+    def encode(self, sentences):
+        """
+        :param sentences: list of normalized strings.
+        :return: ids of all their words concatenated, and the number of words of each sentence.
+        """
+        text = ' '.join(sentences)
+        if text.isprintable():
+            # the only whitespace is the ASCII space, str.split gives the same words as jiwer
+            words = text.split()
+            lengths = np.fromiter(map(len, map(str.split, sentences)), np.int64, len(sentences))
+        else:
+            split = [split_words(sentence) for sentence in sentences]
+            words = list(chain.from_iterable(split))
+            lengths = np.fromiter(map(len, split), np.int64, len(split))
+        ids = self.ids
+        for word in dict.fromkeys(words):
+            if word not in ids:
+                ids[word] = len(ids)
+        return np.fromiter(map(ids.__getitem__, words), np.int64, len(words)), lengths
+
+
+def edit_distance(reference, hypothesis):
+    """Levenshtein distance between two id sequences, with Python ints as bit vectors of any length."""
+    m = len(reference)
+    if m == 0:
+        return len(hypothesis)
+    peq = {}
+    for i, word in enumerate(reference):
+        peq[word] = peq.get(word, 0) | (1 << i)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    vp, vn, distance = mask, 0, m
+    for word in hypothesis:
+        eq = peq.get(word, 0)
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        hp = vn | (~(xh | vp) & mask)
+        hn = vp & xh
+        if hp & last:
+            distance += 1
+        elif hn & last:
+            distance -= 1
+        hp = (hp << 1) | 1
+        hn = hn << 1
+        vp = (hn | ~(xv | hp)) & mask
+        vn = hp & xv
+    return distance
+
+
+def gather(ids, offsets, lengths):
+    # the sequences starting at `offsets`, concatenated in this order
+    starts = np.cumsum(lengths) - lengths
+    return ids[np.repeat(offsets - starts, lengths) + np.arange(lengths.sum())]
+
+
+def lane_distances(ref_ids, ref_lengths, hyp_ids, hyp_lengths):
+    """
+    Distances of pairs whose references have 1 to 64 words, one uint64 lane each.
+
+    :param ref_ids: concatenated reference ids, `ref_lengths` words per lane.
+    :param hyp_ids: concatenated hypothesis ids, `hyp_lengths` words per lane,
+        sorted by increasing length.
+    """
+    n = len(ref_lengths)
+    stride = int(max(ref_ids.max(), hyp_ids.max(initial=0))) + 1
+
+    # peq: for every (lane, word) of the references, the bit mask of its positions
+    lanes = np.repeat(np.arange(n), ref_lengths)
+    positions = np.arange(len(ref_ids)) - np.repeat(np.cumsum(ref_lengths) - ref_lengths, ref_lengths)
+    keys = lanes * stride + ref_ids
+    order = np.argsort(keys, kind='stable')
+    keys, first = np.unique(keys[order], return_index=True)
+    masks = np.bitwise_or.reduceat(np.left_shift(np.uint64(1), positions[order].astype(np.uint64)), first)
+
+    # eq of every hypothesis word, 0 for words not in the reference
+    width = int(hyp_lengths[-1])
+    eq = np.zeros((width, n), np.uint64)
+    hyp_lanes = np.repeat(np.arange(n), hyp_lengths)
+    columns = np.arange(len(hyp_ids)) - np.repeat(np.cumsum(hyp_lengths) - hyp_lengths, hyp_lengths)
+    hyp_keys = hyp_lanes * stride + hyp_ids
+    found = np.minimum(np.searchsorted(keys, hyp_keys), len(keys) - 1)
+    eq[columns, hyp_lanes] = np.where(keys[found] == hyp_keys, masks[found], np.uint64(0))
+
+    one = np.uint64(1)
+    mask = np.uint64(np.iinfo(np.uint64).max) >> (LANE_BITS - ref_lengths).astype(np.uint64)
+    last = np.left_shift(one, (ref_lengths - 1).astype(np.uint64))
+    vp = mask.copy()
+    vn = np.zeros(n, np.uint64)
+    distance = ref_lengths.copy()
+    for j in range(width):
+        # lanes are sorted by hypothesis length, the ones still running are a suffix
+        start = np.searchsorted(hyp_lengths, j, side='right')
+        e, p, v, k = eq[j, start:], vp[start:], vn[start:], last[start:]
+        xv = e | v
+        xh = (((e & p) + p) ^ p) | e
+        hp = v | ~(xh | p)
+        hn = p & xh
+        distance[start:] += ((hp & k) != 0).astype(np.int64) - ((hn & k) != 0).astype(np.int64)
+        hp = (hp << one) | one
+        hn = hn << one
+        vp[start:] = (hn | ~(xv | hp)) & mask[start:]
+        vn[start:] = hp & xv
+    return distance
+
+
+def distances(ref_ids, ref_lengths, hyp_ids, hyp_lengths, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Word edit distances of many pairs, as returned by `Vocabulary.encode`.
+
+    :param chunk_size: (int) lanes per NumPy pass, bounds the eq matrix.
+    :return: int64 array, one distance per pair.
+    """
+    if len(ref_lengths) != len(hyp_lengths):
+        raise ValueError(f'{len(ref_lengths)} references and {len(hyp_lengths)} hypotheses')
+    ref_offsets = np.cumsum(ref_lengths) - ref_lengths
+    hyp_offsets = np.cumsum(hyp_lengths) - hyp_lengths
+    result = hyp_lengths.copy()  # the distance to an empty reference
+
+    for i in np.flatnonzero(ref_lengths > LANE_BITS):
+        result[i] = edit_distance(ref_ids[ref_offsets[i]:ref_offsets[i] + ref_lengths[i]].tolist(),
+                                  hyp_ids[hyp_offsets[i]:hyp_offsets[i] + hyp_lengths[i]].tolist())
+
+    lanes = np.flatnonzero((ref_lengths > 0) & (ref_lengths <= LANE_BITS))
+    # similar hypothesis lengths in a chunk keep the padding short
+    lanes = lanes[np.argsort(hyp_lengths[lanes], kind='stable')]
+    for start in range(0, len(lanes), chunk_size):
+        chunk = lanes[start:start + chunk_size]
+        result[chunk] = lane_distances(gather(ref_ids, ref_offsets[chunk], ref_lengths[chunk]), ref_lengths[chunk],
+                                       gather(hyp_ids, hyp_offsets[chunk], hyp_lengths[chunk]), hyp_lengths[chunk])
+    return result
+
+
+def score_batch(references, hypotheses, vocabulary=None):
+    """
+    Errors, reference words and WER of many utterances.
+
+    :param references: normalized reference strings.
+    :param hypotheses: normalized hypothesis strings, in the same order.
+    :param vocabulary: `Vocabulary` to reuse across calls, e.g. in a sweep
+        over the same references.
+    :return: (errors, words, wer) arrays. As in jiwer, the WER of an empty
+        reference is the number of inserted words.
+    """
+    vocabulary = vocabulary if vocabulary is not None else Vocabulary()
+    ref_ids, words = vocabulary.encode(references)
+    hyp_ids, hyp_lengths = vocabulary.encode(hypotheses)
+    errors = distances(ref_ids, words, hyp_ids, hyp_lengths)
+    wer = np.where(words > 0, errors / np.maximum(words, 1), errors).astype(np.float64)
+    return errors, words, wer